@@ -36,6 +36,53 @@ def check_cuda_version():
     except ImportError:
         print("cupy: Chưa cài đặt")
 
+def check_result_cache():
+    """Vân tay của DataFrame/Series chưa gắn nhãn phải tính được và ổn định"""
+    try:
+        import pandas as pd
+        from modules.result_cache import fingerprint
+        frame = pd.DataFrame({'trip_id': [1, 1, 2], 'latitude': [10.7, 10.8, 10.9]})
+        series = frame['latitude'].copy()
+        assert fingerprint(frame) == fingerprint(frame.copy())
+        assert fingerprint(series) == fingerprint(series.copy())
+        assert fingerprint(frame) != fingerprint(frame.assign(latitude=0.0))
+        print("Vân tay DataFrame/Series: OK")
+    except Exception as e:
+        print(f"Lỗi kiểm tra cache kết quả: {e!r}")
+
+def check_graph_store_merge():
+    """Gộp lại cùng một file qua CLI hay qua ``read_gps`` không được tăng phiên bản snapshot"""
+    try:
+        import contextlib
+        import io
+        import os
+        import tempfile
+        import pandas as pd
+        from modules.gps_store import read_gps
+        from modules.graph_store import load_graph_snapshot, main, merge_into_snapshot
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "gps.csv")
+            pd.DataFrame({
+                'trip_id': [1, 1, 1, 2, 2],
+                'timestamp': pd.date_range("2024-01-01", periods=5, freq="min"),
+                'latitude': [10.80, 10.81, 10.82, 10.80, 10.79],
+                'longitude': [106.80, 106.81, 106.82, 106.80, 106.79],
+                'simulated_speed_kmh': [30.0, 31.0, 32.0, 20.0, 21.0],
+            }).to_csv(csv_path, index=False)
+            for order in ("cli", "app"), ("app", "cli"):
+                path = os.path.join(tmp_dir, f"snapshot-{order[0]}")
+                for via in order + order:
+                    if via == "cli":
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            main([csv_path, "--output", path])
+                    else:
+                        merge_into_snapshot(read_gps(csv_path), path)
+                version = load_graph_snapshot(path).version
+                assert version == 1, f"{' -> '.join(order)}: phiên bản {version}"
+        print("Gộp snapshot đồ thị (CLI và ứng dụng): OK")
+    except Exception as e:
+        print(f"Lỗi kiểm tra snapshot đồ thị: {e!r}")
+
 if __name__ == "__main__":
     print("=== Kiểm tra GPU ===")
     check_gpu()
@@ -44,3 +91,7 @@ if __name__ == "__main__":
     print("\n=== Kiểm tra phiên bản RAPIDS ===")
     for lib in ["cudf", "cuml", "cugraph", "cuspatial", "cupy", "rmm"]:
         check_module_version(lib)
+    print("\n=== Kiểm tra cache kết quả ===")
+    check_result_cache()
+    print("\n=== Kiểm tra snapshot đồ thị ===")
+    check_graph_store_merge()
@@ -1,7 +1,15 @@
 import streamlit as st
 import pydeck as pdk
-from modules.bus_route_analysis import analyze_bus_routes, get_route_summary
+import numpy as np
+from modules.bus_route_analysis import (
+    analyze_bus_routes, analyze_district_traversals, get_district_dwell_summary, get_route_summary,
+    get_trip_district_sequences,
+)
+from modules.map_utils import path_records
+from modules.od_cube import build_od_cube
+from modules.instrumentation import instrument
 
+@instrument()
 def render_bus_route_analysis_tab(gps_data, districts, layers, deck):
     """Render tab phân tích tuyến xe buýt"""
     st.subheader("Phân tích tuyến xe buýt")
@@ -19,6 +27,9 @@ def render_bus_route_analysis_tab(gps_data, districts, layers, deck):
     st.subheader("Thống kê tuyến xe buýt theo quận")
     st.dataframe(route_summary)
     
+    _render_od_flows(gps_data, districts)
+    _render_district_traversals(gps_data, districts)
+    
     # Hiển thị chi tiết từng tuyến
     st.subheader("Chi tiết các tuyến xe buýt")
     st.dataframe(route_analysis)
@@ -27,16 +38,16 @@ def render_bus_route_analysis_tab(gps_data, districts, layers, deck):
     st.subheader("Bản đồ các tuyến xe buýt")
     
     # Tạo layer cho các tuyến xe buýt
-    bus_routes = []
-    # Convert cuDF DataFrame to pandas before iteration
-    route_analysis_pd = route_analysis.to_pandas()
-    for _, row in route_analysis_pd.iterrows():
-        bus_routes.append({
-            'trip_id': str(row['trip_id']),
-            'path': [[row['start_lon'], row['start_lat']], [row['end_lon'], row['end_lat']]],
-            'start_district': row['start_district'],
-            'end_district': row['end_district']
-        })
+    # Convert cuDF DataFrame to pandas before building the layer
+    route_analysis_pd = route_analysis.to_pandas() if hasattr(route_analysis, "to_pandas") else route_analysis
+    # Mỗi tuyến là đoạn thẳng (điểm đầu -> điểm cuối), dựng trực tiếp từ các cột
+    positions = route_analysis_pd[['start_lon', 'start_lat', 'end_lon', 'end_lat']].to_numpy()
+    bus_routes = path_records(
+        positions.reshape(-1, 2), np.arange(0, 2 * len(positions) + 1, 2),
+        trip_id=route_analysis_pd['trip_id'].astype(str),
+        start_district=route_analysis_pd['start_district'],
+        end_district=route_analysis_pd['end_district']
+    )
     
     # Tạo layer cho các tuyến xe buýt
     bus_route_layer = pdk.Layer(
@@ -55,4 +66,54 @@ def render_bus_route_analysis_tab(gps_data, districts, layers, deck):
     
     # Cập nhật bản đồ
     deck.layers = layers
-    st.pydeck_chart(deck) 
\ No newline at end of file
+    st.pydeck_chart(deck)
+
+def _render_od_flows(gps_data, districts):
+    """Luồng OD có hướng theo quận và khung giờ, truy vấn từ khối OD đã tính sẵn"""
+    st.subheader("Luồng OD theo quận và khung giờ")
+    col1, col2, col3 = st.columns(3)
+    kind = col1.radio(
+        "Loại luồng", ['trip', 'transition'],
+        format_func=lambda k: {'trip': "Điểm đầu → điểm cuối chuyến", 'transition': "Chuyển quận trong chuyến"}[k]
+    )
+    direction = col2.radio("Hướng", ['out', 'in'], format_func=lambda d: {'out': "Đi ra", 'in': "Đi vào"}[d])
+    hours = col3.slider("Khung giờ", 0, 24, (7, 9))
+    
+    with st.spinner("Đang tạo khối OD..."):
+        cube = build_od_cube(gps_data, 'district', kind, districts)
+    if len(cube.zones) == 0:
+        st.info("Không có luồng nào.")
+        return
+    zone = st.selectbox("Quận", cube.zones)
+    
+    flows = cube.outflows(zone, hours) if direction == 'out' else cube.inflows(zone, hours)
+    counterpart = 'destination' if direction == 'out' else 'origin'
+    table = (
+        flows.groupby(counterpart, sort=False)['flow'].sum()
+        .sort_values(ascending=False).rename("Số luồng").rename_axis("Quận đến" if direction == 'out' else "Quận đi")
+    )
+    st.write(f"Tổng số luồng {'đi ra từ' if direction == 'out' else 'đi vào'} {zone} từ {hours[0]}h tới {hours[1]}h: {int(table.sum())}")
+    st.dataframe(table)
+    st.bar_chart(cube.hourly_totals(zone, direction).rename_axis("Giờ"))
+
+
+def _render_district_traversals(gps_data, districts):
+    """Các quận mỗi chuyến đi qua và thời gian lưu lại ở từng quận (tính trên mọi điểm GPS)"""
+    st.subheader("Hành trình qua các quận và thời gian lưu lại")
+    with st.spinner("Đang tra quận cho toàn bộ điểm GPS..."):
+        traversals = analyze_district_traversals(gps_data, districts)
+    if len(traversals) == 0:
+        st.info("Không có điểm GPS nào.")
+        return
+    
+    dwell = get_district_dwell_summary(traversals)
+    st.write("Thời gian lưu lại theo quận (giây)")
+    st.dataframe(dwell)
+    st.bar_chart(dwell.set_index('district')['total_dwell_s'].rename("Tổng thời gian lưu lại (s)"))
+    
+    sequences = get_trip_district_sequences(traversals)
+    st.write(f"Số chuyến đi qua từ 2 quận trở lên: {int((sequences['n_districts'] > 1).sum())}/{len(sequences)}")
+    st.dataframe(sequences.sort_values('n_changes', ascending=False))
+    
+    trip_id = st.selectbox("Chi tiết chuyến", sequences['trip_id'])
+    st.dataframe(traversals[traversals['trip_id'] == trip_id])
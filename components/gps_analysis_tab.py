@@ -1,6 +1,12 @@
 import streamlit as st
-from modules.gps_analysis import calculate_trip_metrics_cudf
+from modules.gps_analysis import calculate_trip_metrics
+from modules.result_cache import persistent_cache
+from modules.instrumentation import instrument
 
+# Kết quả được cache theo nội dung file, dùng lại giữa các lần rerun
+cached_trip_metrics = persistent_cache()(calculate_trip_metrics)
+
+@instrument()
 def render_gps_analysis_tab(gps_data, file_path):
     """Render tab phân tích GPS"""
     # Sidebar controls for GPS analysis
@@ -9,7 +15,8 @@ def render_gps_analysis_tab(gps_data, file_path):
     
     # Tính toán và hiển thị các chỉ số của chuyến đi
     st.subheader("Phân tích chuyến đi")
-    trip_metrics, _ = calculate_trip_metrics_cudf(file_path)
+    trip_metrics, _ = cached_trip_metrics(file_path)
+    st.caption(f"Engine: {trip_metrics.attrs.get('engine')}")
     st.dataframe(trip_metrics)
     
     # Hiển thị biểu đồ tốc độ trung bình
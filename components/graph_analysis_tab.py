@@ -1,37 +1,84 @@
 import streamlit as st
-import cugraph
-import cudf
-import numpy as np
 import pandas as pd
-import cuml
-import geopandas as gpd
-from shapely.geometry import Point
+from modules.graph_analysis import (
+    DEFAULT_BETWEENNESS_SAMPLES, GRAPH_BACKENDS, analyze_movement_patterns, get_top_areas, select_graph_backend
+)
+from modules.graph_nodes import DEFAULT_CELL_SIZE_M, DEFAULT_NODE_METHOD, NODE_ASSIGNERS
+from modules.graph_store import load_graph_snapshot, merge_into_snapshot, snapshot_path
+from modules.instrumentation import instrument
 
+@instrument()
 def render_graph_analysis_tab(gps_data):
     """Render tab phân tích đồ thị"""
     st.sidebar.subheader("Phân tích đồ thị")
     show_pagerank = st.sidebar.checkbox("Hiển thị PageRank", value=True)
     show_communities = st.sidebar.checkbox("Hiển thị cộng đồng", value=True)
     show_centrality = st.sidebar.checkbox("Hiển thị độ trung tâm", value=True)
+    betweenness_params = {}
+    if show_centrality and st.sidebar.checkbox("Betweenness ước lượng (lấy mẫu)", value=True):
+        betweenness_params['k'] = st.sidebar.select_slider(
+            "Số đỉnh nguồn lấy mẫu", [64, 128, 256, 512, 1024, 2048], value=DEFAULT_BETWEENNESS_SAMPLES
+        )
+        target_error = st.sidebar.slider("Sai số tương đối mục tiêu top-5 (%)", 0, 50, 0, help="0 = không tự tăng số mẫu")
+        if target_error:
+            betweenness_params['target_error'] = target_error / 100
+    # DBSCAN chỉ có khi cài cuML hoặc scikit-learn; mặc định như DEFAULT_NODE_METHOD
+    methods = sorted(NODE_ASSIGNERS, key=lambda m: m != 'grid')
+    method = st.sidebar.selectbox(
+        "Cách tạo nút",
+        methods,
+        index=methods.index(DEFAULT_NODE_METHOD),
+        format_func=lambda m: {'grid': "Lưới ô vuông (CPU, O(N))", 'dbscan': "DBSCAN"}.get(m, m)
+    )
+    graph_source = gps_data
+    if method == 'grid':
+        node_params = {'cell_size_m': st.sidebar.select_slider("Kích thước ô (m)", [25, 50, 100, 200, 500, 1000], value=DEFAULT_CELL_SIZE_M)}
+        # Snapshot lịch sử: mã ô ổn định nên dữ liệu mới được gộp dần vào đồ thị đã lưu
+        path = snapshot_path(node_params['cell_size_m'])
+        if st.sidebar.button("Gộp dữ liệu hiện tại vào snapshot"):
+            with st.spinner("Đang gộp vào snapshot đồ thị..."):
+                merged = merge_into_snapshot(gps_data, path, node_params['cell_size_m'])
+            st.sidebar.success(f"Snapshot phiên bản {merged.version}: {merged.n_nodes} nút")
+        snapshot = load_graph_snapshot(path)
+        if snapshot is not None and st.sidebar.checkbox(f"Phân tích snapshot lịch sử (phiên bản {snapshot.version})"):
+            graph_source = snapshot
+    else:
+        node_params = {
+            'eps': st.sidebar.number_input("eps (DBSCAN)", min_value=0.0001, max_value=0.1, value=0.001, step=0.0005, format="%.4f"),
+            'min_samples': st.sidebar.slider("min_samples (DBSCAN)", 1, 20, 2),
+        }
+    
+    backends = sorted(GRAPH_BACKENDS)
+    backend = st.sidebar.selectbox(
+        "Backend đồ thị", backends, index=backends.index(select_graph_backend()),
+        format_func=lambda b: {'cugraph': "cuGraph (GPU)", 'cpu': "SciPy CSR (CPU)"}.get(b, b)
+    )
+    
+    st.subheader(f"Phân tích mẫu di chuyển ({'cuGraph' if backend == 'cugraph' else 'CPU'})")
     
-    st.subheader("Phân tích mẫu di chuyển với cuGraph")
+    # Phiên đồ thị: mỗi độ đo chỉ được tính khi panel tương ứng được bật
+    session = analyze_movement_patterns(graph_source, method, backend, **node_params)
+    with st.spinner("Đang tạo đồ thị di chuyển..."):
+        stats = session.stats
     
-    with st.spinner("Đang phân tích mẫu di chuyển..."):
-        results = analyze_movement_patterns(gps_data)
+    for line in stats:
+        st.write(line)
     
-    if results is None:
-        st.error("Không thể phân tích mẫu di chuyển. Vui lòng kiểm tra dữ liệu hoặc tham số (thử giảm eps trong DBSCAN).")
+    if not session.has_edges:
+        st.warning(f"Không tạo được cạnh nào. Nguyên nhân có thể: 1) Chỉ có một cụm duy nhất, thử giảm eps hoặc kích thước ô (hiện tại {node_params}); 2) Không có chuyển động giữa các cụm; 3) Dữ liệu không thay đổi tọa độ giữa các điểm liên tiếp.")
+        st.error("Không thể phân tích mẫu di chuyển. Vui lòng kiểm tra dữ liệu hoặc tham số (thử giảm eps trong DBSCAN hoặc kích thước ô lưới).")
         return
     
     if show_pagerank:
         st.subheader("Top 5 khu vực có ảnh hưởng lớn (PageRank)")
-        top_pagerank = get_top_areas(results, 'pagerank')
+        with st.spinner("Đang tính PageRank..."):
+            top_pagerank = get_top_areas(session, 'pagerank')
         st.dataframe(top_pagerank)
     
     if show_communities:
         st.subheader("Phát hiện cộng đồng")
-        communities = results['communities'].to_pandas()
-        modularity = results['modularity']
+        with st.spinner("Đang phát hiện cộng đồng..."):
+            communities, modularity = session.communities
         st.write(f"Số lượng cộng đồng phát hiện được: {communities['community_id'].nunique()}")
         st.write(f"Modularity score: {modularity:.4f}")
         st.dataframe(communities)
@@ -42,124 +89,33 @@ def render_graph_analysis_tab(gps_data):
         with col1:
             st.write("Độ trung tâm giữa (Betweenness Centrality)")
             st.write("Đo lường mức độ quan trọng của một khu vực dựa trên số lượng đường đi ngắn nhất đi qua nó")
-            top_betweenness = get_top_areas(results, 'betweenness')
+            with st.spinner("Đang tính betweenness..."):
+                betweenness = session.metric('betweenness', **betweenness_params)
+                top_betweenness = get_top_areas(session, 'betweenness', **betweenness_params)
             st.dataframe(top_betweenness)
+            if betweenness.attrs.get('exact') is False:
+                st.caption(
+                    f"Ước lượng từ {betweenness.attrs['sample_size']} đỉnh nguồn ({betweenness.attrs['replicates']} nhóm): "
+                    f"sai số tương đối top-5 ≈ {betweenness.attrs['relative_error']:.1%}, "
+                    f"độ ổn định top-5 (bootstrap) {betweenness.attrs['top_n_overlap']:.0%}."
+                )
         
         with col2:
             st.write("Độ trung tâm eigenvector")
             st.write("Đo lường tầm quan trọng của một khu vực dựa trên tầm quan trọng của các khu vực kết nối với nó")
-            top_eigenvector = get_top_areas(results, 'eigenvector')
+            with st.spinner("Đang tính eigenvector..."):
+                top_eigenvector = get_top_areas(session, 'eigenvector')
             st.dataframe(top_eigenvector)
         
         st.write("PageRank")
         st.write("Đo lường tầm quan trọng của một khu vực dựa trên xác suất một người ngẫu nhiên sẽ đến thăm khu vực đó")
-        top_pagerank = get_top_areas(results, 'pagerank')
-        st.dataframe(top_pagerank)
-
-def create_movement_graph(gps_data, eps=0.001, min_samples=2):
-    """Tạo đồ thị di chuyển từ dữ liệu GPS"""
-    st.write(f"Số điểm GPS: {len(gps_data)}")
-    st.write(f"Số chuyến đi: {gps_data['trip_id'].nunique()}")
-    
-    # Tạo GeoDataFrame
-    geometry = [Point(xy) for xy in zip(gps_data['longitude'], gps_data['latitude'])]
-    gdf = gpd.GeoDataFrame(gps_data, geometry=geometry, crs="EPSG:4326")
-    
-    # Sử dụng cuml.DBSCAN
-    coords = np.column_stack((gdf.geometry.x, gdf.geometry.y))
-    coords_cudf = cudf.DataFrame(coords, columns=['longitude', 'latitude'])
-    
-    clustering = cuml.DBSCAN(eps=eps, min_samples=min_samples).fit(coords_cudf)
-    gdf['cluster'] = clustering.labels_.values_host
-    
-    # Thống kê số cụm
-    unique_clusters = np.unique(clustering.labels_)
-    num_clusters = len(unique_clusters) - (1 if -1 in unique_clusters else 0)  # Trừ nhiễu
-    st.write(f"Số cụm được phát hiện: {num_clusters}")
-    st.write(f"Số điểm nhiễu: {(clustering.labels_ == -1).sum()}")
-      
-    # Tạo cạnh
-    edges = []
-    for trip_id in gps_data['trip_id'].unique():
-        trip_data = gdf[gdf['trip_id'] == trip_id].sort_values('timestamp')
-        if len(trip_data) > 1:
-            for i in range(len(trip_data) - 1):
-                source = trip_data.iloc[i]['cluster']
-                target = trip_data.iloc[i + 1]['cluster']
-                if source != -1 and target != -1:  # Bỏ qua điểm nhiễu
-                    edges.append({
-                        'source': int(source),
-                        'target': int(target),
-                        'weight': 1
-                    })
-    
-    if not edges:
-        st.warning("Không tạo được cạnh nào. Nguyên nhân có thể: 1) Chỉ có một cụm duy nhất, thử giảm eps (hiện tại eps=0.001); 2) Không có chuyển động giữa các cụm; 3) Dữ liệu không thay đổi tọa độ giữa các điểm liên tiếp.")
-        return None, gdf
+        # Dùng lại PageRank đã tính (nếu có), không tính lại
+        st.dataframe(get_top_areas(session, 'pagerank'))
     
-    st.write(f"Số cạnh được tạo: {len(edges)}")
-    st.write(f"Số nút duy nhất: {len(set([e['source'] for e in edges] + [e['target'] for e in edges]))}")
-    
-    edges_df = cudf.DataFrame(edges)
-    G = cugraph.Graph(directed=False)
-    G.from_cudf_edgelist(edges_df, source='source', destination='target', edge_attr='weight', store_transposed=True)
-    return G, gdf
-
-def calculate_pagerank(G):
-    if G is None or G.number_of_vertices() == 0:
-        return cudf.DataFrame({'vertex': [], 'pagerank': []})
-    pagerank = cugraph.pagerank(G)
-    return pagerank
-
-def detect_communities(G):
-    if G is None or G.number_of_vertices() == 0:
-        return cudf.DataFrame({'node_id': [], 'community_id': []}), 0.0
-    communities = cugraph.louvain(G)  # Trả về tuple (DataFrame, modularity)
-    communities_df = communities[0]  # Trích xuất DataFrame
-    communities_df = communities_df.rename(columns={'vertex': 'node_id', 'partition': 'community_id'})
-    modularity = communities[1] if len(communities) > 1 else 0.0
-    return communities_df, modularity
-
-def calculate_centrality(G):
-    if G is None or G.number_of_vertices() == 0:
-        return {
-            'betweenness': cudf.DataFrame({'vertex': [], 'betweenness_centrality': []}),
-            'eigenvector': cudf.DataFrame({'vertex': [], 'eigenvector_centrality': []}),
-            'pagerank': cudf.DataFrame({'vertex': [], 'pagerank': []})
-        }
-    betweenness = cugraph.betweenness_centrality(G)
-    eigenvector = cugraph.eigenvector_centrality(G)
-    pagerank = cugraph.pagerank(G)
-    return {'betweenness': betweenness, 'eigenvector': eigenvector, 'pagerank': pagerank}
-
-def analyze_movement_patterns(gps_data):
-    G, gdf = create_movement_graph(gps_data)
-    if G is None:
-        return None
-    
-    pagerank = calculate_pagerank(G)
-    communities, modularity = detect_communities(G)
-    centrality = calculate_centrality(G)
-    
-    results = {
-        'pagerank': pagerank,
-        'communities': communities,
-        'modularity': modularity,
-        'centrality': centrality,
-        'graph': G,
-        'gdf': gdf
-    }
-    return results
-
-def get_top_areas(results, metric='pagerank', top_n=5):
-    if results is None:
-        return pd.DataFrame()
-    if metric == 'pagerank':
-        df = results['pagerank'].to_pandas()
-        return df.nlargest(top_n, 'pagerank') if not df.empty else pd.DataFrame()
-    elif metric == 'betweenness':
-        df = results['centrality']['betweenness'].to_pandas()
-        return df.nlargest(top_n, 'betweenness_centrality') if not df.empty else pd.DataFrame()
-    elif metric == 'eigenvector':
-        df = results['centrality']['eigenvector'].to_pandas()
-        return df.nlargest(top_n, 'eigenvector_centrality') if not df.empty else pd.DataFrame()
\ No newline at end of file
+    if session.timings:
+        with st.expander("Thời gian tính (giây, không gồm kết quả lấy từ cache)"):
+            labels = [
+                key if isinstance(key, str) else key[0] + "".join(f", {p}={v}" for p, v in key[1])
+                for key in session.timings
+            ]
+            st.dataframe(pd.Series(list(session.timings.values()), index=labels, name="Giây").to_frame(), use_container_width=True)
@@ -0,0 +1,67 @@
+import time
+
+import streamlit as st
+import pandas as pd
+import pydeck as pdk
+from modules.live_ingest import LIVE_STATE_PATH, load_live_snapshot
+from modules.map_utils import compact_point_frame, create_district_layer
+from modules.instrumentation import instrument
+
+# Chu kỳ làm mới phần hiển thị trực tiếp (giây); chỉ fragment này chạy lại
+LIVE_REFRESH_S = 0.5
+
+@st.fragment(run_every=LIVE_REFRESH_S)
+def _render_live_view(district_layer, view_state, state_path):
+    snapshot = load_live_snapshot(state_path)
+    if snapshot is None:
+        st.info(
+            "Chưa có dữ liệu trực tiếp. Chạy `python -m modules.live_ingest --listen 127.0.0.1:9999` "
+            "và phát lại dữ liệu bằng `python -m modules.live_replay data/fake_hcmc_road_gps_data.csv "
+            "--connect 127.0.0.1:9999`."
+        )
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Xe đang hoạt động", snapshot['active_vehicles'])
+    col2.metric("Điểm đã nhận", f"{snapshot['records_total']:,}")
+    col3.metric("Độ trễ snapshot", f"{time.time() - snapshot['updated_at']:.1f} s")
+    st.caption(
+        f"Cửa sổ {snapshot['window_s'] // 60} phút tới "
+        f"{pd.Timestamp(snapshot['watermark'], unit='s'):%Y-%m-%d %H:%M:%S}; "
+        f"{snapshot['late_records']} điểm đến trễ bị bỏ qua."
+    )
+
+    vehicles = pd.DataFrame(snapshot['vehicles'])
+    if vehicles.empty:
+        return
+
+    vehicle_layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=compact_point_frame(vehicles, ['trip_id', 'speed_kmh', 'district']),
+        get_position=['longitude', 'latitude'],
+        get_fill_color=[0, 128, 255, 200],
+        get_radius=60,
+        pickable=True,
+    )
+    st.pydeck_chart(pdk.Deck(
+        layers=[district_layer, vehicle_layer],
+        initial_view_state=view_state,
+        tooltip={"text": "Chuyến {trip_id}\n{speed_kmh} km/h\n{district}"}
+    ))
+
+    st.subheader("Số xe theo quận")
+    st.bar_chart(pd.Series(snapshot['district_counts'], name='Số xe'))
+
+    st.subheader("Các xe trong cửa sổ")
+    st.dataframe(
+        vehicles[['trip_id', 'district', 'speed_kmh', 'window_avg_speed_kmh', 'window_distance_km', 'window_points']]
+        .sort_values('window_distance_km', ascending=False),
+        hide_index=True
+    )
+
+@instrument()
+def render_live_fleet_tab(districts, view_state, state_path=LIVE_STATE_PATH):
+    """Render tab theo dõi đội xe trực tiếp từ snapshot của modules.live_ingest"""
+    st.subheader("Theo dõi đội xe trực tiếp")
+    # Layer quận tạo một lần mỗi lần rerun trang, fragment chỉ vẽ lại vị trí xe
+    _render_live_view(create_district_layer(districts), view_state, state_path)
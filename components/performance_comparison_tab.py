@@ -1,111 +1,78 @@
 import streamlit as st
+import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
-from modules.gps_analysis import calculate_trip_metrics_pandas, calculate_trip_metrics_cudf
+from modules.benchmark import BENCHMARK_RESULTS_PATH, load_benchmark_results
+from modules.instrumentation import instrument
 
-def render_performance_comparison_tab(file_path):
-    """Render tab so sánh hiệu suất"""
-    st.sidebar.subheader("So sánh hiệu suất")
-    show_traditional = st.sidebar.checkbox("Hiển thị kết quả pandas", value=True)
-    show_cudf = st.sidebar.checkbox("Hiển thị kết quả cudf", value=True)
-    
+@instrument()
+def render_performance_comparison_tab(results_path=BENCHMARK_RESULTS_PATH):
+    """Render tab so sánh hiệu suất từ kết quả benchmark đã lưu"""
     st.subheader("So sánh hiệu suất")
-    
-    # Placeholders
-    traditional_placeholder = st.empty()
-    cudf_placeholder = st.empty()
-    speedup_placeholder = st.empty()
-    
-    # Khởi tạo biến lưu thời gian
-    traditional_time = None
-    cudf_time = None
-    traditional_metrics = None
-    cudf_metrics = None
-    timings_pd = None
-    timings_cudf = None
 
-    # Tính toán
-    if show_traditional:
-        with st.spinner("Đang tính toán bằng phương pháp thông thường..."):
-            traditional_metrics, timings_pd = calculate_trip_metrics_cudf(file_path)
-            print(timings_pd)
-            traditional_time = timings_pd['total']
-            traditional_placeholder.metric(
-                "Thời gian thực thi (pandas)", 
-                f"{traditional_time:.3f} giây"
-            )
-    if show_cudf:
-        with st.spinner("Đang tính toán bằng cudf..."):
-            cudf_metrics, timings_cudf =  calculate_trip_metrics_pandas(file_path)
-            print(timings_cudf)
-            cudf_time = timings_cudf['total']/2
-            cudf_placeholder.metric(
-                "Thời gian thực thi (cudf)", 
-                f"{cudf_time:.3f} giây"
-            )
-    
-    # Biểu đồ so sánh chi tiết từng phép tính
-    if (show_traditional and timings_pd is not None) or (show_cudf and timings_cudf is not None):
-        # Lấy danh sách các phép tính
-        step_names = ['total','sort', 'shift', 'haversine', 'dropna', 'groupby', 'merge_calc']
-        data = []
-        for step in step_names:
-            row = {
-                'Bước': step,
-                'pandas': timings_pd[step] if timings_pd is not None else None,
-                'cudf': timings_cudf[step]/2 if timings_cudf is not None else None
-            }
-            data.append(row)
-        df_steps = px.data.tips()  # dummy, sẽ bị ghi đè
-        import pandas as pd
-        df_steps = pd.DataFrame(data)
-        # Chuyển sang dạng long để vẽ grouped bar
-        df_long = df_steps.melt(id_vars='Bước', var_name='Phương pháp', value_name='Thời gian (giây)')
-        fig_steps = px.bar(
-            df_long,
-            x='Bước',
-            y='Thời gian (giây)',
-            color='Phương pháp',
-            barmode='group',
-            title="So sánh thời gian từng phép tính"
+    report = load_benchmark_results(results_path)
+    if report is None:
+        st.info(
+            f"Chưa có kết quả benchmark tại '{results_path}'. "
+            "Chạy `python -m modules.benchmark` để tạo kết quả."
         )
-        st.plotly_chart(fig_steps, use_container_width=True)
-    
-    # Tính và hiển thị tốc độ tăng
-    if show_traditional and show_cudf and traditional_time and cudf_time and cudf_time > 0:
-        speedup = traditional_time / cudf_time
-        speedup_placeholder.metric("Tốc độ tăng", f"{speedup:.2f}x")
-    
-    st.subheader("Kết quả phân tích")
-    subtab1, subtab2 = st.tabs(["pandas", "cudf"])
-    with subtab1:
-        if show_traditional and traditional_metrics is not None:
-            st.dataframe(traditional_metrics)
-            st.subheader("Biểu đồ tốc độ trung bình")
-            st.plotly_chart(
-                px.bar(
-                    traditional_metrics, 
-                    x='trip_id', 
-                    y='avg_speed_kmh', 
-                    labels={'avg_speed_kmh': 'Tốc độ trung bình (km/h)', 'trip_id': 'Trip ID'}
-                ),
-                use_container_width=True
-            )
-            st.subheader("Biểu đồ khoảng cách di chuyển")
-            st.bar_chart(traditional_metrics.set_index('trip_id')['total_distance_km'])
-    with subtab2:
-        if show_cudf and cudf_metrics is not None:
-            st.dataframe(cudf_metrics)
-            st.subheader("Biểu đồ tốc độ trung bình")
-            st.plotly_chart(
-                px.bar(
-                    cudf_metrics, 
-                    x='trip_id', 
-                    y='avg_speed_kmh', 
-                    labels={'avg_speed_kmh': 'Tốc độ trung bình (km/h)', 'trip_id': 'Trip ID'}
-                ),
-                use_container_width=True
-            )
-            st.subheader("Biểu đồ khoảng cách di chuyển")
-            st.bar_chart(cudf_metrics.set_index('trip_id')['total_distance_km'])
+        return
+
+    meta = report['meta']
+    st.caption(
+        f"Chạy lúc {meta['created_at']} trên {meta['platform']} (Python {meta['python']}); "
+        f"{meta['warmup']} lần warmup, {meta['trials']} lần đo mỗi stage. "
+        "Thời gian gồm cả đọc dữ liệu; bộ nhớ đỉnh chỉ tính bộ nhớ CPU."
+    )
+
+    results = pd.DataFrame(report['results'])
+    if results.empty:
+        st.warning("File kết quả benchmark không có dữ liệu.")
+        return
+
+    # Bảng chi tiết cho một kích thước dữ liệu
+    sizes = sorted(results['size'].unique())
+    selected_size = st.selectbox("Số điểm GPS", sizes, index=len(sizes) - 1, format_func=lambda n: f"{n:,}")
+    table = results[results['size'] == selected_size][
+        ['stage', 'median_s', 'p95_s', 'peak_mem_mb', 'peak_rss_mb', 'rows_per_sec']
+    ].rename(columns={
+        'stage': 'Stage',
+        'median_s': 'Median (giây)',
+        'p95_s': 'p95 (giây)',
+        'peak_mem_mb': 'Heap đỉnh (MB)',
+        'peak_rss_mb': 'RSS tăng thêm (MB)',
+        'rows_per_sec': 'Dòng/giây',
+    })
+    st.dataframe(table, hide_index=True)
 
+    # Thời gian median theo kích thước dữ liệu
+    fig_scaling = px.line(
+        results,
+        x='size',
+        y='median_s',
+        color='stage',
+        markers=True,
+        log_x=True,
+        log_y=True,
+        error_y=results['p95_s'] - results['median_s'],
+        labels={'size': 'Số điểm GPS', 'median_s': 'Thời gian median (giây)', 'stage': 'Stage'},
+        title="Thời gian theo kích thước dữ liệu (thanh lỗi tới p95)"
+    )
+    st.plotly_chart(fig_scaling, use_container_width=True)
+
+    # Tốc độ tăng của các engine trip metrics so với pandas, cùng kích thước
+    trip_metrics = results[results['stage'].str.startswith('trip_metrics:')].copy()
+    trip_metrics['engine'] = trip_metrics['stage'].str.split(':').str[1]
+    baseline = trip_metrics[trip_metrics['engine'] == 'pandas'].set_index('size')['median_s']
+    if not baseline.empty and trip_metrics['engine'].nunique() > 1:
+        trip_metrics['speedup'] = trip_metrics['size'].map(baseline) / trip_metrics['median_s']
+        fig_speedup = px.bar(
+            trip_metrics,
+            x='size',
+            y='speedup',
+            color='engine',
+            barmode='group',
+            log_x=True,
+            labels={'size': 'Số điểm GPS', 'speedup': 'Tốc độ tăng so với pandas (x)', 'engine': 'Engine'},
+            title="Tốc độ tăng của trip metrics so với pandas"
+        )
+        st.plotly_chart(fig_speedup, use_container_width=True)
@@ -1,13 +1,34 @@
-import osmnx as ox
-import networkx as nx
-import cudf as cd  # Sử dụng cudf thay vì pandas
-import numpy as np
-import random
+"""Tạo dữ liệu GPS giả dọc theo đường đi ngắn nhất trên mạng lưới đường TP.HCM
+
+Mỗi đoạn (lat1, lon1, lat2, lon2) trong file đoạn tuyến là một chuyến. Các
+chuyến được chia cho nhiều tiến trình; mỗi chuyến tìm đường đi trên đồ thị đã
+chiếu, nội suy mọi điểm lấy mẫu dọc tuyến trong một lần gọi
+``shapely.line_interpolate_point``, đổi cả mảng tọa độ sang WGS84 qua một
+``pyproj.Transformer`` dùng chung và thêm nhiễu bằng bộ sinh NumPy có seed
+theo (seed, trip_id) nên kết quả không phụ thuộc số tiến trình. Kết quả được
+ghi dần theo từng lô (Parquet hoặc CSV theo đuôi file) vào file tạm rồi đổi
+tên khi xong.
+
+    python data/genarate_gps_data.py --workers 8
+    python data/genarate_gps_data.py --workers 8 --output data/fake_hcmc_road_gps_data_full.parquet
+"""
+import argparse
 import datetime
-from shapely.geometry import Point, LineString
+import functools
 import os
-from osmnx import projection
-import geopandas as gpd
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+import shapely
+from pyproj import Transformer
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # --- Cấu hình ---
 place_name = "Ho Chi Minh City, Vietnam"
@@ -16,210 +37,237 @@ min_speed_kmh = 20  # Tốc độ giả định tối thiểu (km/h)
 max_speed_kmh = 60  # Tốc độ giả định tối đa (km/h)
 sampling_interval_seconds = 30  # Khoảng thời gian lấy mẫu GPS (giây)
 gps_noise_meters = 10  # Mức độ nhiễu GPS giả định (mét)
-
-# Điểm bắt đầu và kết thúc
-csv_file = 'bus_route_segments_full.csv'
-df = cd.read_csv(csv_file)  # Sử dụng cudf để đọc CSV
-data_points = df.to_pandas().apply(  # Chuyển sang pandas tạm thời để xử lý
-    lambda row: (row['lat1'], row['lon1'], row['lat2'], row['lon2']),
-    axis=1
-).tolist()
+trip_spacing_minutes = 5  # Chuyến thứ i bắt đầu sau chuyến đầu (i - 1) * 5 phút
 
 # Đường dẫn để lưu và tải đồ thị
-graph_file = "data/hcmc_graph.graphml"
-projected_graph_file = "data/hcmc_graph_projected.graphml"
-
-# Khoảng thời gian tạo dữ liệu (bắt đầu từ 1 tuần trước)
-start_time_base = datetime.datetime.now() - datetime.timedelta(days=7)
-
-# --- Hàm hỗ trợ ---
-def add_gps_noise(latitude, longitude, noise_meters):
-    """Thêm nhiễu ngẫu nhiên vào tọa độ Lat/Lon (ước tính)."""
-    lat_noise_deg = noise_meters / 111000 * random.uniform(-1, 1)
-    lon_noise_deg = noise_meters / (111000 * abs(np.cos(np.radians(latitude)))) * random.uniform(-1, 1)
-    return latitude + lat_noise_deg, longitude + lon_noise_deg
-
-# --- Tải hoặc xử lý mạng lưới đường bộ --- 
-print(f"Kiểm tra xem mạng lưới đường bộ đã được lưu chưa...")
-
-if os.path.exists(graph_file) and os.path.exists(projected_graph_file):
-    print(f"Đồ thị đã tồn tại. Đang tải từ '{graph_file}' và '{projected_graph_file}'...")
-    G = ox.load_graphml(graph_file)
-    G_proj = ox.load_graphml(projected_graph_file)
-    print(f"Đã tải đồ thị từ file. CRS của đồ thị dự án: {G_proj.graph['crs']}")
-else:
+graph_file = os.path.join(DATA_DIR, "hcmc_graph.graphml")
+projected_graph_file = os.path.join(DATA_DIR, "hcmc_graph_projected.graphml")
+
+# Cùng schema với file GPS mà ứng dụng đọc (modules/gps_store.py)
+GPS_SCHEMA = pa.schema([
+    ('trip_id', pa.int64()),
+    ('timestamp', pa.timestamp('ns')),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('simulated_speed_kmh', pa.float32()),
+])
+# Số dòng gom lại trước mỗi lần ghi (một row group Parquet)
+WRITE_BATCH_ROWS = 256_000
+METERS_PER_DEGREE = 111000
+
+# Trạng thái của mỗi tiến trình con: đồ thị đã chiếu và cấu hình mô phỏng
+_worker = {}
+
+def load_graphs():
+    """Tải đồ thị đường bộ (gốc và đã chiếu) từ file, tải từ OSM nếu chưa có"""
+    if os.path.exists(graph_file) and os.path.exists(projected_graph_file):
+        print(f"Đồ thị đã tồn tại. Đang tải từ '{graph_file}' và '{projected_graph_file}'...")
+        return ox.load_graphml(graph_file), ox.load_graphml(projected_graph_file)
     print(f"Đang tải mạng lưới đường bộ '{network_type}' cho '{place_name}'...")
     G = ox.graph_from_place(place_name, network_type=network_type)
-    print("Đã tải đồ thị.")
-
     G_proj = ox.project_graph(G)
     print(f"Đã dự án đồ thị sang hệ tọa độ: {G_proj.graph['crs']}")
-
-    print(f"Lưu đồ thị vào '{graph_file}' và '{projected_graph_file}'...")
     ox.save_graphml(G, graph_file)
     ox.save_graphml(G_proj, projected_graph_file)
-    print("Đã lưu đồ thị.")
+    return G, G_proj
 
-# --- Tạo dữ liệu GPS giả cho nhiều chuyến đi ---
-all_gps_points = []
+@functools.lru_cache(maxsize=None)
+def _to_wgs84(crs):
+    """Transformer từ hệ chiếu của đồ thị sang EPSG:4326, tạo một lần mỗi tiến trình"""
+    return Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
 
-print(f"\nĐang tạo {len(data_points)} chuyến đi...")
+def _init_worker(G_proj, config):
+    """Khởi tạo tiến trình con (với fork đồ thị được kế thừa, không phải sao chép)"""
+    _worker['G_proj'] = G_proj
+    _worker['config'] = config
 
-for trip_id, (lat1, lon1, lat2, lon2) in enumerate(data_points, 1):
-    print(f"\nChuyến đi {trip_id}: từ ({lat1}, {lon1}) đến ({lat2}, {lon2})")
-    
-    try:
-        # Tìm nút gần nhất với điểm bắt đầu và kết thúc
-        origin_node = ox.distance.nearest_nodes(G, lon1, lat1)  # (lon, lat)
-        destination_node = ox.distance.nearest_nodes(G, lon2, lat2)  # (lon, lat)
+def _route_coords(G_proj, route):
+    """Tọa độ (x, y) đã chiếu dọc tuyến (bỏ các điểm lặp lại, giữ lần đầu) và độ dài tuyến (m)"""
+    pieces = []
+    length_m = 0.0
+    for u, v in zip(route[:-1], route[1:]):
+        edge = G_proj.get_edge_data(u, v, 0)
+        if not edge:
+            continue
+        length_m += edge['length']
+        if isinstance(edge.get('geometry'), shapely.LineString):
+            pieces.append(shapely.get_coordinates(edge['geometry']))
+        else:
+            pieces.append(np.array([
+                (G_proj.nodes[u]['x'], G_proj.nodes[u]['y']),
+                (G_proj.nodes[v]['x'], G_proj.nodes[v]['y']),
+            ]))
+    if not pieces:
+        return np.empty((0, 2)), 0.0
+    coords = np.concatenate(pieces)
+    _, first = np.unique(coords, axis=0, return_index=True)
+    return coords[np.sort(first)], length_m
 
-        # Tìm đường đi ngắn nhất (theo độ dài) giữa 2 nút
+def add_gps_noise(latitudes, longitudes, noise_meters, rng):
+    """Thêm nhiễu đều trong [-noise, noise] mét vào mảng Lat/Lon (ước tính)"""
+    lat_noise_deg = noise_meters / METERS_PER_DEGREE * rng.uniform(-1, 1, len(latitudes))
+    lon_noise_deg = noise_meters / (METERS_PER_DEGREE * np.abs(np.cos(np.radians(latitudes)))) * rng.uniform(-1, 1, len(latitudes))
+    return latitudes + lat_noise_deg, longitudes + lon_noise_deg
+
+def simulate_trip(task):
+    """Mô phỏng một chuyến; trả về (trip_id, các cột hoặc None, thông báo)"""
+    trip_id, origin_node, destination_node = task
+    G_proj = _worker['G_proj']
+    config = _worker['config']
+    try:
         route = nx.shortest_path(G_proj, origin_node, destination_node, weight='length')
+        coords, route_length_m = _route_coords(G_proj, route)
+        if len(coords) < 2:
+            return trip_id, None, "Tuyến đường quá ngắn hoặc không có geometry. Bỏ qua."
 
-        # Lấy thông tin chi tiết về các cạnh (đoạn đường) trên tuyến đường
-        route_edges = []
-        for u, v in zip(route[:-1], route[1:]):
-            edge_data = G_proj.get_edge_data(u, v, 0)
-            if edge_data:
-                edge_data['u'] = u
-                edge_data['v'] = v
-                route_edges.append(edge_data)
-
-        # Kiểm tra khoảng cách tuyến đường
-        route_length_m = sum(edge['length'] for edge in route_edges)
-        route_length_km = route_length_m / 1000
-        print(f"Khoảng cách tuyến đường: {route_length_km:.2f} km")
-
-        # --- Mô phỏng di chuyển dọc theo tuyến đường ---
-        trip_speed_kmh = random.uniform(min_speed_kmh, max_speed_kmh)
-        trip_speed_ms = trip_speed_kmh * 1000 / 3600  # Tốc độ theo m/s
-
-        # Ước tính thời lượng chuyến đi (giây)
-        estimated_duration_seconds = route_length_m / trip_speed_ms
-        num_points = int(estimated_duration_seconds / sampling_interval_seconds)
-        if num_points < 2:
-            print("Chuyến đi quá ngắn để tạo ít nhất 2 điểm GPS. Bỏ qua.")
-            continue
+        # Seed theo chuyến nên mỗi chuyến cho cùng kết quả dù chạy ở tiến trình nào
+        rng = np.random.default_rng((config['seed'], trip_id))
+        trip_speed_kmh = rng.uniform(config['min_speed_kmh'], config['max_speed_kmh'])
+        trip_speed_ms = trip_speed_kmh * 1000 / 3600
+        interval = config['sampling_interval_seconds']
+        if int(route_length_m / trip_speed_ms / interval) < 2:
+            return trip_id, None, "Chuyến đi quá ngắn để tạo ít nhất 2 điểm GPS. Bỏ qua."
 
-        # Thời gian bắt đầu chuyến đi
-        trip_start_time = start_time_base + datetime.timedelta(minutes=(trip_id-1)*5)
-        current_time = trip_start_time
-
-        # Lấy tất cả các điểm tọa độ trên tuyến đường
-        route_points_proj = []
-        for edge in route_edges:
-            if 'geometry' in edge and isinstance(edge['geometry'], LineString):
-                route_points_proj.extend(list(edge['geometry'].coords))
-            else:
-                u, v = edge['u'], edge['v']
-                if u in G_proj.nodes and v in G_proj.nodes:
-                    route_points_proj.append((G_proj.nodes[u]['x'], G_proj.nodes[u]['y']))
-                    route_points_proj.append((G_proj.nodes[v]['x'], G_proj.nodes[v]['y']))
-
-        if not route_points_proj:
-            print(f"Không có geometry cho tuyến đường {trip_id}. Bỏ qua.")
-            continue
+        # Điểm đầu là nút xuất phát, sau đó mỗi khoảng lấy mẫu một điểm tới hết tuyến
+        line = shapely.LineString(coords)
+        step_m = trip_speed_ms * interval
+        distances = np.append(np.arange(1, np.ceil(line.length / step_m)) * step_m, line.length)
+        xy = np.vstack((
+            [(G_proj.nodes[origin_node]['x'], G_proj.nodes[origin_node]['y'])],
+            shapely.get_coordinates(shapely.line_interpolate_point(line, distances)),
+            [(G_proj.nodes[destination_node]['x'], G_proj.nodes[destination_node]['y'])],
+        ))
+        lons, lats = _to_wgs84(G_proj.graph['crs']).transform(xy[:, 0], xy[:, 1])
+        # Chỉ thêm điểm kết thúc nếu khác điểm cuối tuyến
+        if abs(lats[-1] - lats[-2]) <= 1e-5 and abs(lons[-1] - lons[-2]) <= 1e-5:
+            lons, lats = lons[:-1], lats[:-1]
+        lats, lons = add_gps_noise(lats, lons, config['gps_noise_meters'], rng)
+
+        start_ns = config['start_ns'] + (trip_id - 1) * config['trip_spacing_minutes'] * 60 * 10**9
+        columns = {
+            'trip_id': np.full(len(lats), trip_id, dtype=np.int64),
+            'timestamp': (start_ns + np.arange(len(lats), dtype=np.int64) * interval * 10**9).view('datetime64[ns]'),
+            'latitude': lats,
+            'longitude': lons,
+            'simulated_speed_kmh': np.full(len(lats), trip_speed_kmh, dtype=np.float32),
+        }
+        return trip_id, columns, (
+            f"{len(lats)} điểm GPS (độ dài {route_length_m / 1000:.2f} km, tốc độ {trip_speed_kmh:.2f} km/h)"
+        )
+    except nx.NetworkXNoPath:
+        return trip_id, None, "Không tìm thấy đường đi. Bỏ qua."
+    except Exception as e:
+        return trip_id, None, f"Lỗi: {e}. Bỏ qua."
 
-        # Xử lý trường hợp các điểm trùng lặp
-        unique_route_points_proj = []
-        seen_points = set()
-        for p in route_points_proj:
-            if p not in seen_points:
-                unique_route_points_proj.append(p)
-                seen_points.add(p)
+class _BatchWriter:
+    """Ghi dần các lô cột vào file tạm (Parquet hoặc CSV); chỉ đổi tên khi ``commit``"""
 
-        if len(unique_route_points_proj) < 2:
-            print(f"Tuyến đường {trip_id} quá ngắn. Bỏ qua.")
-            continue
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.tmp_path = f"{output_path}.tmp-{os.getpid()}"
+        if output_path.endswith(".parquet"):
+            self.writer = pq.ParquetWriter(self.tmp_path, GPS_SCHEMA, compression='zstd')
+        else:
+            self.writer = pv.CSVWriter(self.tmp_path, GPS_SCHEMA)
+        self.pending = []
+        self.pending_rows = 0
+        self.n_rows = 0
 
-        route_line_proj = LineString(unique_route_points_proj)
-        total_route_length_proj = route_line_proj.length
-        distance_per_interval_m = trip_speed_ms * sampling_interval_seconds
-        current_distance_on_line_m = 0
-
-        # Tạo các điểm GPS
-        gps_points_for_trip = []  # Lưu tạm thời dưới dạng list
-        # Thêm điểm bắt đầu
-        origin_gdf = gpd.GeoDataFrame(
-            [{'geometry': Point(G_proj.nodes[origin_node]['x'], G_proj.nodes[origin_node]['y'])}],
-            crs=G_proj.graph['crs']
-        )
-        origin_lat_lon = projection.project_gdf(origin_gdf, to_crs='EPSG:4326').iloc[0]['geometry']
-        noisy_lat, noisy_lon = add_gps_noise(origin_lat_lon.y, origin_lat_lon.x, gps_noise_meters)
-        gps_points_for_trip.append({
-            'trip_id': trip_id,
-            'timestamp': current_time,
-            'latitude': noisy_lat,
-            'longitude': noisy_lon,
-            'simulated_speed_kmh': trip_speed_kmh
-        })
-        current_time += datetime.timedelta(seconds=sampling_interval_seconds)
-
-        while current_distance_on_line_m < total_route_length_proj:
-            target_distance_on_line_m = current_distance_on_line_m + distance_per_interval_m
-            if target_distance_on_line_m > total_route_length_proj:
-                target_distance_on_line_m = total_route_length_proj
-            fraction = target_distance_on_line_m / total_route_length_proj
-            if fraction > 1.0:
-                fraction = 1.0
-            interpolated_point_proj = route_line_proj.interpolate(fraction, normalized=True)
-            point_gdf = gpd.GeoDataFrame([{'geometry': interpolated_point_proj}], crs=G_proj.graph['crs'])
-            point_lat_lon = projection.project_gdf(point_gdf, to_crs='EPSG:4326').iloc[0]['geometry']
-            noisy_lat, noisy_lon = add_gps_noise(point_lat_lon.y, point_lat_lon.x, gps_noise_meters)
-            gps_points_for_trip.append({
-                'trip_id': trip_id,
-                'timestamp': current_time,
-                'latitude': noisy_lat,
-                'longitude': noisy_lon,
-                'simulated_speed_kmh': trip_speed_kmh
-            })
-            current_distance_on_line_m = target_distance_on_line_m
-            current_time += datetime.timedelta(seconds=sampling_interval_seconds)
-
-        # Thêm điểm kết thúc nếu cần
-        dest_gdf = gpd.GeoDataFrame(
-            [{'geometry': Point(G_proj.nodes[destination_node]['x'], G_proj.nodes[destination_node]['y'])}],
-            crs=G_proj.graph['crs']
-        )
-        destination_lat_lon = projection.project_gdf(dest_gdf, to_crs='EPSG:4326').iloc[0]['geometry']
-        if not gps_points_for_trip or (
-            abs(gps_points_for_trip[-1]['latitude'] - destination_lat_lon.y) > 1e-5 or
-            abs(gps_points_for_trip[-1]['longitude'] - destination_lat_lon.x) > 1e-5
-        ):
-            noisy_lat, noisy_lon = add_gps_noise(destination_lat_lon.y, destination_lat_lon.x, gps_noise_meters)
-            gps_points_for_trip.append({
-                'trip_id': trip_id,
-                'timestamp': current_time,
-                'latitude': noisy_lat,
-                'longitude': noisy_lon,
-                'simulated_speed_kmh': trip_speed_kmh
-            })
-
-        all_gps_points.extend(gps_points_for_trip)
-        print(
-            f"Đã tạo chuyến đi {trip_id} với {len(gps_points_for_trip)} điểm GPS "
-            f"(độ dài {route_length_km:.2f} km, tốc độ {trip_speed_kmh:.2f} km/h)."
+    def add(self, columns):
+        self.pending.append(columns)
+        self.pending_rows += len(columns['trip_id'])
+        if self.pending_rows >= WRITE_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch = pa.record_batch(
+            [pa.array(np.concatenate([c[name] for c in self.pending]), type=field.type) for name, field in zip(GPS_SCHEMA.names, GPS_SCHEMA)],
+            schema=GPS_SCHEMA,
         )
+        self.writer.write_batch(batch)
+        self.n_rows += batch.num_rows
+        self.pending = []
+        self.pending_rows = 0
 
-    except nx.NetworkXNoPath:
-        print(f"Không tìm thấy đường đi cho chuyến {trip_id}. Bỏ qua.")
-        continue
-    except Exception as e:
-        print(f"Lỗi khi tạo chuyến đi {trip_id}: {e}. Bỏ qua.")
-        continue
-
-# --- Tạo DataFrame và Lưu ---
-if all_gps_points:
-    gps_df = cd.DataFrame(all_gps_points)  # Sử dụng cudf để tạo DataFrame
-    gps_df = gps_df.sort_values(by=['trip_id', 'timestamp']).reset_index(drop=True)
-    
-    print("\nDữ liệu GPS giả tạo:")
-    print(gps_df.to_pandas().head())  # Chuyển sang pandas để in
-    print("\n...")
-    print(gps_df.to_pandas().tail())
-
-    output_filename = 'fake_hcmc_road_gps_data_full.csv'
-    gps_df.to_pandas().to_csv(output_filename, index=False)  # Chuyển sang pandas để lưu
-    print(f"\nDữ liệu đã được lưu vào file '{output_filename}'")
-else:
-    print("\nKhông có chuyến đi nào được tạo thành công.")
+    def commit(self):
+        """Ghi nốt lô cuối và đổi tên file tạm thành file kết quả (bỏ file rỗng)"""
+        self.flush()
+        self.writer.close()
+        if self.n_rows:
+            os.replace(self.tmp_path, self.output_path)
+        else:
+            os.remove(self.tmp_path)
+
+    def abort(self):
+        """Đóng và xóa file tạm, không đụng tới file kết quả cũ"""
+        try:
+            self.writer.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tạo dữ liệu GPS giả dọc theo các đoạn tuyến xe buýt")
+    parser.add_argument("--segments", default=os.path.join(DATA_DIR, "bus_route_segments_full.csv"), help="File CSV các đoạn (lat1, lon1, lat2, lon2)")
+    parser.add_argument("--output", default=os.path.join(DATA_DIR, "fake_hcmc_road_gps_data_full.csv"), help="File kết quả .parquet hoặc .csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Số tiến trình mô phỏng")
+    parser.add_argument("--seed", type=int, default=0, help="Seed cho tốc độ và nhiễu GPS")
+    parser.add_argument("--start", help="Thời gian bắt đầu chuyến đầu tiên (mặc định 7 ngày trước)")
+    args = parser.parse_args(argv)
+
+    segments = pd.read_csv(args.segments)
+    start_time = pd.Timestamp(args.start) if args.start else pd.Timestamp(datetime.datetime.now() - datetime.timedelta(days=7))
+    config = {
+        'seed': args.seed,
+        'start_ns': start_time.value,
+        'min_speed_kmh': min_speed_kmh,
+        'max_speed_kmh': max_speed_kmh,
+        'sampling_interval_seconds': sampling_interval_seconds,
+        'gps_noise_meters': gps_noise_meters,
+        'trip_spacing_minutes': trip_spacing_minutes,
+    }
+
+    G, G_proj = load_graphs()
+    # Tìm nút gần nhất cho mọi điểm đầu/cuối trong một lần gọi (lon, lat)
+    nodes = ox.distance.nearest_nodes(
+        G,
+        np.concatenate((segments['lon1'].to_numpy(), segments['lon2'].to_numpy())),
+        np.concatenate((segments['lat1'].to_numpy(), segments['lat2'].to_numpy())),
+    )
+    n_trips = len(segments)
+    tasks = [(trip_id, nodes[i], nodes[n_trips + i]) for i, trip_id in enumerate(range(1, n_trips + 1))]
+
+    print(f"\nĐang tạo {n_trips} chuyến đi với {args.workers} tiến trình...")
+    writer = _BatchWriter(args.output)
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(G_proj, config))
+        # Lấy kết quả theo thứ tự chuyến để file ra đã sắp theo (trip_id, timestamp)
+        results = executor.map(simulate_trip, tasks, chunksize=max(1, n_trips // (args.workers * 16)))
+    else:
+        executor = None
+        _init_worker(G_proj, config)
+        results = map(simulate_trip, tasks)
+    try:
+        for trip_id, columns, message in results:
+            print(f"Chuyến đi {trip_id}: {message}")
+            if columns is not None:
+                writer.add(columns)
+    except BaseException:
+        # Tiến trình con lỗi, BrokenProcessPool hoặc Ctrl-C: không công bố file dở dang
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        writer.abort()
+        raise
+    if executor is not None:
+        executor.shutdown()
+    writer.commit()
+
+    if writer.n_rows:
+        print(f"\nĐã ghi {writer.n_rows} điểm GPS vào '{args.output}'")
+    else:
+        print("\nKhông có chuyến đi nào được tạo thành công.")
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,36 @@
 import streamlit as st
 import pydeck as pdk
-import cudf
-from modules.map_utils import load_geojson, create_district_layer, create_gps_layer, create_heatmap_layer
+import pandas as pd
+from modules.map_utils import create_district_layer, create_gps_layer, create_heatmap_layer, build_trip_path_levels, select_path_level, aggregate_heatmap_bins, heatmap_cell_size_m, path_records, compact_point_frame
+from modules.district_index import load_district_index
+from modules.gps_store import read_gps
+from modules.result_cache import file_fingerprint, tag_fingerprint
 from components.gps_analysis_tab import render_gps_analysis_tab
 from components.performance_comparison_tab import render_performance_comparison_tab
 from components.graph_analysis_tab import render_graph_analysis_tab
 from components.bus_route_analysis_tab import render_bus_route_analysis_tab
+from components.live_fleet_tab import render_live_fleet_tab
+from modules import instrumentation
+from modules.instrumentation import instrument
 
-def load_gps_data(file_path):
-    """Đọc dữ liệu GPS từ file CSV bằng cudf"""
-    # Đọc file CSV bằng cudf
-    df = cudf.read_csv(file_path)
-    
-    # Chuyển đổi cột 'timestamp' sang kiểu datetime bằng cudf
-    df['timestamp'] = cudf.to_datetime(df['timestamp'])
-    
-    return df.to_pandas()
+# Mức zoom ban đầu của bản đồ (trung tâm Q9, TP.HCM)
+DEFAULT_ZOOM = 13.5
 
-def create_district_layer(districts):
-    # Create a list to store polygon data
-    polygons = []
-    
-    # Process each district
-    for district in districts["level2s"]:
-        # Get coordinates for each polygon in the district
-        for polygon in district["coordinates"]:
-            # Convert coordinates to the format expected by pydeck
-            coords = polygon[0]  # Get the first (and only) ring of coordinates
-            polygons.append({
-                "name": district["name"],
-                "id": district["level2_id"],
-                "coordinates": coords
-            })
-    
-    return pdk.Layer(
-        "PolygonLayer",
-        data=polygons,
-        get_polygon="coordinates",
-        get_fill_color=[255, 140, 0, 100],  # Orange with some transparency
-        get_line_color=[0, 0, 0, 80],  # Black border
-        get_line_width=2,
-        pickable=True,
-        auto_highlight=True,
-        highlight_color=[255, 140, 0, 200],  # Brighter orange when hovered
-        extruded=False,
-    )
+@instrument()
+def load_gps_data(file_path, columns=None, start=None, end=None):
+    """Đọc dữ liệu GPS từ cache Parquet (CSV chỉ được parse lần đầu)"""
+    df = read_gps(file_path, columns=columns, start=start, end=end)
+    # Vân tay theo nguồn để cache kết quả không phải hash lại cả DataFrame
+    return tag_fingerprint(df, 'gps', file_fingerprint(file_path), columns, start, end)
 
-def create_gps_layer(gps_data):
-    # Group data by trip_id and create path coordinates
-    trip_paths = []
-    for trip_id in gps_data['trip_id'].unique():
-        trip_points = gps_data[gps_data['trip_id'] == trip_id]
-        # Create path coordinates for this trip
-        path = trip_points[['longitude', 'latitude']].values.tolist()
-        if len(path) > 1:  # Only add paths with more than one point
-            trip_paths.append({
-                'trip_id': str(trip_id),  # Convert to string to ensure JSON serialization
-                'path': path
-            })
+@instrument()
+def create_gps_layer(gps_data, zoom=DEFAULT_ZOOM):
+    # Đường đi đã được gom theo chuyến và đơn giản hóa sẵn theo mức zoom
+    trip_ids, coords, offsets = select_path_level(build_trip_path_levels(gps_data), zoom)
+    trip_paths = path_records(
+        coords, offsets,
+        trip_id=trip_ids.astype(str)  # Convert to string to ensure JSON serialization
+    )
     
     # Create layer for GPS paths
     return pdk.Layer(
@@ -71,12 +44,15 @@ def create_gps_layer(gps_data):
         highlight_color=[255, 0, 0, 180],  # Red highlight when hovered
     )
 
-def create_heatmap_layer(gps_data):
-    # Tạo layer cho heatmap
+@instrument()
+def create_heatmap_layer(gps_data, zoom=DEFAULT_ZOOM):
+    # Tạo layer cho heatmap từ lưới đã gom sẵn ở server (trọng số = số điểm mỗi ô)
+    bins = aggregate_heatmap_bins(gps_data, heatmap_cell_size_m(zoom))
     return pdk.Layer(
         "HeatmapLayer",
-        data=gps_data,
+        data=compact_point_frame(bins, ['count']),
         get_position=['longitude', 'latitude'],
+        get_weight='count',
         aggregation="SUM",
         color_range=[
             [255, 0, 0, 0],
@@ -98,6 +74,7 @@ def main():
     show_districts = st.sidebar.checkbox("Hiển thị quận", value=True)
     show_gps = st.sidebar.checkbox("Hiển thị điểm GPS", value=True)
     show_heatmap = st.sidebar.checkbox("Hiển thị heatmap", value=True)
+    map_zoom = st.sidebar.slider("Mức zoom bản đồ", 9.0, 18.0, DEFAULT_ZOOM, 0.5)
     
     # Layer opacity settings
     st.sidebar.subheader("Độ trong suốt")
@@ -107,7 +84,7 @@ def main():
     
     # Load GeoJSON data
     try:
-        districts = load_geojson("data/SGDistrict.geo.json")
+        districts = load_district_index("data/SGDistrict.geo.json")
     except Exception as e:
         st.error(f"Lỗi khi đọc file GeoJSON: {e}")
         return
@@ -127,12 +104,12 @@ def main():
         layers.append(district_layer)
     
     if show_gps:
-        gps_layer = create_gps_layer(gps_data)
+        gps_layer = create_gps_layer(gps_data, zoom=map_zoom)
         gps_layer.get_fill_color = [0, 0, 255, gps_opacity]
         layers.append(gps_layer)
     
     if show_heatmap:
-        heatmap_layer = create_heatmap_layer(gps_data)
+        heatmap_layer = create_heatmap_layer(gps_data, zoom=map_zoom)
         heatmap_layer.color_range = [
             [255, 0, 0, 0],
             [255, 0, 0, heatmap_opacity]
@@ -143,7 +120,7 @@ def main():
     view_state = pdk.ViewState(
         latitude=10.833755,
         longitude=106.818759,
-        zoom=13.5,
+        zoom=map_zoom,
         pitch=0,
     )
     
@@ -172,16 +149,24 @@ def main():
     st.write(f"Tổng số chuyến đi: {gps_data['trip_id'].nunique()}")
     
     # Tạo tabs cho các phân tích khác nhau
-    tab1, tab2, tab3 = st.tabs([ "So sánh hiệu suất", "Phân tích đồ thị", "Phân tích tuyến xe buýt"])
+    tab1, tab2, tab3, tab4 = st.tabs([ "So sánh hiệu suất", "Phân tích đồ thị", "Phân tích tuyến xe buýt", "Đội xe trực tiếp"])
     
     with tab1:
-        render_performance_comparison_tab("data/fake_hcmc_road_gps_data_full.csv")
+        render_performance_comparison_tab()
     
     with tab2:
         render_graph_analysis_tab(gps_data)
     
     with tab3:
         render_bus_route_analysis_tab(gps_data, districts, layers, deck)
+    
+    with tab4:
+        render_live_fleet_tab(districts, view_state)
+    
+    # Thống kê đo đạc theo stage (chỉ khi bật GPS_INSTRUMENT=1)
+    if instrumentation.is_enabled():
+        with st.sidebar.expander("Thời gian theo stage"):
+            st.dataframe(pd.DataFrame.from_dict(instrumentation.summary(), orient='index').drop(columns='histogram_ms'))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""Bộ benchmark cho pipeline GPS
+
+Chạy trên dữ liệu tổng hợp có kích thước cố định, mỗi stage được chạy warmup
+rồi lặp lại nhiều lần; kết quả (median/p95, bộ nhớ đỉnh, số dòng/giây) được
+ghi ra JSON để tab "So sánh hiệu suất" hiển thị.
+
+    python -m modules.benchmark --sizes 10000 100000 1000000 10000000
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from modules.gps_analysis import TRIP_METRICS_ENGINES
+from modules.gps_store import ensure_gps_parquet, read_gps
+from modules.bus_route_analysis import analyze_bus_routes
+from modules.graph_analysis import GRAPH_BACKENDS, GRAPH_METRICS, create_movement_graph
+from modules.district_index import load_district_index
+from modules.instrumentation import current_rss_bytes
+from modules.result_cache import cache_disabled
+
+BENCHMARK_RESULTS_PATH = "data/benchmark_results.json"
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_STAGES = ['ingest', 'trip_metrics', 'bus_routes', 'graph', 'graph_metrics']
+# Các độ đo đồ thị được đo cho từng backend; betweenness dùng chế độ lấy mẫu
+GRAPH_METRIC_PARAMS = {
+    'pagerank': {},
+    'eigenvector': {},
+    'communities': {},
+    'betweenness': {'k': 256},
+}
+DISTRICTS_PATH = "data/SGDistrict.geo.json"
+
+# Vùng tạo dữ liệu tổng hợp (quanh nội thành TP.HCM)
+SYNTHETIC_CENTER = (10.78, 106.70)
+SYNTHETIC_SPREAD_DEG = 0.08
+SAMPLING_INTERVAL_SECONDS = 30
+
+def generate_synthetic_gps(n_points, points_per_trip=200, seed=0):
+    """Tạo dữ liệu GPS tổng hợp cùng schema với fake_hcmc_road_gps_data.csv"""
+    rng = np.random.default_rng(seed)
+    n_trips = max(1, n_points // points_per_trip)
+    trip_ids = np.repeat(np.arange(1, n_trips + 1), points_per_trip)[:n_points]
+    trip_ids = np.concatenate((trip_ids, np.full(n_points - len(trip_ids), n_trips)))
+    starts = np.flatnonzero(np.concatenate(([True], trip_ids[1:] != trip_ids[:-1])))
+    position_in_trip = np.arange(n_points) - np.repeat(starts, np.diff(np.append(starts, n_points)))
+
+    # Mỗi chuyến là một bước đi ngẫu nhiên từ một điểm xuất phát ngẫu nhiên
+    speed_kmh = rng.uniform(20, 60, n_trips)[trip_ids - 1]
+    step_deg = speed_kmh * SAMPLING_INTERVAL_SECONDS / 3600 / 111.0
+    heading = rng.uniform(0, 2 * np.pi, n_points)
+    dlat = np.where(position_in_trip == 0, 0.0, step_deg * np.sin(heading))
+    dlon = np.where(position_in_trip == 0, 0.0, step_deg * np.cos(heading))
+    origin_lat = SYNTHETIC_CENTER[0] + rng.uniform(-SYNTHETIC_SPREAD_DEG, SYNTHETIC_SPREAD_DEG, n_trips)
+    origin_lon = SYNTHETIC_CENTER[1] + rng.uniform(-SYNTHETIC_SPREAD_DEG, SYNTHETIC_SPREAD_DEG, n_trips)
+    latitude = origin_lat[trip_ids - 1] + _cumsum_by_trip(dlat, starts)
+    longitude = origin_lon[trip_ids - 1] + _cumsum_by_trip(dlon, starts)
+
+    trip_start = pd.Timestamp("2025-05-04") + pd.to_timedelta((trip_ids - 1) * 300, unit='s')
+    timestamp = trip_start + pd.to_timedelta(position_in_trip * SAMPLING_INTERVAL_SECONDS, unit='s')
+    return pd.DataFrame({
+        'trip_id': trip_ids,
+        'timestamp': timestamp,
+        'latitude': latitude,
+        'longitude': longitude,
+        'simulated_speed_kmh': speed_kmh,
+    })
+
+def _cumsum_by_trip(values, starts):
+    """Tổng tích lũy khởi động lại ở đầu mỗi chuyến"""
+    total = np.cumsum(values)
+    offsets = np.repeat(total[starts] - values[starts], np.diff(np.append(starts, len(values))))
+    return total - offsets
+
+class _RssSampler:
+    """Lấy mẫu RSS trong một thread nền để ước lượng RSS đỉnh của một lần chạy
+
+    Bắt được cả bộ nhớ không đi qua tracemalloc (ví dụ bộ đệm của Arrow).
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = current_rss_bytes()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = current_rss_bytes()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if self.baseline is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.baseline is not None:
+            self._stop.set()
+            self._thread.join()
+            self._run_once()
+
+    def _run_once(self):
+        rss = current_rss_bytes()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    @property
+    def peak_delta(self):
+        """Phần RSS tăng thêm so với lúc bắt đầu (byte), None nếu không đo được"""
+        if self.baseline is None:
+            return None
+        return self.peak - self.baseline
+
+def _measure(fn, warmup, trials):
+    """Chạy ``fn`` warmup lần rồi đo ``trials`` lần; trả về thời gian và bộ nhớ đỉnh
+
+    Bộ nhớ đỉnh được đo trong một lần chạy riêng (heap Python/NumPy qua
+    tracemalloc và RSS tăng thêm, không gồm bộ nhớ GPU) để không làm sai thời gian.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(trials):
+        gc.collect()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with _RssSampler() as sampler:
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak, sampler.peak_delta
+
+def _summarize(stage, size, rows, times, peak_bytes, peak_rss_bytes):
+    """Thống kê cho một (stage, kích thước)"""
+    median = float(np.median(times))
+    return {
+        'stage': stage,
+        'size': size,
+        'rows': rows,
+        'trials_s': times,
+        'median_s': median,
+        'p95_s': float(np.percentile(times, 95)),
+        'min_s': float(np.min(times)),
+        'peak_mem_mb': peak_bytes / 2**20,
+        'peak_rss_mb': peak_rss_bytes / 2**20 if peak_rss_bytes is not None else None,
+        'rows_per_sec': rows / median if median > 0 else None,
+    }
+
+def _stage_functions(stages, csv_path, workdir, districts):
+    """Tạo các hàm cần đo cho từng stage trên một tập dữ liệu"""
+    functions = {}
+    if 'ingest' in stages:
+        ingest_dir = os.path.join(workdir, "ingest")
+
+        def ingest():
+            # Luôn chuyển đổi lại từ đầu: xóa cache trước mỗi lần chạy
+            shutil.rmtree(ingest_dir, ignore_errors=True)
+            ensure_gps_parquet(csv_path, cache_dir=ingest_dir)
+        functions['ingest'] = ingest
+
+    if 'trip_metrics' in stages:
+        # Các stage tính trên cache Parquet đã có sẵn, gồm cả thời gian đọc
+        ensure_gps_parquet(csv_path)
+        for engine, func in TRIP_METRICS_ENGINES.items():
+            functions[f'trip_metrics:{engine}'] = lambda func=func: func(csv_path)
+
+    if 'bus_routes' in stages or 'graph' in stages or 'graph_metrics' in stages:
+        gps_data = read_gps(csv_path)
+
+    if 'bus_routes' in stages:
+        functions['bus_routes'] = lambda: analyze_bus_routes(gps_data, districts)
+
+    if 'graph' in stages:
+        functions['graph'] = lambda: create_movement_graph(gps_data)
+
+    if 'graph_metrics' in stages:
+        # Đồ thị được tạo trước cho từng backend, chỉ đo thời gian tính độ đo
+        for backend in GRAPH_BACKENDS:
+            G, _, _ = create_movement_graph(gps_data, backend=backend)
+            for metric, params in GRAPH_METRIC_PARAMS.items():
+                func, _ = GRAPH_METRICS[metric]
+                functions[f'graph_metrics:{backend}:{metric}'] = lambda func=func, G=G, params=params: func(G, **params)
+    return functions
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=DEFAULT_STAGES, warmup=1, trials=5, seed=0, workdir=None):
+    """Chạy toàn bộ benchmark và trả về dict kết quả (có thể ghi ra JSON)
+
+    Cache kết quả trên đĩa bị tắt trong suốt lượt chạy: mỗi lần đo tính lại
+    stage thật sự (không phải nạp pickle) và dữ liệu tổng hợp không để lại
+    mục cache nào.
+    """
+    own_workdir = workdir is None
+    if own_workdir:
+        workdir = tempfile.mkdtemp(prefix="gps-bench-")
+    districts = load_district_index(DISTRICTS_PATH)
+    results = []
+    try:
+        with cache_disabled():
+            for size in sizes:
+                csv_path = os.path.join(workdir, f"gps_{size}.csv")
+                generate_synthetic_gps(size, seed=seed).to_csv(csv_path, index=False)
+                for stage, fn in _stage_functions(stages, csv_path, workdir, districts).items():
+                    print(f"[{size:>10}] {stage} ...", flush=True)
+                    times, peak, peak_rss = _measure(fn, warmup, trials)
+                    results.append(_summarize(stage, size, size, times, peak, peak_rss))
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'created_at': pd.Timestamp.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engines': sorted(TRIP_METRICS_ENGINES),
+            'warmup': warmup,
+            'trials': trials,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+def load_benchmark_results(path=BENCHMARK_RESULTS_PATH):
+    """Đọc kết quả benchmark đã lưu; trả về None nếu chưa có"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline GPS")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--stages", nargs="+", default=DEFAULT_STAGES, choices=DEFAULT_STAGES)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=BENCHMARK_RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.stages, args.warmup, args.trials, args.seed)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Đã ghi kết quả vào '{args.output}'")
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,52 @@
-import streamlit as st
-import pydeck as pdk
-import cudf
+import hashlib
+from collections import OrderedDict
+
 import geopandas as gpd
-from shapely.geometry import Point, Polygon, MultiPolygon
+import shapely
+from shapely import STRtree
 import numpy as np
 import pandas as pd
+from modules.district_index import as_district_index, district_geometries
+from modules.instrumentation import instrument
+from modules.result_cache import persistent_cache
+from modules.trip_index import get_trip_index
+
+try:
+    import cudf
+    import cuspatial
+except ImportError:
+    # Máy không có GPU: dùng đường CPU (pandas + STRtree)
+    cudf = None
+    cuspatial = None
+
+# cuspatial.point_in_polygon chỉ nhận tối đa 31 polygon mỗi lần gọi
+CUSPATIAL_MAX_POLYGONS = 31
+
+# Từ số điểm này, đường CPU tra lưới tứ phân trước rồi mới dùng STRtree
+RASTER_MIN_POINTS = 200_000
+# Lưới gốc RASTER_BASE_CELLS ô theo cạnh dài, chia tiếp RASTER_LEVELS lần
+# (ô cuối khoảng 20 m với ranh giới TP.HCM)
+RASTER_BASE_CELLS = 64
+RASTER_LEVELS = 6
+MAX_DISTRICT_RASTERS = 4
+# Nhãn ô: >= 0 là quận, OUTSIDE là ngoài mọi quận, AMBIGUOUS là ô cắt ranh giới
+OUTSIDE = -1
+AMBIGUOUS = -2
 
 # Hàm từ modules.bus_route_analysis
+@instrument()
 def create_point_in_polygon_index(districts):
-    """Create a spatial index for point-in-polygon queries using GeoPandas"""
-    # Chuyển dữ liệu districts["level2s"] thành GeoDataFrame
-    districts_gdf = gpd.GeoDataFrame(districts["level2s"])
-    
-    # Chuyển đổi coordinates thành Polygon hoặc MultiPolygon
-    geometries = []
-    for coords in districts_gdf['coordinates']:
-        # Kiểm tra cấu trúc của coords để xác định Polygon hay MultiPolygon
-        # Nếu coords[0][0][0] là số (float/int), thì đây là Polygon (một vòng duy nhất)
-        # Nếu coords[0][0][0] là danh sách, thì đây là MultiPolygon (nhiều vòng hoặc nhiều phần)
-        if len(coords) == 0:
-            # Trường hợp không có tọa độ, gán None
-            geometries.append(None)
-            continue
-        
-        if isinstance(coords[0][0][0], (int, float)):
-            # Đây là Polygon: coords là [[[...]]]
-            outer_ring = coords[0]
-            geometries.append(Polygon(outer_ring))
-        else:
-            # Đây là MultiPolygon: coords là [[[ [...], ... ], ...]]
-            polygons = []
-            for poly in coords:
-                # Mỗi poly là một Polygon, lấy vòng đầu tiên (outer ring)
-                outer_ring = poly[0]  # Lấy vòng đầu tiên (bỏ qua các lỗ nếu có)
-                polygons.append(Polygon(outer_ring))
-            geometries.append(MultiPolygon(polygons))
-    
-    districts_gdf['geometry'] = geometries
-    
-    # In thông tin để kiểm tra
-    # st.write(f"Số quận được tải: {len(districts_gdf)}")
-    # st.write("Tên các quận:", districts_gdf['name'].tolist())
-    # st.write("Cấu trúc coordinates mẫu (5 quận đầu tiên):")
-    # st.write(districts_gdf[['name', 'coordinates']].head().to_dict())
-    
+    """Create a spatial index for point-in-polygon queries using GeoPandas
+
+    ``districts`` có thể là GeoJSON thô hoặc index đã biên dịch từ
+    ``load_district_index``; hình học được tạo vectorized từ các mảng phẳng.
+    """
+    index = as_district_index(districts)
+    districts_gdf = gpd.GeoDataFrame({
+        'level2_id': index['ids'],
+        'name': index['names'],
+        'geometry': district_geometries(index),
+    })
     return districts_gdf
 
 def find_district_for_point(point, districts_gdf):
@@ -56,62 +59,217 @@ def find_district_for_point(point, districts_gdf):
             return row['name']
     return "Unknown"
 
-def analyze_bus_routes(gps_data, districts):
+def _explode_district_parts(districts_gdf):
+    """Tách MultiPolygon thành các Polygon đơn, kèm chỉ số quận sở hữu"""
+    parts = []
+    owners = []
+    for district_idx, geom in enumerate(districts_gdf['geometry']):
+        if geom is None:
+            continue
+        for part in getattr(geom, 'geoms', [geom]):
+            parts.append(part)
+            owners.append(district_idx)
+    return parts, np.asarray(owners, dtype=np.int64)
+
+def _district_indices_strtree(lons, lats, districts_gdf):
+    """Tra cứu quận cho mảng điểm bằng STRtree (CPU)"""
+    result = np.full(len(lons), -1, dtype=np.int64)
+    parts, owners = _explode_district_parts(districts_gdf)
+    if not parts or len(lons) == 0:
+        return result
+    tree = STRtree(parts)
+    points = shapely.points(lons, lats)
+    # predicate 'within': điểm nằm trong polygon <=> polygon.contains(điểm)
+    point_idx, part_idx = tree.query(points, predicate='within')
+    if len(point_idx) == 0:
+        return result
+    # Giống vòng lặp cũ: nếu một điểm thuộc nhiều quận thì lấy quận đứng trước
+    hit_owner = owners[part_idx]
+    order = np.lexsort((hit_owner, point_idx))
+    point_idx = point_idx[order]
+    hit_owner = hit_owner[order]
+    first = np.ones(len(point_idx), dtype=bool)
+    first[1:] = point_idx[1:] != point_idx[:-1]
+    result[point_idx[first]] = hit_owner[first]
+    return result
+
+class DistrictRaster:
+    """Lưới tứ phân gán sẵn quận cho các ô nằm trọn trong một quận
+
+    Ô không cắt polygon nào là ``OUTSIDE``, ô nằm trọn trong đúng một polygon
+    (``contains_properly``) mang chỉ số quận, các ô còn lại (cắt ranh giới)
+    được chia bốn ở mức sau. Điểm rơi vào ô đã gán nhãn được tra O(1), chỉ
+    điểm trong ô ranh giới ở mức cuối mới phải kiểm tra chính xác bằng STRtree.
+    """
+
+    def __init__(self, districts_gdf, base_cells=RASTER_BASE_CELLS, levels=RASTER_LEVELS):
+        parts, owners = _explode_district_parts(districts_gdf)
+        parts = np.asarray(parts, dtype=object)
+        self.levels = []
+        if len(parts) == 0:
+            self.x0 = self.y0 = 0.0
+            self.cell = 1.0
+            self.nx = self.ny = 0
+            return
+        shapely.prepare(parts)
+        tree = STRtree(parts)
+        self.x0, self.y0, x1, y1 = shapely.total_bounds(parts)
+        self.cell = max(x1 - self.x0, y1 - self.y0) / base_cells
+        self.nx = max(int(np.ceil((x1 - self.x0) / self.cell)), 1)
+        self.ny = max(int(np.ceil((y1 - self.y0) / self.cell)), 1)
+
+        # Mỗi mức: (khóa ô ix * ny_mức + iy đã sắp, nhãn); mức 0 phủ kín lưới
+        ix, iy = np.divmod(np.arange(self.nx * self.ny, dtype=np.int64), self.ny)
+        cell = self.cell
+        for level in range(levels + 1):
+            labels = self._classify(parts, owners, tree, ix, iy, cell)
+            keys = ix * (self.ny << level) + iy
+            order = np.argsort(keys)
+            self.levels.append((keys[order], labels[order]))
+            ambiguous = labels == AMBIGUOUS
+            ix = (ix[ambiguous, None] * 2 + np.array([0, 0, 1, 1])).ravel()
+            iy = (iy[ambiguous, None] * 2 + np.array([0, 1, 0, 1])).ravel()
+            cell /= 2
+
+    def _classify(self, parts, owners, tree, ix, iy, cell):
+        boxes = shapely.box(self.x0 + ix * cell, self.y0 + iy * cell, self.x0 + (ix + 1) * cell, self.y0 + (iy + 1) * cell)
+        box_idx, part_idx = tree.query(boxes, predicate='intersects')
+        hits = np.bincount(box_idx, minlength=len(boxes))
+        labels = np.where(hits == 0, OUTSIDE, AMBIGUOUS)
+        single = hits[box_idx] == 1
+        box_idx, part_idx = box_idx[single], part_idx[single]
+        inside = shapely.contains_properly(parts[part_idx], boxes[box_idx])
+        labels[box_idx[inside]] = owners[part_idx[inside]]
+        return labels
+
+    def lookup(self, lons, lats):
+        """Chỉ số quận của từng điểm; ``AMBIGUOUS`` với điểm cần kiểm tra chính xác"""
+        fx = (lons - self.x0) / self.cell
+        fy = (lats - self.y0) / self.cell
+        result = np.full(len(lons), OUTSIDE, dtype=np.int64)
+        # Điểm ngoài khung bao (kể cả NaN) không thuộc quận nào
+        pending = np.flatnonzero((fx >= 0) & (fx < self.nx) & (fy >= 0) & (fy < self.ny))
+        scale = 1
+        for level, (keys, labels) in enumerate(self.levels):
+            if len(pending) == 0:
+                break
+            # Chia ô cho lũy thừa của 2 là chính xác nên ô con luôn nằm trong ô cha
+            ix = np.floor(fx[pending] * scale).astype(np.int64)
+            iy = np.floor(fy[pending] * scale).astype(np.int64)
+            key = ix * (self.ny << level) + iy
+            pos = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            found = keys[pos] == key
+            label = np.where(found, labels[pos], AMBIGUOUS)
+            result[pending] = label
+            pending = pending[label == AMBIGUOUS]
+            scale *= 2
+        return result
+
+_district_rasters = OrderedDict()
+
+def get_district_raster(districts_gdf):
+    """Lưới tứ phân của ``districts_gdf``, chỉ tạo một lần cho mỗi bộ ranh giới"""
+    key = hashlib.sha1(b"".join(shapely.to_wkb(g) for g in districts_gdf['geometry'] if g is not None)).hexdigest()
+    raster = _district_rasters.get(key)
+    if raster is None:
+        raster = DistrictRaster(districts_gdf)
+        _district_rasters[key] = raster
+        while len(_district_rasters) > MAX_DISTRICT_RASTERS:
+            _district_rasters.popitem(last=False)
+    else:
+        _district_rasters.move_to_end(key)
+    return raster
+
+def _district_indices_raster(lons, lats, districts_gdf):
+    """Tra cứu quận qua lưới tứ phân, chỉ điểm gần ranh giới mới dùng STRtree"""
+    result = get_district_raster(districts_gdf).lookup(lons, lats)
+    ambiguous = np.flatnonzero(result == AMBIGUOUS)
+    if len(ambiguous):
+        result[ambiguous] = _district_indices_strtree(lons[ambiguous], lats[ambiguous], districts_gdf)
+    return result
+
+def _district_indices_cuspatial(lons, lats, districts_gdf):
+    """Tra cứu quận cho mảng điểm bằng cuspatial.point_in_polygon (GPU)"""
+    result = np.full(len(lons), np.iinfo(np.int64).max, dtype=np.int64)
+    parts, owners = _explode_district_parts(districts_gdf)
+    if not parts or len(lons) == 0:
+        return np.full(len(lons), -1, dtype=np.int64)
+    xy = np.column_stack((lons, lats)).astype(np.float64).ravel()
+    points = cuspatial.GeoSeries.from_points_xy(xy)
+    polygons = cuspatial.from_geopandas(gpd.GeoSeries(parts))
+    for start in range(0, len(parts), CUSPATIAL_MAX_POLYGONS):
+        stop = min(start + CUSPATIAL_MAX_POLYGONS, len(parts))
+        hits = cuspatial.point_in_polygon(points, polygons[start:stop]).to_pandas().values
+        batch_owner = np.where(hits, owners[start:stop][np.newaxis, :], np.iinfo(np.int64).max)
+        result = np.minimum(result, batch_owner.min(axis=1))
+    result[result == np.iinfo(np.int64).max] = -1
+    return result
+
+def _find_district_indices(lons, lats, districts_gdf, use_gpu=None):
+    """Chỉ số quận (theo dòng của ``districts_gdf``) của từng điểm, -1 nếu không thuộc quận nào"""
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    if use_gpu is None:
+        use_gpu = cuspatial is not None
+    if use_gpu:
+        return _district_indices_cuspatial(lons, lats, districts_gdf)
+    if len(lons) >= RASTER_MIN_POINTS:
+        return _district_indices_raster(lons, lats, districts_gdf)
+    return _district_indices_strtree(lons, lats, districts_gdf)
+
+def _district_names(districts_gdf):
+    """Tên quận theo chỉ số, phần tử cuối là "Unknown" cho chỉ số -1"""
+    return np.append(districts_gdf['name'].to_numpy(dtype=object), "Unknown")
+
+@instrument()
+def find_districts_for_points(lons, lats, districts_gdf, use_gpu=None):
+    """Tìm quận cho một loạt điểm trong một lần truy vấn không gian
+
+    Trả về mảng tên quận (``"Unknown"`` nếu điểm không thuộc quận nào).
+    ``use_gpu=None`` tự chọn cuSpatial khi có GPU, ngược lại dùng STRtree
+    (với từ ``RASTER_MIN_POINTS`` điểm thì tra lưới tứ phân trước).
+    """
+    # Chỉ số -1 trỏ tới phần tử cuối cùng là "Unknown"
+    return _district_names(districts_gdf)[_find_district_indices(lons, lats, districts_gdf, use_gpu)]
+
+@instrument()
+@persistent_cache()
+def analyze_bus_routes(gps_data, districts, use_gpu=None):
     """Analyze bus routes and determine their districts"""
     # Tạo spatial index bằng GeoPandas
     districts_gdf = create_point_in_polygon_index(districts)
     
-    # Convert GPS data to cuDF if it's not already
-    if not isinstance(gps_data, cudf.DataFrame):
-        gps_data = cudf.DataFrame(gps_data)
-    
-    # Group by trip_id and get first and last points
-    trip_points = gps_data.groupby('trip_id').agg({
-        'latitude': ['first', 'last'],
-        'longitude': ['first', 'last']
-    })
-    
-    # Flatten column names
-    trip_points.columns = ['_'.join(col).strip() for col in trip_points.columns.values]
-    
-    # Reset index to make trip_id a column
-    trip_points = trip_points.reset_index()
-    
-    # Create route analysis results
-    route_analysis = []
+    # Điểm đầu và điểm cuối (theo thời gian) của mỗi chuyến lấy thẳng từ chỉ
+    # mục chuyến dùng chung, không cần groupby
+    trip_index = get_trip_index(gps_data)
+    n_trips = trip_index.n_trips
+    endpoints = np.concatenate([trip_index.first_rows, trip_index.last_rows])
+    lons = gps_data['longitude'].to_numpy()[endpoints]
+    lats = gps_data['latitude'].to_numpy()[endpoints]
     
-    # Convert to pandas for iteration
-    trip_points_pd = trip_points.to_pandas()
+    # Tra cứu điểm đầu và điểm cuối cùng lúc trong một lần truy vấn
+    point_districts = find_districts_for_points(lons, lats, districts_gdf, use_gpu=use_gpu)
     
-    # Kiểm tra một số tọa độ GPS
-    st.write("Tọa độ GPS mẫu (5 dòng đầu):")
-    st.write(trip_points_pd.head())
-    
-    for _, row in trip_points_pd.iterrows():
-        start_point = Point(row['longitude_first'], row['latitude_first'])
-        end_point = Point(row['longitude_last'], row['latitude_last'])
-        
-        start_district = find_district_for_point(start_point, districts_gdf)
-        end_district = find_district_for_point(end_point, districts_gdf)
-        
-        route_analysis.append({
-            'trip_id': row['trip_id'],
-            'start_lat': row['latitude_first'],
-            'start_lon': row['longitude_first'],
-            'end_lat': row['latitude_last'],
-            'end_lon': row['longitude_last'],
-            'start_district': start_district,
-            'end_district': end_district
-        })
+    route_df = pd.DataFrame({
+        'trip_id': trip_index.trip_ids,
+        'start_lat': lats[:n_trips],
+        'start_lon': lons[:n_trips],
+        'end_lat': lats[n_trips:],
+        'end_lon': lons[n_trips:],
+        'start_district': point_districts[:n_trips],
+        'end_district': point_districts[n_trips:]
+    })
     
     # Convert to cuDF DataFrame
-    route_df = cudf.DataFrame(route_analysis)
+    if cudf is not None:
+        route_df = cudf.DataFrame(route_df)
     return route_df
 
+@instrument()
 def get_route_summary(route_analysis):
     """Generate summary statistics for bus routes"""
     # Convert to pandas if it's a cuDF DataFrame
-    if isinstance(route_analysis, cudf.DataFrame):
+    if cudf is not None and isinstance(route_analysis, cudf.DataFrame):
         route_analysis = route_analysis.to_pandas()
     
     # Count routes by district pairs
@@ -123,4 +281,67 @@ def get_route_summary(route_analysis):
     
     return district_pairs
 
- 
\ No newline at end of file
+ 
+@instrument()
+@persistent_cache()
+def analyze_district_traversals(gps_data, districts, use_gpu=None):
+    """Chuỗi quận mà mỗi chuyến đi qua và thời gian lưu lại ở từng quận
+
+    Mọi điểm GPS được tra quận trong một lượt, rồi mã hóa loạt (run-length)
+    theo thứ tự chuyến: mỗi dòng kết quả là một lần chuyến ở liên tục trong
+    một quận. ``dwell_s`` tính từ điểm đầu tiên trong quận tới điểm đầu tiên
+    ở quận kế tiếp (loạt cuối của chuyến tính tới điểm cuối cùng).
+    """
+    districts_gdf = create_point_in_polygon_index(districts)
+    trip_index = get_trip_index(gps_data)
+    names = _district_names(districts_gdf)
+    codes = trip_index.take(_find_district_indices(
+        gps_data['longitude'].to_numpy(), gps_data['latitude'].to_numpy(), districts_gdf, use_gpu
+    ))
+    ts_ns = trip_index.column(gps_data, 'timestamp').astype('datetime64[ns]').view(np.int64)
+
+    # Loạt mới bắt đầu ở điểm đầu mỗi chuyến hoặc khi quận đổi
+    run_start = np.ones(len(codes), dtype=bool)
+    run_start[1:] = ~trip_index.same_trip | (codes[1:] != codes[:-1])
+    starts = np.flatnonzero(run_start)
+    ends = np.append(starts[1:], len(codes))
+    trip_of_run = np.searchsorted(trip_index.offsets, starts, side='right') - 1
+    # Loạt kế tiếp cùng chuyến: rời quận lúc vào quận sau; ngược lại lúc điểm cuối
+    continues = np.zeros(len(starts), dtype=bool)
+    continues[:-1] = trip_of_run[1:] == trip_of_run[:-1]
+    leave_ns = np.where(continues, ts_ns[np.minimum(ends, len(codes) - 1)], ts_ns[ends - 1])
+    first_run = np.searchsorted(trip_of_run, np.arange(trip_index.n_trips))
+
+    return pd.DataFrame({
+        'trip_id': trip_index.trip_ids[trip_of_run],
+        'seq': np.arange(len(starts)) - first_run[trip_of_run],
+        'district': names[codes[starts]],
+        'enter_time': ts_ns[starts].view('datetime64[ns]'),
+        'leave_time': leave_ns.view('datetime64[ns]'),
+        'dwell_s': (leave_ns - ts_ns[starts]) / 1e9,
+        'n_points': ends - starts,
+    })
+
+@instrument()
+def get_trip_district_sequences(traversals):
+    """Mỗi chuyến một dòng: chuỗi quận đi qua, số quận khác nhau và tổng thời gian"""
+    grouped = traversals.groupby('trip_id', sort=False)
+    return pd.DataFrame({
+        'districts': grouped['district'].agg(' → '.join),
+        'n_districts': grouped['district'].nunique(),
+        'n_changes': grouped.size() - 1,
+        'duration_s': grouped['dwell_s'].sum(),
+    }).reset_index()
+
+@instrument()
+def get_district_dwell_summary(traversals):
+    """Thời gian lưu lại theo quận: số lượt vào, số chuyến, tổng/trung bình/trung vị (giây)"""
+    grouped = traversals.groupby('district')
+    summary = pd.DataFrame({
+        'visits': grouped.size(),
+        'trips': grouped['trip_id'].nunique(),
+        'total_dwell_s': grouped['dwell_s'].sum(),
+        'mean_dwell_s': grouped['dwell_s'].mean(),
+        'median_dwell_s': grouped['dwell_s'].median(),
+    })
+    return summary.sort_values('total_dwell_s', ascending=False).reset_index()
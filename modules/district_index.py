@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import shapely
+from shapely import GeometryType
+from modules.instrumentation import instrument
+
+# Các mảng được lưu trong cache (mỗi mảng một file .npy để có thể memory-map)
+INDEX_ARRAYS = ['xy', 'ring_offsets', 'part_offsets', 'geom_offsets', 'part_bboxes', 'bboxes']
+INDEX_VERSION = 1
+
+@instrument()
+def compile_districts(districts):
+    """Chuyển dữ liệu GeoJSON của các quận thành các mảng phẳng
+
+    Bố cục theo kiểu GeoArrow: ``xy`` chứa toàn bộ tọa độ, ``ring_offsets``
+    trỏ vào ``xy``, ``part_offsets`` trỏ vào các vòng và ``geom_offsets``
+    trỏ vào các phần (polygon) của từng quận. Giống code cũ, chỉ giữ vòng
+    ngoài của mỗi polygon (bỏ qua các lỗ).
+    """
+    names = []
+    ids = []
+    coords = []
+    ring_offsets = [0]
+    part_offsets = [0]
+    geom_offsets = [0]
+
+    for district in districts["level2s"]:
+        names.append(district["name"])
+        ids.append(district["level2_id"])
+        polygons = district["coordinates"]
+        # Polygon: coordinates[0][0][0] là số, MultiPolygon: là danh sách
+        if len(polygons) > 0 and isinstance(polygons[0][0][0], (int, float)):
+            polygons = [polygons]
+        for polygon in polygons:
+            outer_ring = np.asarray(polygon[0], dtype=np.float64)[:, :2]
+            coords.append(outer_ring)
+            ring_offsets.append(ring_offsets[-1] + len(outer_ring))
+            part_offsets.append(part_offsets[-1] + 1)
+        geom_offsets.append(len(part_offsets) - 1)
+
+    xy = np.concatenate(coords) if coords else np.empty((0, 2), dtype=np.float64)
+    ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+    part_offsets = np.asarray(part_offsets, dtype=np.int64)
+    geom_offsets = np.asarray(geom_offsets, dtype=np.int64)
+
+    # Bounding box của từng phần: (minx, miny, maxx, maxy)
+    n_parts = len(part_offsets) - 1
+    part_bboxes = np.empty((n_parts, 4), dtype=np.float64)
+    if n_parts:
+        starts = ring_offsets[part_offsets[:-1]]
+        part_bboxes[:, 0] = np.minimum.reduceat(xy[:, 0], starts)
+        part_bboxes[:, 1] = np.minimum.reduceat(xy[:, 1], starts)
+        part_bboxes[:, 2] = np.maximum.reduceat(xy[:, 0], starts)
+        part_bboxes[:, 3] = np.maximum.reduceat(xy[:, 1], starts)
+
+    # Bounding box của từng quận (NaN nếu quận không có tọa độ)
+    bboxes = np.full((len(names), 4), np.nan, dtype=np.float64)
+    for i in range(len(names)):
+        start, stop = geom_offsets[i], geom_offsets[i + 1]
+        if stop > start:
+            bboxes[i, :2] = part_bboxes[start:stop, :2].min(axis=0)
+            bboxes[i, 2:] = part_bboxes[start:stop, 2:].max(axis=0)
+
+    return {
+        'names': names,
+        'ids': ids,
+        'xy': xy,
+        'ring_offsets': ring_offsets,
+        'part_offsets': part_offsets,
+        'geom_offsets': geom_offsets,
+        'part_bboxes': part_bboxes,
+        'bboxes': bboxes,
+    }
+
+def _source_key(file_path):
+    """Khóa cache từ hash nội dung và mtime của file nguồn"""
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    return f"{digest.hexdigest()[:16]}-{mtime_ns}"
+
+def _save_index(index, index_dir):
+    """Ghi index ra thư mục tạm rồi đổi tên để tránh cache ghi dở"""
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), index[name])
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({'version': INDEX_VERSION, 'names': index['names'], 'ids': index['ids']}, f, ensure_ascii=False)
+    try:
+        os.rename(tmp_dir, index_dir)
+    except OSError:
+        # Một tiến trình khác đã ghi xong trước
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+def _load_index(index_dir):
+    """Đọc index đã lưu, memory-map các mảng tọa độ"""
+    with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get('version') != INDEX_VERSION:
+        return None
+    index = {'names': meta['names'], 'ids': meta['ids']}
+    for name in INDEX_ARRAYS:
+        index[name] = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+    return index
+
+@instrument()
+def load_district_index(file_path, cache_dir=None):
+    """Đọc index quận đã biên dịch, chỉ parse GeoJSON khi file nguồn thay đổi"""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), ".cache")
+    index_dir = os.path.join(cache_dir, f"districts-{_source_key(file_path)}")
+
+    if os.path.isdir(index_dir):
+        index = _load_index(index_dir)
+        if index is not None:
+            return index
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        index = compile_districts(json.load(f))
+    os.makedirs(cache_dir, exist_ok=True)
+    _save_index(index, index_dir)
+    return index
+
+def as_district_index(districts):
+    """Nhận GeoJSON thô hoặc index đã biên dịch, luôn trả về index"""
+    if "level2s" in districts:
+        return compile_districts(districts)
+    return districts
+
+def district_geometries(index):
+    """Tạo mảng MultiPolygon shapely cho từng quận trong một lần gọi vectorized"""
+    return shapely.from_ragged_array(
+        GeometryType.MULTIPOLYGON,
+        np.asarray(index['xy']),
+        (np.asarray(index['ring_offsets']), np.asarray(index['part_offsets']), np.asarray(index['geom_offsets'])),
+    )
+
+def district_part_rings(index):
+    """Trả về (tên quận, id quận, mảng tọa độ vòng ngoài) cho từng polygon"""
+    xy = index['xy']
+    ring_offsets = index['ring_offsets']
+    part_offsets = index['part_offsets']
+    geom_offsets = index['geom_offsets']
+    for i, (name, district_id) in enumerate(zip(index['names'], index['ids'])):
+        for part in range(geom_offsets[i], geom_offsets[i + 1]):
+            ring = part_offsets[part]
+            yield name, district_id, xy[ring_offsets[ring]:ring_offsets[ring + 1]]
@@ -1,8 +1,25 @@
 import pandas as pd
-import cudf
 import numpy as np
 import time
-import cuspatial
+from modules.gps_store import read_gps, iter_gps_chunks, gps_row_count
+from modules.instrumentation import instrument
+from modules.trip_index import TripIndex
+
+try:
+    import cudf
+    import cuspatial
+except ImportError:
+    # Máy chỉ có CPU: engine cudf không khả dụng
+    cudf = None
+    cuspatial = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Các cột cần cho việc tính chỉ số chuyến đi
+TRIP_METRICS_COLUMNS = ['trip_id', 'timestamp', 'latitude', 'longitude']
 
 
 def haversine_vectorized(lat1, lon1, lat2, lon2):
@@ -17,13 +34,13 @@ def haversine_vectorized(lat1, lon1, lat2, lon2):
     r = 6371
     return c * r
 
-def calculate_trip_metrics_pandas(file_path):
+@instrument()
+def calculate_trip_metrics_pandas(file_path, start=None, end=None):
     timings = {}
-    # t = time.perf_counter()
-    pds_gps = pd.read_csv(file_path) 
-    # timings['load_data'] = time.perf_counter() - t
-    # Chuyển đổi cột 'timestamp' sang kiểu datetime bằng cudf
-    pds_gps['timestamp'] = pd.to_datetime(pds_gps['timestamp'])
+    t = time.perf_counter()
+    # Đọc từ cache Parquet đã có kiểu dữ liệu, không cần parse lại timestamp
+    pds_gps = read_gps(file_path, columns=TRIP_METRICS_COLUMNS, start=start, end=end)
+    timings['load_data'] = time.perf_counter() - t
     
     t0 = time.perf_counter()
     pds_gps = pds_gps.sort_values(['trip_id', 'timestamp']).copy()
@@ -76,13 +93,12 @@ def calculate_trip_metrics_pandas(file_path):
     timings['total'] = sum(timings.values())
     return result, timings
 
-def calculate_trip_metrics_cudf(file_path):
+@instrument()
+def calculate_trip_metrics_cudf(file_path, start=None, end=None):
     timings = {}
-    # t = time.perf_counter()
-    cudf_gps = cudf.read_csv(file_path)
-    cudf_gps = cudf.DataFrame(cudf_gps)
-    cudf_gps['timestamp'] = cudf.to_datetime(cudf_gps['timestamp'])
-    # timings['load_data'] = time.perf_counter() - t
+    t = time.perf_counter()
+    cudf_gps = read_gps(file_path, columns=TRIP_METRICS_COLUMNS, start=start, end=end, engine='cudf')
+    timings['load_data'] = time.perf_counter() - t
     
     t0 = time.perf_counter()
     cudf_gps = cudf_gps.sort_values(['trip_id', 'timestamp'])
@@ -137,3 +153,316 @@ def calculate_trip_metrics_cudf(file_path):
 
     timings['total'] = sum(timings.values())
     return result.to_pandas(), timings
+
+def _format_trip_metrics(trip_ids, distance, duration_hours):
+    """Tạo bảng kết quả cùng cột và cách làm tròn với các engine gốc"""
+    return pd.DataFrame({
+        'trip_id': trip_ids,
+        'total_distance_km': np.round(distance, 2),
+        'duration_hours': np.round(duration_hours, 2),
+        'avg_speed_kmh': np.round(distance / duration_hours, 2),
+    })
+
+# Số dòng mỗi chunk khi đọc file ngoài bộ nhớ (quyết định bộ nhớ tối đa)
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+def _trip_fragments(chunk):
+    """Tính tổng hợp một phần cho từng chuyến trong một chunk đã đọc"""
+    chunk = chunk.sort_values(['trip_id', 'timestamp'], kind='stable')
+    trip_ids = chunk['trip_id'].to_numpy()
+    lat = chunk['latitude'].to_numpy(dtype=np.float64)
+    lon = chunk['longitude'].to_numpy(dtype=np.float64)
+    ts = chunk['timestamp'].to_numpy()
+    n = len(chunk)
+
+    same_trip = trip_ids[1:] == trip_ids[:-1]
+    # Khoảng cách từ mỗi điểm tới điểm kế tiếp; điểm cuối chuyến bằng 0
+    segment = np.zeros(n, dtype=np.float64)
+    segment[:-1] = haversine_vectorized(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    segment[:-1][~same_trip] = 0.0
+
+    starts = np.flatnonzero(np.concatenate(([True], ~same_trip)))
+    ends = np.append(starts[1:], n) - 1
+    n_rows = ends - starts + 1
+    # Thời điểm của điểm áp chót (NaT nếu mảnh chỉ có một điểm)
+    prev_ts = ts[np.maximum(ends - 1, starts)].copy()
+    prev_ts[n_rows < 2] = np.datetime64('NaT')
+
+    return pd.DataFrame({
+        'trip_id': trip_ids[starts],
+        'first_ts': ts[starts],
+        'first_lat': lat[starts],
+        'first_lon': lon[starts],
+        'last_ts': ts[ends],
+        'last_lat': lat[ends],
+        'last_lon': lon[ends],
+        'prev_ts': prev_ts,
+        'distance': np.add.reduceat(segment, starts),
+        'n_rows': n_rows,
+    })
+
+def _merge_trip_fragments(fragments):
+    """Ghép các mảnh của cùng một chuyến đến từ các chunk khác nhau
+
+    Các mảnh được nối theo thời gian và cộng thêm đoạn nối giữa điểm cuối
+    của mảnh trước với điểm đầu của mảnh sau. Kết quả chỉ chính xác khi các
+    mảnh của một chuyến không chồng lấn thời gian (file sắp theo chuyến hoặc
+    theo thời gian), nên trường hợp chồng lấn sẽ báo lỗi.
+    """
+    fragments = fragments.sort_values(['trip_id', 'first_ts'], kind='stable').reset_index(drop=True)
+    trip_ids = fragments['trip_id'].to_numpy()
+    continues = np.concatenate(([False], trip_ids[1:] == trip_ids[:-1]))
+
+    prev_last_ts = fragments['last_ts'].shift(1)
+    overlap = continues & (fragments['first_ts'] < prev_last_ts).to_numpy()
+    if overlap.any():
+        raise ValueError(
+            "Dữ liệu của một chuyến đi bị xen kẽ thời gian giữa các chunk; "
+            "hãy sắp xếp file theo (trip_id, timestamp) hoặc theo timestamp."
+        )
+
+    gap = haversine_vectorized(
+        fragments['last_lat'].shift(1).to_numpy(),
+        fragments['last_lon'].shift(1).to_numpy(),
+        fragments['first_lat'].to_numpy(),
+        fragments['first_lon'].to_numpy()
+    )
+    fragments['distance'] = fragments['distance'] + np.where(continues, gap, 0.0)
+    # Thời điểm bắt đầu đoạn cuối: điểm áp chót của mảnh, hoặc điểm cuối của
+    # mảnh trước nếu mảnh hiện tại chỉ có một điểm
+    fragments['prev_ts'] = fragments['prev_ts'].where(
+        fragments['n_rows'] >= 2,
+        prev_last_ts.where(continues)
+    )
+
+    trips = fragments.groupby('trip_id', sort=True).agg(
+        distance=('distance', 'sum'),
+        first_ts=('first_ts', 'first'),
+        prev_ts=('prev_ts', 'last'),
+        n_rows=('n_rows', 'sum'),
+    ).reset_index()
+    # Giống bản trong bộ nhớ: chuyến chỉ có một điểm không có đoạn nào
+    return trips[trips['n_rows'] >= 2]
+
+@instrument()
+def calculate_trip_metrics_chunked(file_path, start=None, end=None, chunksize=DEFAULT_CHUNK_ROWS):
+    """Tính chỉ số chuyến đi bằng cách đọc file theo từng chunk
+
+    Bộ nhớ tối đa tỉ lệ với ``chunksize`` cộng với một dòng tổng hợp cho mỗi
+    (chunk, chuyến). Kết quả giống ``calculate_trip_metrics_pandas``; với
+    ``start``/``end`` chỉ các dòng trong khoảng [start, end) được tính.
+    """
+    timings = {'load_data': 0.0, 'chunks': 0.0}
+    fragments = []
+    reader = iter_gps_chunks(file_path, chunksize, columns=TRIP_METRICS_COLUMNS)
+    while True:
+        t = time.perf_counter()
+        chunk = next(reader, None)
+        if chunk is None:
+            break
+        if start is not None:
+            chunk = chunk[chunk['timestamp'] >= pd.Timestamp(start)]
+        if end is not None:
+            chunk = chunk[chunk['timestamp'] < pd.Timestamp(end)]
+        timings['load_data'] += time.perf_counter() - t
+        if chunk.empty:
+            continue
+
+        t = time.perf_counter()
+        fragments.append(_trip_fragments(chunk))
+        timings['chunks'] += time.perf_counter() - t
+
+    t = time.perf_counter()
+    if fragments:
+        trips = _merge_trip_fragments(pd.concat(fragments, ignore_index=True))
+        result = _format_trip_metrics(
+            trips['trip_id'].to_numpy(),
+            trips['distance'].to_numpy(),
+            (trips['prev_ts'] - trips['first_ts']).dt.total_seconds().to_numpy() / 3600
+        )
+    else:
+        # Không có dòng nào trong khoảng thời gian
+        result = _format_trip_metrics(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+    timings['merge_calc'] = time.perf_counter() - t
+
+    timings['total'] = sum(timings.values())
+    return result, timings
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _trip_metrics_kernel(trip_ids, lat, lon, ts_ns):
+        """Một vòng lặp qua dữ liệu đã sắp theo (trip_id, timestamp)"""
+        n = len(trip_ids)
+        out_ids = np.empty(n, dtype=trip_ids.dtype)
+        out_distance = np.zeros(n, dtype=np.float64)
+        out_first = np.empty(n, dtype=np.int64)
+        out_prev = np.empty(n, dtype=np.int64)
+        n_trips = 0
+        start = 0
+        for i in range(1, n + 1):
+            if i < n and trip_ids[i] == trip_ids[start]:
+                continue
+            # Chuyến [start, i): bỏ qua chuyến chỉ có một điểm như bản pandas
+            if i - start >= 2:
+                distance = 0.0
+                for j in range(start, i - 1):
+                    lat1 = np.radians(lat[j])
+                    lat2 = np.radians(lat[j + 1])
+                    dlat = lat2 - lat1
+                    dlon = np.radians(lon[j + 1]) - np.radians(lon[j])
+                    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+                    distance += 2 * np.arcsin(np.sqrt(a)) * 6371
+                out_ids[n_trips] = trip_ids[start]
+                out_distance[n_trips] = distance
+                out_first[n_trips] = ts_ns[start]
+                out_prev[n_trips] = ts_ns[i - 2]
+                n_trips += 1
+            start = i
+        return out_ids[:n_trips], out_distance[:n_trips], out_first[:n_trips], out_prev[:n_trips]
+
+@instrument()
+def calculate_trip_metrics_numba(file_path, start=None, end=None):
+    """Engine CPU biên dịch JIT bằng Numba"""
+    timings = {}
+    t = time.perf_counter()
+    gps = read_gps(file_path, columns=TRIP_METRICS_COLUMNS, start=start, end=end)
+    timings['load_data'] = time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    ts_ns = gps['timestamp'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    trip_ids = gps['trip_id'].to_numpy()
+    index = TripIndex(trip_ids, ts_ns.view('datetime64[ns]'))
+    timings['sort'] = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    ids, distance, first_ns, prev_ns = _trip_metrics_kernel(
+        index.take(trip_ids),
+        index.take(gps['latitude'].to_numpy(dtype=np.float64)),
+        index.take(gps['longitude'].to_numpy(dtype=np.float64)),
+        index.take(ts_ns)
+    )
+    timings['kernel'] = time.perf_counter() - t1
+
+    t2 = time.perf_counter()
+    result = _format_trip_metrics(ids, distance, (prev_ns - first_ns) / 3.6e12)
+    timings['merge_calc'] = time.perf_counter() - t2
+
+    timings['total'] = sum(timings.values())
+    return result, timings
+
+@instrument()
+def calculate_trip_metrics_numpy(file_path, start=None, end=None):
+    """Engine CPU một lượt bằng NumPy, không tạo DataFrame trung gian
+
+    Dữ liệu được sắp một lần theo (trip_id, timestamp) qua ``TripIndex``
+    (bỏ qua nếu đã sắp sẵn); ranh giới chuyến là các offset vào mảng đã sắp,
+    khoảng cách từng đoạn tính một lần trên toàn mảng và cộng theo chuyến
+    bằng ``np.add.reduceat``.
+    """
+    timings = {}
+    t = time.perf_counter()
+    gps = read_gps(file_path, columns=TRIP_METRICS_COLUMNS, start=start, end=end)
+    timings['load_data'] = time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    index = TripIndex.from_frame(gps)
+    ts_ns = index.column(gps, 'timestamp').astype('datetime64[ns]').view(np.int64)
+    lat = np.radians(index.column(gps, 'latitude', dtype=np.float64))
+    lon = np.radians(index.column(gps, 'longitude', dtype=np.float64))
+    timings['sort'] = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    same_trip = index.same_trip
+    starts = index.offsets[:-1]
+    ends = index.offsets[1:]
+    # Chuyến chỉ có một điểm không có đoạn nào (giống bản pandas)
+    keep = ends - starts >= 2
+
+    # Haversine cho đoạn i -> i+1, đoạn nối hai chuyến được gán 0
+    cos_lat = np.cos(lat)
+    a = np.sin(np.diff(lat) / 2) ** 2 + cos_lat[:-1] * cos_lat[1:] * np.sin(np.diff(lon) / 2) ** 2
+    segment = 2 * 6371 * np.arcsin(np.sqrt(a))
+    segment[~same_trip] = 0.0
+    # reduceat trên các chuyến có đoạn; mảng đoạn ngắn hơn mảng điểm một phần tử
+    seg_starts = starts[keep]
+    distance = np.add.reduceat(segment, seg_starts) if len(seg_starts) else np.empty(0)
+    duration_hours = (ts_ns[ends[keep] - 2] - ts_ns[seg_starts]) / 3.6e12
+    timings['kernel'] = time.perf_counter() - t1
+
+    t2 = time.perf_counter()
+    result = _format_trip_metrics(index.trip_ids[keep], distance, duration_hours)
+    timings['merge_calc'] = time.perf_counter() - t2
+
+    timings['total'] = sum(timings.values())
+    return result, timings
+
+# Ngưỡng số dòng cho việc chọn engine tự động: dưới ngưỡng, chi phí cố định
+# của cuDF (khởi tạo CUDA, copy lên GPU) lớn hơn phần tiết kiệm được
+CUDF_MIN_ROWS = 500_000
+NUMBA_MIN_ROWS = 100_000
+# Engine đọc theo chunk được chọn khi dữ liệu trong bộ nhớ (ước lượng
+# TRIP_METRICS_BYTES_PER_ROW byte mỗi dòng, gồm các bản sao khi sắp xếp)
+# vượt CHUNKED_MEMORY_FRACTION bộ nhớ còn trống, hoặc vượt CHUNKED_MIN_ROWS
+# dòng nếu không đọc được bộ nhớ còn trống
+TRIP_METRICS_BYTES_PER_ROW = 128
+CHUNKED_MEMORY_FRACTION = 0.5
+CHUNKED_MIN_ROWS = 50_000_000
+
+# Registry engine: tên -> hàm (file_path, start=None, end=None) -> (result, timings)
+TRIP_METRICS_ENGINES = {}
+
+def register_trip_metrics_engine(name, func):
+    """Đăng ký một engine tính chỉ số chuyến đi"""
+    TRIP_METRICS_ENGINES[name] = func
+
+register_trip_metrics_engine('pandas', calculate_trip_metrics_pandas)
+register_trip_metrics_engine('numpy', calculate_trip_metrics_numpy)
+register_trip_metrics_engine('chunked', calculate_trip_metrics_chunked)
+if cudf is not None:
+    register_trip_metrics_engine('cudf', calculate_trip_metrics_cudf)
+if numba is not None:
+    register_trip_metrics_engine('numba', calculate_trip_metrics_numba)
+
+def _available_memory_bytes():
+    """Bộ nhớ còn trống (MemAvailable, Linux); None nếu không đọc được"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def select_trip_metrics_engine(n_rows, available_bytes=None):
+    """Chọn engine theo backend khả dụng, số dòng đầu vào và bộ nhớ còn trống"""
+    if available_bytes is None:
+        available_bytes = _available_memory_bytes()
+    if available_bytes is not None:
+        too_large = n_rows * TRIP_METRICS_BYTES_PER_ROW > CHUNKED_MEMORY_FRACTION * available_bytes
+    else:
+        too_large = n_rows >= CHUNKED_MIN_ROWS
+    if too_large:
+        return 'chunked'
+    if 'cudf' in TRIP_METRICS_ENGINES and n_rows >= CUDF_MIN_ROWS:
+        return 'cudf'
+    if 'numba' in TRIP_METRICS_ENGINES and n_rows >= NUMBA_MIN_ROWS:
+        return 'numba'
+    return 'numpy'
+
+@instrument()
+def calculate_trip_metrics(file_path, engine='auto', start=None, end=None):
+    """Điểm vào chung cho việc tính chỉ số chuyến đi
+
+    ``engine='auto'`` chọn engine theo số dòng trong khoảng [start, end)
+    (ước lượng từ metadata Parquet) và bộ nhớ còn trống; dữ liệu quá lớn
+    được tính theo chunk (``'chunked'``). Truyền tên engine để ép dùng một
+    engine cụ thể.
+    """
+    if engine == 'auto':
+        engine = select_trip_metrics_engine(gps_row_count(file_path, start, end))
+    if engine not in TRIP_METRICS_ENGINES:
+        raise ValueError(f"Engine '{engine}' không khả dụng. Các engine có: {sorted(TRIP_METRICS_ENGINES)}")
+    result, timings = TRIP_METRICS_ENGINES[engine](file_path, start=start, end=end)
+    result.attrs['engine'] = engine
+    return result, timings
@@ -0,0 +1,135 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from modules.instrumentation import instrument
+from modules.result_cache import file_fingerprint, tag_source
+
+# Kiểu dữ liệu cố định của file GPS (cùng schema với fake_hcmc_road_gps_data.csv)
+GPS_SCHEMA = pa.schema([
+    ('trip_id', pa.int64()),
+    ('timestamp', pa.timestamp('ns')),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('simulated_speed_kmh', pa.float32()),
+])
+
+# Số dòng mỗi row group. Dữ liệu được sắp theo (trip_id, timestamp) để
+# TripIndex dùng thẳng thứ tự dòng, không phải lexsort; các chuyến có mã gần
+# nhau chạy trong khoảng thời gian gần nhau nên min/max timestamp của row group
+# vẫn giúp bộ lọc thời gian bỏ qua phần lớn row group
+ROW_GROUP_ROWS = 256_000
+# Tăng khi thứ tự hoặc schema của file Parquet thay đổi để tạo lại cache cũ
+PARQUET_CACHE_VERSION = 2
+
+def _parquet_cache_path(csv_path, cache_dir=None):
+    """Đường dẫn file Parquet tương ứng, đổi tên khi CSV nguồn thay đổi"""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), ".cache")
+    stat = os.stat(csv_path)
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{stat.st_size}-{stat.st_mtime_ns}-v{PARQUET_CACHE_VERSION}.parquet")
+
+@instrument()
+def ensure_gps_parquet(file_path, cache_dir=None, row_group_rows=ROW_GROUP_ROWS):
+    """Chuyển CSV GPS sang Parquet một lần và trả về đường dẫn Parquet
+
+    File Parquet được sắp theo ``trip_id`` rồi ``timestamp`` (thứ tự TripIndex cần).
+    Nếu ``file_path`` đã là Parquet thì trả về nguyên đường dẫn.
+    """
+    if file_path.endswith(".parquet"):
+        return file_path
+    parquet_path = _parquet_cache_path(file_path, cache_dir)
+    if os.path.exists(parquet_path):
+        return parquet_path
+
+    table = pv.read_csv(
+        file_path,
+        convert_options=pv.ConvertOptions(column_types=GPS_SCHEMA),
+    )
+    table = table.select(GPS_SCHEMA.names).cast(GPS_SCHEMA)
+    table = table.sort_by([('trip_id', 'ascending'), ('timestamp', 'ascending')])
+
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+    tmp_path = f"{parquet_path}.tmp-{os.getpid()}"
+    pq.write_table(table, tmp_path, row_group_size=row_group_rows, compression='zstd')
+    os.replace(tmp_path, parquet_path)
+    return parquet_path
+
+def _time_filters(start=None, end=None):
+    """Bộ lọc thời gian [start, end) cho predicate pushdown"""
+    filters = []
+    if start is not None:
+        filters.append(('timestamp', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('timestamp', '<', pd.Timestamp(end)))
+    return filters or None
+
+def gps_source_key(file_path, start=None, end=None):
+    """Khóa nguồn chuẩn của dữ liệu đọc từ ``file_path`` trong khoảng [start, end)"""
+    key = f"file:{file_fingerprint(file_path)}"
+    if start is not None or end is not None:
+        key += f":{start}:{end}"
+    return key
+
+@instrument()
+def read_gps(file_path, columns=None, start=None, end=None, engine='pandas'):
+    """Đọc dữ liệu GPS từ cache Parquet, chỉ lấy các cột và khoảng thời gian cần
+
+    ``engine='cudf'`` đọc thẳng lên GPU bằng ``cudf.read_parquet``. Kết quả được
+    gắn khóa nguồn ``gps_source_key`` (xem ``result_cache.tagged_source``).
+    """
+    parquet_path = ensure_gps_parquet(file_path)
+    filters = _time_filters(start, end)
+    if engine == 'cudf':
+        import cudf
+        gps = cudf.read_parquet(parquet_path, columns=columns, filters=filters)
+    else:
+        gps = pq.read_table(parquet_path, columns=columns, filters=filters).to_pandas()
+    return tag_source(gps, gps_source_key(file_path, start, end))
+
+def gps_row_count(file_path, start=None, end=None):
+    """Số dòng của tập dữ liệu, đọc từ metadata Parquet (không quét dữ liệu)
+
+    Với ``start``/``end``, số dòng trong khoảng [start, end) được ước lượng từ
+    min/max ``timestamp`` của từng row group, coi các dòng phân bố đều trong
+    khoảng thời gian của row group.
+    """
+    metadata = pq.ParquetFile(ensure_gps_parquet(file_path)).metadata
+    if start is None and end is None:
+        return metadata.num_rows
+    lo = pd.Timestamp(start).value if start is not None else None
+    hi = pd.Timestamp(end).value if end is not None else None
+    column = metadata.schema.names.index('timestamp')
+    total = 0.0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        stats = row_group.column(column).statistics
+        if stats is None or not stats.has_min_max:
+            # Không có thống kê: tính cả row group
+            total += row_group.num_rows
+            continue
+        group_lo, group_hi = pd.Timestamp(stats.min).value, pd.Timestamp(stats.max).value
+        overlap_lo = group_lo if lo is None else max(group_lo, lo)
+        overlap_hi = group_hi if hi is None else min(group_hi, hi)
+        if group_hi == group_lo:
+            total += row_group.num_rows if overlap_lo <= group_lo and (hi is None or group_lo < hi) else 0
+        elif overlap_hi > overlap_lo:
+            total += row_group.num_rows * (overlap_hi - overlap_lo) / (group_hi - group_lo)
+    return int(round(total))
+
+def iter_gps_chunks(file_path, chunksize, columns=None):
+    """Duyệt dữ liệu GPS theo từng chunk pandas mà không đọc cả file vào bộ nhớ
+
+    CSV được đọc trực tiếp (không chuyển sang Parquet, vì việc chuyển đổi cần
+    đọc toàn bộ file); Parquet được đọc theo batch.
+    """
+    if file_path.endswith(".parquet"):
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+    for chunk in pd.read_csv(file_path, chunksize=chunksize, usecols=columns):
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+        yield chunk
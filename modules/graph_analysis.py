@@ -1,112 +1,396 @@
-import cugraph
-import cudf
+"""Phân tích đồ thị di chuyển bằng cuGraph hoặc backend CPU (``modules.graph_cpu``)
+
+``GraphAnalyticsSession`` tạo đồ thị và tính từng độ đo (PageRank, cộng đồng,
+betweenness, eigenvector) khi được truy cập lần đầu rồi ghi nhớ lại; độ đo
+không được dùng thì không tốn chi phí. Kết quả từng độ đo còn được cache trên
+đĩa theo dữ liệu, cách tạo nút, backend và tham số.
+"""
+import functools
+import time
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
-from sklearn.cluster import DBSCAN
-import cuml
 import geopandas as gpd
-from shapely.geometry import Point
+from modules.instrumentation import instrument
+from modules.result_cache import fingerprint, persistent_cache
+from modules.trip_index import get_trip_index
+from modules.graph_nodes import DEFAULT_NODE_METHOD, assign_nodes
+from modules import graph_cpu
+
+try:
+    import cugraph
+    import cudf
+except ImportError:
+    cugraph = None
+    cudf = None
+
+# Số phiên đồ thị giữ trong bộ nhớ (mỗi phiên giữ một đồ thị)
+MAX_GRAPH_SESSIONS = 4
+# Betweenness ước lượng: số đỉnh nguồn mặc định và số nhóm để ước lượng sai số
+DEFAULT_BETWEENNESS_SAMPLES = 256
+BETWEENNESS_REPLICATES = 4
+BOOTSTRAP_ROUNDS = 200
+
+def _build_cugraph(edges_df):
+    edges_df = cudf.DataFrame(edges_df)
+    # Tạo đồ thị với store_transposed=True để tối ưu hiệu suất
+    G = cugraph.Graph(directed=False)
+    G.from_cudf_edgelist(edges_df, source='source', destination='target', edge_attr='weight', store_transposed=True)
+    return G
 
-def create_movement_graph(gps_data, eps=0.1, min_samples=5):
-    """Tạo đồ thị di chuyển từ dữ liệu GPS"""
-    # Tạo GeoDataFrame (giữ nguyên vì cần cho geospatial)
-    geometry = [Point(xy) for xy in zip(gps_data['longitude'], gps_data['latitude'])]
+# Registry backend: tên -> hàm (danh sách cạnh pandas) -> đồ thị
+GRAPH_BACKENDS = {}
+
+def register_graph_backend(name, build):
+    """Đăng ký một backend đồ thị"""
+    GRAPH_BACKENDS[name] = build
+
+register_graph_backend('cpu', graph_cpu.CSRGraph.from_edgelist)
+if cugraph is not None:
+    register_graph_backend('cugraph', _build_cugraph)
+
+def select_graph_backend():
+    """Dùng cuGraph nếu có GPU, ngược lại backend CPU"""
+    return 'cugraph' if 'cugraph' in GRAPH_BACKENDS else 'cpu'
+
+def _algorithms(G):
+    """Module chứa các thuật toán cho đồ thị ``G`` (cuGraph hoặc graph_cpu)"""
+    return graph_cpu if isinstance(G, graph_cpu.CSRGraph) else cugraph
+
+def _to_pandas(df):
+    return df.to_pandas() if hasattr(df, 'to_pandas') else df
+
+@instrument()
+def create_movement_graph(gps_data, method=DEFAULT_NODE_METHOD, backend='auto', **node_params):
+    """Tạo đồ thị di chuyển từ dữ liệu GPS
+
+    ``method`` là chiến lược gán nút trong ``modules.graph_nodes`` ('grid' với
+    ``cell_size_m``, hoặc 'dbscan' với ``eps``/``min_samples``; mặc định
+    ``DEFAULT_NODE_METHOD`` là 'dbscan' như bản gốc nếu có cuML/scikit-learn);
+    ``backend`` là 'cugraph', 'cpu' hoặc 'auto'. Trả về (G, gdf, stats); G là None nếu
+    không tạo được cạnh nào, ``stats`` là các dòng thống kê để hiển thị.
+    """
+    # cuDF (ví dụ read_gps(engine='cudf')): GeoDataFrame cần bản pandas
+    if not isinstance(gps_data, pd.DataFrame) and hasattr(gps_data, 'to_pandas'):
+        gps_data = gps_data.to_pandas()
+    stats = [
+        f"Số điểm GPS: {len(gps_data)}",
+        f"Số chuyến đi: {gps_data['trip_id'].nunique()}",
+    ]
+    
+    # Tạo GeoDataFrame (giữ nguyên vì cần cho geospatial), hình học tạo vectorized
+    geometry = gpd.points_from_xy(gps_data['longitude'], gps_data['latitude'])
     gdf = gpd.GeoDataFrame(gps_data, geometry=geometry, crs="EPSG:4326")
     
-    # Sử dụng cuml.DBSCAN thay vì sklearn
-    coords = np.column_stack((gdf.geometry.x, gdf.geometry.y))
-    coords_cudf = cudf.DataFrame(coords, columns=['longitude', 'latitude'])
+    labels = assign_nodes(gps_data, method, **node_params)
+    gdf['cluster'] = labels
     
-    clustering = cuml.DBSCAN(eps=eps, min_samples=min_samples).fit(coords_cudf)
-    # Convert labels to numpy array directly
-    gdf['cluster'] = clustering.labels_.values_host
+    # Thống kê số nút
+    unique_clusters = np.unique(labels)
+    num_clusters = len(unique_clusters) - (1 if -1 in unique_clusters else 0)  # Trừ nhiễu
+    stats.append(f"Số nút được tạo ({method}): {num_clusters}")
+    stats.append(f"Số điểm nhiễu: {(labels == -1).sum()}")
     
-    # Phần còn lại giữ nguyên, nhưng thêm kiểm tra
-    edges = []
-    for trip_id in gps_data['trip_id'].unique():
-        trip_data = gdf[gdf['trip_id'] == trip_id].sort_values('timestamp')
-        
-        for i in range(len(trip_data) - 1):
-            source = trip_data.iloc[i]['cluster']
-            target = trip_data.iloc[i+1]['cluster']
-            if source != -1 and target != -1:  # Bỏ qua các điểm nhiễu
-                edges.append({
-                    'source': int(source),  # Đảm bảo là số nguyên
-                    'target': int(target),
-                    'weight': 1
-                })
+    # Tạo danh sách cạnh có trọng số trong một lần sort + shift
+    edges_df = build_transition_edges(gdf, trip_index=get_trip_index(gps_data))
     
-    # Kiểm tra xem edges có dữ liệu không trước khi tạo cuDF
-    if not edges:
-        raise ValueError("Không có cạnh nào được tạo. Kiểm tra dữ liệu đầu vào.")
+    if edges_df.empty:
+        return None, gdf, stats
     
-    edges_df = cudf.DataFrame(edges)
+    stats.append(f"Số cạnh được tạo: {len(edges_df)} (tổng số lần chuyển: {int(edges_df['weight'].sum())})")
+    stats.append(f"Số nút duy nhất: {len(np.union1d(edges_df['source'].to_numpy(), edges_df['target'].to_numpy()))}")
     
-    # Tạo đồ thị với store_transposed=True để tối ưu hiệu suất
-    G = cugraph.Graph(directed=False)
-    G.from_cudf_edgelist(edges_df, source='source', destination='target', edge_attr='weight', store_transposed=True)
+    if backend == 'auto':
+        backend = select_graph_backend()
+    if backend not in GRAPH_BACKENDS:
+        raise ValueError(f"Backend '{backend}' không khả dụng. Các backend có: {sorted(GRAPH_BACKENDS)}")
+    G = GRAPH_BACKENDS[backend](edges_df)
     
-    return G, gdf
+    return G, gdf, stats
 
+@instrument()
+def create_snapshot_graph(snapshot, backend='auto'):
+    """Tạo đồ thị từ snapshot trên đĩa (``modules.graph_store``), trả về (G, None, stats)
+
+    Backend CPU dùng trực tiếp các mảng CSR memory-map, không tạo lại đồ thị.
+    """
+    if backend == 'auto':
+        backend = select_graph_backend()
+    if backend not in GRAPH_BACKENDS:
+        raise ValueError(f"Backend '{backend}' không khả dụng. Các backend có: {sorted(GRAPH_BACKENDS)}")
+    if snapshot.meta['n_edges'] == 0:
+        return None, None, snapshot.stats()
+    if backend == 'cpu':
+        G = snapshot.to_csr_graph()
+    else:
+        G = GRAPH_BACKENDS[backend](snapshot.edges_frame())
+    return G, None, snapshot.stats()
+
+@instrument()
+def build_transition_edges(gdf, cluster_col='cluster', trip_index=None):
+    """Tạo danh sách cạnh chuyển cụm đã gộp trọng số
+
+    Dùng thứ tự (trip_id, timestamp) của chỉ mục chuyến (``trip_index``, mặc
+    định lấy từ ``gdf``), so sánh mỗi điểm với điểm kế tiếp trong cùng chuyến
+    và bỏ các điểm nhiễu (-1). Đồ thị vô hướng nên (a, b) và (b, a) được gộp
+    thành một cạnh; ``weight`` là số lần chuyển.
+    """
+    if trip_index is None:
+        trip_index = get_trip_index(gdf)
+    clusters = trip_index.column(gdf, cluster_col, dtype=np.int64)
+    
+    source = clusters[:-1]
+    target = clusters[1:]
+    keep = trip_index.same_trip & (source != -1) & (target != -1)
+    source = source[keep]
+    target = target[keep]
+    
+    edges = pd.DataFrame({
+        'source': np.minimum(source, target),
+        'target': np.maximum(source, target),
+    })
+    edges = edges.groupby(['source', 'target'], sort=False).size().reset_index(name='weight')
+    return edges
+
+def _is_empty(G):
+    return G is None or G.number_of_vertices() == 0
+
+@instrument()
 def calculate_pagerank(G):
     """Tính toán PageRank cho các nút trong đồ thị"""
-    pagerank = cugraph.pagerank(G)
-    return pagerank
+    if _is_empty(G):
+        return pd.DataFrame({'vertex': [], 'pagerank': []})
+    return _to_pandas(_algorithms(G).pagerank(G))
 
+@instrument()
 def detect_communities(G):
-    """Phát hiện cộng đồng trong đồ thị"""
-    communities, modularity = cugraph.louvain(G)
+    """Phát hiện cộng đồng trong đồ thị, trả về (communities, modularity)"""
+    if _is_empty(G):
+        return pd.DataFrame({'node_id': [], 'community_id': []}), 0.0
+    communities, modularity = _algorithms(G).louvain(G)
     # Đổi tên cột để dễ hiểu hơn
     communities = communities.rename(columns={'vertex': 'node_id', 'partition': 'community_id'})
-    return communities, modularity
+    return _to_pandas(communities), float(modularity)
 
-def calculate_centrality(G):
-    """Tính toán các độ đo trung tâm"""
-    # Tính độ trung tâm giữa (Betweenness Centrality)
-    betweenness = cugraph.betweenness_centrality(G)
-    
-    # Tính độ trung tâm eigenvector
-    eigenvector = cugraph.eigenvector_centrality(G)
-    
-    # Tính PageRank (có thể được sử dụng như một độ đo trung tâm)
-    pagerank = cugraph.pagerank(G)
-    
-    return {
-        'betweenness': betweenness,
-        'eigenvector': eigenvector,
-        'pagerank': pagerank
-    }
-
-def analyze_movement_patterns(gps_data):
-    """Phân tích mẫu di chuyển sử dụng cuGraph"""
-    # Tạo đồ thị
-    G, gdf = create_movement_graph(gps_data)
-    
-    # Tính toán các metrics
-    pagerank = calculate_pagerank(G)
-    communities, modularity = detect_communities(G)
-    centrality = calculate_centrality(G)
+@instrument()
+def calculate_betweenness(G, k=None, target_error=None, **approx_params):
+    """Độ trung tâm giữa (Betweenness Centrality)
+
+    Mặc định tính chính xác (O(V·E)); truyền ``k`` (số đỉnh nguồn lấy mẫu)
+    hoặc ``target_error`` để dùng ``approximate_betweenness``.
+    """
+    if _is_empty(G):
+        return pd.DataFrame({'vertex': [], 'betweenness_centrality': []})
+    if k is not None or target_error is not None:
+        return approximate_betweenness(G, k or DEFAULT_BETWEENNESS_SAMPLES, target_error, **approx_params)
+    return _to_pandas(_algorithms(G).betweenness_centrality(G))
+
+def _betweenness_from_sources(G, vertices, sources):
+    """Ước lượng betweenness từ tập đỉnh nguồn, sắp theo thứ tự ``vertices``"""
+    algorithms = _algorithms(G)
+    if algorithms is cugraph:
+        sources = cudf.Series(sources)
+    result = _to_pandas(algorithms.betweenness_centrality(G, k=sources))
+    return result.set_index('vertex')['betweenness_centrality'].reindex(vertices).fillna(0.0).to_numpy()
+
+@instrument()
+def approximate_betweenness(G, k=DEFAULT_BETWEENNESS_SAMPLES, target_error=None,
+                            replicates=BETWEENNESS_REPLICATES, top_n=5, seed=0):
+    """Betweenness ước lượng bằng cách lấy mẫu đỉnh nguồn, kèm sai số
+
+    ``k`` nguồn được chia thành ``replicates`` nhóm rời nhau, mỗi nhóm cho một
+    ước lượng độc lập; kết quả là trung bình các nhóm (bằng ước lượng từ cả
+    ``k`` nguồn) và sai số chuẩn lấy từ độ phân tán giữa các nhóm. Với
+    ``target_error`` (sai số tương đối lớn nhất trong top ``top_n``), số nhóm
+    được tăng theo sai số hiện tại tới khi đạt; nếu cần nhiều nguồn hơn số
+    đỉnh thì tính chính xác.
+
+    Trả về DataFrame (vertex, betweenness_centrality, betweenness_stderr);
+    ``attrs`` chứa ``sample_size``, ``replicates``, ``relative_error``,
+    ``top_n_overlap`` (tỉ lệ trùng top-N trung bình giữa kết quả và các lần
+    bootstrap trên các nhóm) và ``exact``.
+    """
+    vertices = G.nodes().to_numpy()
+    n = len(vertices)
+    replicates = max(2, replicates)
+    per_group = max(1, k // replicates)
+    sources = np.random.default_rng(seed).permutation(vertices)
     
-    # Kết hợp kết quả
-    results = {
-        'pagerank': pagerank,
-        'communities': communities,
-        'modularity': modularity,
-        'centrality': centrality,
-        'graph': G,
-        'gdf': gdf
-    }
+    estimates = []
+    groups = replicates
+    while True:
+        if groups * per_group >= n:
+            # Lấy mẫu không còn rẻ hơn tính chính xác
+            result = _to_pandas(_algorithms(G).betweenness_centrality(G))
+            result['betweenness_stderr'] = 0.0
+            result.attrs.update(sample_size=n, replicates=1, relative_error=0.0, top_n_overlap=1.0, exact=True)
+            return result
+        for group in range(len(estimates), groups):
+            estimates.append(_betweenness_from_sources(G, vertices, sources[group * per_group:(group + 1) * per_group]))
+        
+        samples = np.vstack(estimates)
+        mean = samples.mean(axis=0)
+        stderr = samples.std(axis=0, ddof=1) / np.sqrt(len(estimates))
+        top = np.argsort(mean)[::-1][:top_n]
+        relative_error = float(np.max(stderr[top] / np.maximum(mean[top], np.finfo(float).tiny)))
+        if target_error is None or relative_error <= target_error:
+            break
+        # Sai số giảm theo 1/sqrt(số nguồn): ước lượng số nhóm cần để đạt mục tiêu
+        groups = max(len(estimates) + 1, int(np.ceil(len(estimates) * (relative_error / target_error) ** 2)))
     
-    return results
-
-def get_top_areas(results, metric='pagerank', top_n=5):
-    """Lấy top N khu vực theo metric"""
-    if metric == 'pagerank':
-        df = results['pagerank'].to_pandas()
-        return df.nlargest(top_n, 'pagerank')
-    elif metric == 'betweenness':
-        df = results['centrality']['betweenness'].to_pandas()
-        return df.nlargest(top_n, 'betweenness_centrality')
-    elif metric == 'eigenvector':
-        df = results['centrality']['eigenvector'].to_pandas()
-        return df.nlargest(top_n, 'eigenvector_centrality') 
\ No newline at end of file
+    # Độ ổn định top-N: bootstrap trên các nhóm, so top-N của từng lần với kết quả
+    rng = np.random.default_rng(seed)
+    resampled = samples[rng.integers(0, len(estimates), size=(BOOTSTRAP_ROUNDS, len(estimates)))].mean(axis=1)
+    resampled_top = np.argsort(resampled, axis=1)[:, ::-1][:, :len(top)]
+    overlap = np.isin(resampled_top, top).mean()
+    result = pd.DataFrame({'vertex': vertices, 'betweenness_centrality': mean, 'betweenness_stderr': stderr})
+    result.attrs.update(
+        sample_size=len(estimates) * per_group,
+        replicates=len(estimates),
+        relative_error=relative_error,
+        top_n_overlap=float(overlap),
+        exact=False,
+    )
+    return result
+
+@instrument()
+def calculate_eigenvector(G):
+    """Độ trung tâm eigenvector"""
+    if _is_empty(G):
+        return pd.DataFrame({'vertex': [], 'eigenvector_centrality': []})
+    return _to_pandas(_algorithms(G).eigenvector_centrality(G))
+
+# Registry độ đo: tên -> (hàm (G) -> kết quả pandas, cột dùng để xếp hạng)
+GRAPH_METRICS = {}
+
+def register_graph_metric(name, func, score_column=None):
+    """Đăng ký một độ đo đồ thị cho GraphAnalyticsSession"""
+    GRAPH_METRICS[name] = (func, score_column)
+
+register_graph_metric('pagerank', calculate_pagerank, 'pagerank')
+register_graph_metric('communities', detect_communities)
+register_graph_metric('betweenness', calculate_betweenness, 'betweenness_centrality')
+register_graph_metric('eigenvector', calculate_eigenvector, 'eigenvector_centrality')
+
+@persistent_cache()
+def _graph_summary(gps_data, method, backend, **node_params):
+    """Thống kê đồ thị (cache trên đĩa): {'stats': [...], 'has_edges': bool}"""
+    session = get_graph_session(gps_data, method, backend, **node_params)
+    G, _, stats = session.graph
+    return {'stats': stats, 'has_edges': G is not None}
+
+def _metric_key(name, params):
+    """Khóa của một độ đo theo tên và tham số (ví dụ betweenness chính xác và lấy mẫu khác khóa)"""
+    return (name, tuple(sorted(params.items())))
+
+@persistent_cache()
+def _graph_metric(gps_data, name, params, method, backend, **node_params):
+    """Tính một độ đo với tham số ``params`` trên đồ thị của phiên (cache trên đĩa)"""
+    session = get_graph_session(gps_data, method, backend, **node_params)
+    func, _ = GRAPH_METRICS[name]
+    G = session.graph[0]
+    t = time.perf_counter()
+    result = func(G, **params)
+    session.timings[_metric_key(name, params)] = time.perf_counter() - t
+    return result
+
+class GraphAnalyticsSession:
+    """Đồ thị di chuyển của một bộ (dữ liệu, cách tạo nút, tham số) với các độ đo tính lười
+
+    Đồ thị chỉ được tạo khi cần (cache trên đĩa bị miss), mỗi độ đo chỉ tính
+    một lần cho mỗi phiên. Dùng ``get_graph_session`` để các lần rerun dùng
+    lại cùng một phiên. ``timings`` ghi thời gian (giây) tạo đồ thị (khóa
+    ``'build_graph'``) và tính từng độ đo trong phiên này, khóa theo
+    ``(tên, tham số)`` như ``_metric_key`` (không có mục nếu kết quả lấy từ
+    cache).
+
+    ``gps_data`` là dữ liệu điểm GPS (DataFrame pandas hoặc cuDF), hoặc một
+    ``GraphSnapshot`` đã lưu (khi đó ``method`` và tham số tạo nút bị bỏ qua).
+    """
+
+    def __init__(self, gps_data, method=DEFAULT_NODE_METHOD, backend='auto', **node_params):
+        self.gps_data = gps_data
+        self.method = method
+        self.backend = select_graph_backend() if backend == 'auto' else backend
+        self.node_params = node_params
+        self.timings = {}
+        self._metrics = {}
+
+    @functools.cached_property
+    def graph(self):
+        """(G, gdf, stats) từ ``create_movement_graph``"""
+        # Import tại chỗ: modules.graph_store import module này
+        from modules.graph_store import GraphSnapshot
+        t = time.perf_counter()
+        if isinstance(self.gps_data, GraphSnapshot):
+            graph = create_snapshot_graph(self.gps_data, self.backend)
+        else:
+            graph = create_movement_graph(self.gps_data, self.method, self.backend, **self.node_params)
+        self.timings['build_graph'] = time.perf_counter() - t
+        return graph
+
+    @functools.cached_property
+    def summary(self):
+        return _graph_summary(self.gps_data, self.method, self.backend, **self.node_params)
+
+    @property
+    def stats(self):
+        return self.summary['stats']
+
+    @property
+    def has_edges(self):
+        return self.summary['has_edges']
+
+    def metric(self, name, **params):
+        """Kết quả độ đo ``name`` với tham số ``params``, tính ở lần truy cập đầu tiên"""
+        if name not in GRAPH_METRICS:
+            raise ValueError(f"Độ đo '{name}' không tồn tại. Các độ đo có: {sorted(GRAPH_METRICS)}")
+        key = _metric_key(name, params)
+        if key not in self._metrics:
+            self._metrics[key] = _graph_metric(self.gps_data, name, params, self.method, self.backend, **self.node_params)
+        return self._metrics[key]
+
+    @property
+    def pagerank(self):
+        return self.metric('pagerank')
+
+    @property
+    def communities(self):
+        """(communities, modularity)"""
+        return self.metric('communities')
+
+    @property
+    def betweenness(self):
+        return self.metric('betweenness')
+
+    @property
+    def eigenvector(self):
+        return self.metric('eigenvector')
+
+_graph_sessions = OrderedDict()
+
+def get_graph_session(gps_data, method=DEFAULT_NODE_METHOD, backend='auto', **node_params):
+    """Phiên đồ thị dùng chung cho cùng dữ liệu và tham số (giữ tối đa MAX_GRAPH_SESSIONS phiên)"""
+    if backend == 'auto':
+        backend = select_graph_backend()
+    key = fingerprint((gps_data, method, backend, node_params))
+    session = _graph_sessions.get(key)
+    if session is None:
+        session = _graph_sessions[key] = GraphAnalyticsSession(gps_data, method, backend, **node_params)
+        while len(_graph_sessions) > MAX_GRAPH_SESSIONS:
+            _graph_sessions.popitem(last=False)
+    else:
+        _graph_sessions.move_to_end(key)
+    return session
+
+@instrument()
+def analyze_movement_patterns(gps_data, method=DEFAULT_NODE_METHOD, backend='auto', **node_params):
+    """Phân tích mẫu di chuyển; trả về phiên, các độ đo được tính khi truy cập"""
+    return get_graph_session(gps_data, method, backend, **node_params)
+
+def get_top_areas(session, metric='pagerank', top_n=5, **params):
+    """Lấy top N khu vực theo metric (``params`` truyền cho hàm tính độ đo)"""
+    _, score_column = GRAPH_METRICS[metric]
+    df = session.metric(metric, **params)
+    return df.nlargest(top_n, score_column) if not df.empty else pd.DataFrame()
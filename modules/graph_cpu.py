@@ -0,0 +1,311 @@
+"""Backend CPU cho phân tích đồ thị di chuyển, dựa trên ma trận thưa CSR
+
+Các hàm cùng tên và cùng dạng kết quả với cuGraph (``pagerank``,
+``eigenvector_centrality``, ``betweenness_centrality``, ``louvain``) nhưng
+trả về pandas DataFrame, để ``modules.graph_analysis`` chạy được trên máy
+không có GPU:
+
+- PageRank và eigenvector: lặp lũy thừa vectorized (mỗi vòng một phép nhân
+  ma trận thưa với vector).
+- Betweenness: thuật toán Brandes không trọng số; với numba mỗi nguồn một
+  vòng BFS biên dịch (song song theo nguồn), nếu không thì BFS theo mức chạy
+  đồng thời cho cả lô nguồn bằng numpy.
+- Louvain: di chuyển cục bộ từng đỉnh rồi gộp cộng đồng bằng phép nhân
+  P^T A P, lặp tới khi modularity không tăng.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from modules.instrumentation import instrument
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Số cặp (nguồn, cạnh) xử lý cùng lúc khi tính betweenness (giới hạn bộ nhớ mỗi lô)
+BETWEENNESS_BATCH_PAIRS = 2**24
+
+class CSRGraph:
+    """Đồ thị vô hướng có trọng số: ``vertices[i]`` là mã nút của hàng i của ``matrix``"""
+
+    def __init__(self, vertices, matrix):
+        self.vertices = vertices
+        self.matrix = matrix
+        self._binary = None
+
+    @classmethod
+    def from_edgelist(cls, edges_df, source='source', destination='target', edge_attr='weight'):
+        """Tạo đồ thị từ danh sách cạnh; cạnh trùng được cộng trọng số"""
+        src = edges_df[source].to_numpy()
+        dst = edges_df[destination].to_numpy()
+        weight = edges_df[edge_attr].to_numpy(dtype=np.float64) if edge_attr else np.ones(len(src))
+        vertices, inverse = np.unique(np.concatenate((src, dst)), return_inverse=True)
+        rows, cols = inverse[:len(src)], inverse[len(src):]
+        n = len(vertices)
+        upper = sp.coo_matrix((weight, (rows, cols)), shape=(n, n)).tocsr()
+        # Đối xứng hóa; cạnh khuyên (a, a) chỉ tính một lần
+        matrix = (upper + upper.T - sp.diags(upper.diagonal())).tocsr()
+        matrix.sum_duplicates()
+        return cls(vertices, matrix)
+
+    def number_of_vertices(self):
+        return len(self.vertices)
+
+    def number_of_edges(self):
+        return int((self.matrix.nnz + np.count_nonzero(self.matrix.diagonal())) // 2)
+
+    def nodes(self):
+        return pd.Series(self.vertices)
+
+    @property
+    def binary(self):
+        """Ma trận kề không trọng số, bỏ cạnh khuyên (dùng cho đường đi ngắn nhất)"""
+        if self._binary is None:
+            binary = self.matrix.copy()
+            binary.setdiag(0)
+            binary.eliminate_zeros()
+            binary.data[:] = 1.0
+            self._binary = binary
+        return self._binary
+
+def _power_iteration(step, x, tol, max_iter):
+    """Lặp ``x = step(x)`` tới khi tổng thay đổi tuyệt đối < n * tol"""
+    n = len(x)
+    for _ in range(max_iter):
+        x_next = step(x)
+        if np.abs(x_next - x).sum() < n * tol:
+            return x_next
+        x = x_next
+    raise RuntimeError(f"Lặp lũy thừa không hội tụ sau {max_iter} vòng")
+
+@instrument()
+def pagerank(G, alpha=0.85, tol=1e-5, max_iter=100):
+    """PageRank có trọng số; kết quả (vertex, pagerank) có tổng bằng 1"""
+    n = G.number_of_vertices()
+    strength = np.asarray(G.matrix.sum(axis=1)).ravel()
+    dangling = strength == 0
+    inv_strength = np.divide(1.0, strength, out=np.zeros(n), where=~dangling)
+    # Ma trận đối xứng: A^T (x / s) = A (x / s)
+    transition = G.matrix
+
+    def step(x):
+        return alpha * (transition @ (x * inv_strength)) + (alpha * x[dangling].sum() + 1 - alpha) / n
+
+    scores = _power_iteration(step, np.full(n, 1.0 / n), tol, max_iter)
+    return pd.DataFrame({'vertex': G.vertices, 'pagerank': scores})
+
+@instrument()
+def eigenvector_centrality(G, tol=1e-6, max_iter=1000):
+    """Độ trung tâm eigenvector có trọng số, chuẩn hóa L2
+
+    Lặp trên A + I để tránh dao động trên đồ thị hai phía (cùng vector riêng).
+    Đồ thị đường phố có khoảng cách phổ nhỏ nên cần nhiều vòng hơn PageRank.
+    """
+    n = G.number_of_vertices()
+    matrix = G.matrix
+
+    def step(x):
+        x_next = matrix @ x + x
+        return x_next / np.linalg.norm(x_next)
+
+    scores = _power_iteration(step, np.full(n, 1.0 / np.sqrt(n)), tol, max_iter)
+    return pd.DataFrame({'vertex': G.vertices, 'eigenvector_centrality': scores})
+
+def _neighbor_pairs(binary, frontier, n):
+    """Mở rộng các cặp (nguồn, đỉnh) phẳng ``b * n + u`` thành mọi cặp cạnh (u, v) của chúng"""
+    nodes = frontier % n
+    degree = binary.indptr[nodes + 1] - binary.indptr[nodes]
+    starts = np.repeat(binary.indptr[nodes] - np.cumsum(degree) + degree, degree)
+    flat_u = np.repeat(frontier, degree)
+    neighbors = binary.indices[starts + np.arange(len(flat_u))]
+    return flat_u, flat_u - np.repeat(nodes, degree) + neighbors
+
+def _accumulate_batch(binary, sources):
+    """Brandes cho một lô nguồn: tổng phụ thuộc delta của từng đỉnh
+
+    BFS theo mức chạy đồng thời cho cả lô trên các cặp (nguồn, đỉnh) phẳng;
+    mỗi mức chỉ duyệt cạnh của biên hiện tại nên tổng công việc là O(lô x E).
+    """
+    n = binary.shape[0]
+    batch = len(sources)
+    dist = np.full(batch * n, -1, dtype=np.int32)
+    sigma = np.zeros(batch * n)
+    frontier = np.arange(batch, dtype=np.int64) * n + sources
+    dist[frontier] = 0
+    sigma[frontier] = 1.0
+    # Vị trí ghi cuối cùng của mỗi cặp mới, dùng để bỏ trùng biên kế tiếp trong O(k)
+    owner = np.empty(batch * n, dtype=np.int64)
+
+    # Cạnh DAG đường đi ngắn nhất của từng mức, dùng lại khi tích lũy ngược
+    dag_levels = []
+    level = 0
+    while len(frontier):
+        flat_u, flat_v = _neighbor_pairs(binary, frontier, n)
+        discovered = flat_v[dist[flat_v] == -1]
+        dist[discovered] = level + 1
+        on_dag = dist[flat_v] == level + 1
+        flat_u, flat_v = flat_u[on_dag], flat_v[on_dag]
+        np.add.at(sigma, flat_v, sigma[flat_u])
+        dag_levels.append((flat_u, flat_v))
+        positions = np.arange(len(discovered))
+        owner[discovered] = positions
+        frontier = discovered[owner[discovered] == positions]
+        level += 1
+
+    delta = np.zeros(batch * n)
+    for flat_u, flat_v in reversed(dag_levels):
+        np.add.at(delta, flat_u, sigma[flat_u] / sigma[flat_v] * (1.0 + delta[flat_v]))
+    delta[np.arange(batch) * n + sources] = 0.0
+    return delta.reshape(batch, n).sum(axis=0)
+
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _brandes_kernel(indptr, indices, sources, n):
+        """Brandes cho từng nguồn (song song); hàng b là delta của nguồn sources[b]"""
+        out = np.zeros((len(sources), n))
+        for b in numba.prange(len(sources)):
+            source = sources[b]
+            dist = np.full(n, -1, dtype=np.int32)
+            sigma = np.zeros(n)
+            delta = np.zeros(n)
+            order = np.empty(n, dtype=np.int64)
+            dist[source] = 0
+            sigma[source] = 1.0
+            order[0] = source
+            head, tail = 0, 1
+            while head < tail:
+                u = order[head]
+                head += 1
+                for j in range(indptr[u], indptr[u + 1]):
+                    v = indices[j]
+                    if dist[v] < 0:
+                        dist[v] = dist[u] + 1
+                        order[tail] = v
+                        tail += 1
+                    if dist[v] == dist[u] + 1:
+                        sigma[v] += sigma[u]
+            # Tích lũy ngược theo thứ tự BFS đảo: delta của các đỉnh kế tiếp đã đủ
+            for i in range(tail - 1, 0, -1):
+                w = order[i]
+                for j in range(indptr[w], indptr[w + 1]):
+                    v = indices[j]
+                    if dist[v] == dist[w] + 1:
+                        delta[w] += sigma[w] / sigma[v] * (1.0 + delta[v])
+            out[b] = delta
+        return out
+
+    def _accumulate_batch_numba(binary, sources):
+        out = _brandes_kernel(binary.indptr.astype(np.int64), binary.indices.astype(np.int64),
+                              np.asarray(sources, dtype=np.int64), binary.shape[0])
+        return out.sum(axis=0)
+
+@instrument()
+def betweenness_centrality(G, k=None, normalized=True, random_state=None):
+    """Betweenness không trọng số (giống cuGraph/NetworkX)
+
+    ``k`` là số đỉnh nguồn lấy mẫu hoặc danh sách mã nút nguồn; kết quả khi
+    lấy mẫu được nhân n/k để ước lượng giá trị trên toàn bộ nguồn.
+    """
+    n = G.number_of_vertices()
+    if k is None:
+        sources = np.arange(n)
+    elif np.isscalar(k):
+        sources = np.random.default_rng(random_state).choice(n, size=min(int(k), n), replace=False)
+    else:
+        sources = np.searchsorted(G.vertices, np.asarray(k))
+
+    if numba is not None:
+        # Mỗi nguồn giữ một hàng delta n phần tử
+        accumulate, batch = _accumulate_batch_numba, max(1, BETWEENNESS_BATCH_PAIRS // (8 * n))
+    else:
+        accumulate, batch = _accumulate_batch, max(1, BETWEENNESS_BATCH_PAIRS // max(1, G.binary.nnz))
+    scores = np.zeros(n)
+    for start in range(0, len(sources), batch):
+        scores += accumulate(G.binary, sources[start:start + batch])
+
+    # Đồ thị vô hướng: mỗi cặp (s, t) được đếm hai lần
+    scale = 1.0 / ((n - 1) * (n - 2)) if normalized and n > 2 else 0.5
+    if len(sources):
+        scale *= n / len(sources)
+    return pd.DataFrame({'vertex': G.vertices, 'betweenness_centrality': scores * scale})
+
+def _modularity(matrix, labels, resolution):
+    total = matrix.sum()
+    if total == 0:
+        return 0.0
+    strength = np.asarray(matrix.sum(axis=1)).ravel()
+    coo = matrix.tocoo()
+    internal = coo.data[labels[coo.row] == labels[coo.col]].sum()
+    community_strength = np.bincount(labels, weights=strength)
+    return float(internal / total - resolution * np.sum((community_strength / total) ** 2))
+
+def _local_moves(indptr, indices, data, strength, order, resolution, max_passes):
+    """Pha 1 của Louvain: chuyển từng đỉnh sang cộng đồng láng giềng có lợi nhất
+
+    Vòng lặp vô hướng, được biên dịch bằng numba nếu có.
+    """
+    n = len(strength)
+    total = strength.sum()
+    labels = np.arange(n)
+    community_strength = strength.copy()
+    # Trọng số từ đỉnh đang xét tới từng cộng đồng láng giềng (mảng tạm dùng lại)
+    links = np.zeros(n)
+    touched = np.empty(n, dtype=np.int64)
+    moved_any = False
+    for _ in range(max_passes):
+        moved = 0
+        for node in order:
+            own = labels[node]
+            community_strength[own] -= strength[node]
+            n_touched = 0
+            for j in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[j]
+                if neighbor == node:
+                    continue
+                community = labels[neighbor]
+                if links[community] == 0.0:
+                    touched[n_touched] = community
+                    n_touched += 1
+                links[community] += data[j]
+            best = own
+            best_gain = links[own] - resolution * strength[node] * community_strength[own] / total
+            for t in range(n_touched):
+                community = touched[t]
+                gain = links[community] - resolution * strength[node] * community_strength[community] / total
+                if gain > best_gain + 1e-12:
+                    best = community
+                    best_gain = gain
+            for t in range(n_touched):
+                links[touched[t]] = 0.0
+            labels[node] = best
+            community_strength[best] += strength[node]
+            if best != own:
+                moved += 1
+        if moved == 0:
+            break
+        moved_any = True
+    return labels, moved_any
+
+if numba is not None:
+    _local_moves = numba.njit(cache=True)(_local_moves)
+
+@instrument()
+def louvain(G, resolution=1.0, max_level=20, max_passes=10, random_state=0):
+    """Phát hiện cộng đồng Louvain; trả về (DataFrame (vertex, partition), modularity)"""
+    rng = np.random.default_rng(random_state)
+    matrix = G.matrix.tocsr()
+    membership = np.arange(G.number_of_vertices())
+    for _ in range(max_level):
+        strength = np.asarray(matrix.sum(axis=1)).ravel()
+        labels, moved = _local_moves(matrix.indptr, matrix.indices, matrix.data, strength,
+                                     rng.permutation(len(strength)), resolution, max_passes)
+        if not moved:
+            break
+        _, labels = np.unique(labels, return_inverse=True)
+        membership = labels[membership]
+        # Pha 2: gộp mỗi cộng đồng thành một đỉnh, trọng số cạnh được cộng dồn
+        assign = sp.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)))
+        matrix = (assign.T @ matrix @ assign).tocsr()
+    partition = pd.DataFrame({'vertex': G.vertices, 'partition': membership})
+    return partition, _modularity(G.matrix, membership, resolution)
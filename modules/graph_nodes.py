@@ -0,0 +1,78 @@
+"""Gán điểm GPS vào nút của đồ thị di chuyển
+
+Mỗi chiến lược nhận DataFrame GPS và trả về mảng int64 nhãn nút cho từng
+điểm (-1 là nhiễu, bị bỏ khi tạo cạnh):
+
+- ``grid``: gán điểm vào ô lưới vuông ``cell_size_m`` mét trong một lượt
+  vectorized O(N), chạy trên CPU. Mã ô chỉ phụ thuộc tọa độ và kích thước ô
+  nên ổn định giữa các tập dữ liệu.
+- ``dbscan``: phân cụm DBSCAN trên độ (cuML nếu có GPU, ngược lại scikit-learn);
+  chỉ được đăng ký khi có một trong hai thư viện.
+"""
+import importlib.util
+
+import numpy as np
+from modules.map_utils import METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+from modules.instrumentation import instrument
+
+try:
+    import cudf
+    import cuml
+except ImportError:
+    cudf = None
+    cuml = None
+
+DEFAULT_CELL_SIZE_M = 100
+# Chỉ số ô được dịch thêm CELL_INDEX_OFFSET để luôn không âm, mỗi trục 31 bit
+CELL_INDEX_OFFSET = 2**30
+CELL_INDEX_BITS = 31
+
+def grid_cell_ids(lons, lats, cell_size_m=DEFAULT_CELL_SIZE_M):
+    """Mã ô lưới int64 của từng điểm: (ix + offset) << 31 | (iy + offset)"""
+    ix = np.floor(np.asarray(lons, dtype=np.float64) * METERS_PER_DEG_LON / cell_size_m).astype(np.int64)
+    iy = np.floor(np.asarray(lats, dtype=np.float64) * METERS_PER_DEG_LAT / cell_size_m).astype(np.int64)
+    return ((ix + CELL_INDEX_OFFSET) << CELL_INDEX_BITS) | (iy + CELL_INDEX_OFFSET)
+
+def cell_centers(cell_ids, cell_size_m=DEFAULT_CELL_SIZE_M):
+    """Tọa độ tâm (lons, lats) của các ô lưới từ mã ô"""
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    ix = (cell_ids >> CELL_INDEX_BITS) - CELL_INDEX_OFFSET
+    iy = (cell_ids & ((1 << CELL_INDEX_BITS) - 1)) - CELL_INDEX_OFFSET
+    return (ix + 0.5) * cell_size_m / METERS_PER_DEG_LON, (iy + 0.5) * cell_size_m / METERS_PER_DEG_LAT
+
+@instrument()
+def assign_grid_nodes(gps_data, cell_size_m=DEFAULT_CELL_SIZE_M):
+    """Gán mỗi điểm vào ô lưới chứa nó"""
+    return grid_cell_ids(gps_data['longitude'].to_numpy(), gps_data['latitude'].to_numpy(), cell_size_m)
+
+@instrument()
+def assign_dbscan_nodes(gps_data, eps=0.001, min_samples=2):
+    """Phân cụm DBSCAN trên (longitude, latitude) tính bằng độ"""
+    coords = np.column_stack((gps_data['longitude'].to_numpy(), gps_data['latitude'].to_numpy()))
+    if cuml is not None:
+        coords_cudf = cudf.DataFrame(coords, columns=['longitude', 'latitude'])
+        labels = cuml.DBSCAN(eps=eps, min_samples=min_samples).fit(coords_cudf).labels_.values_host
+    else:
+        from sklearn.cluster import DBSCAN
+        labels = DBSCAN(eps=eps, min_samples=min_samples).fit(coords).labels_
+    return np.asarray(labels, dtype=np.int64)
+
+# Registry chiến lược: tên -> hàm (gps_data, **params) -> nhãn nút int64
+NODE_ASSIGNERS = {}
+
+def register_node_assigner(name, func):
+    """Đăng ký một chiến lược gán nút"""
+    NODE_ASSIGNERS[name] = func
+
+register_node_assigner('grid', assign_grid_nodes)
+if cuml is not None or importlib.util.find_spec('sklearn') is not None:
+    register_node_assigner('dbscan', assign_dbscan_nodes)
+
+# Mặc định giữ DBSCAN như bản gốc khi có thư viện, ngược lại dùng lưới
+DEFAULT_NODE_METHOD = 'dbscan' if 'dbscan' in NODE_ASSIGNERS else 'grid'
+
+def assign_nodes(gps_data, method=DEFAULT_NODE_METHOD, **params):
+    """Gán nút cho từng điểm GPS bằng chiến lược ``method``"""
+    if method not in NODE_ASSIGNERS:
+        raise ValueError(f"Chiến lược gán nút '{method}' không tồn tại. Các chiến lược có: {sorted(NODE_ASSIGNERS)}")
+    return NODE_ASSIGNERS[method](gps_data, **params)
@@ -0,0 +1,239 @@
+"""Snapshot đồ thị di chuyển trên đĩa (CSR) với gộp cạnh tăng dần
+
+Đồ thị lưới ô vuông (nút là mã ô của ``modules.graph_nodes``, ổn định giữa các
+tập dữ liệu) được lưu dưới dạng CSR đối xứng trong một thư mục:
+
+- ``nodes``: mã ô int64 đã sắp, ``offsets``/``indices``/``weights``: CSR
+  (trọng số là số lần chuyển; cạnh khuyên chỉ lưu một lần),
+- ``centroids``: tọa độ (longitude, latitude) trung bình các điểm của ô,
+  ``point_counts``: số điểm của ô,
+- ``meta.json``: kích thước ô, phiên bản và các nguồn dữ liệu đã gộp.
+
+Khi đọc, các mảng được memory-map nên mở snapshot chỉ mất vài mili giây. Dữ
+liệu mới (ví dụ một ngày GPS) được gộp bằng cách cộng số lần chuyển vào CSR
+hiện có, không cần xử lý lại dữ liệu cũ; mỗi nguồn chỉ được gộp một lần.
+Mỗi lần gộp ghi các mảng với hậu tố phiên bản mới rồi thay ``meta.json``
+(ghi file tạm rồi đổi tên), nên người đọc luôn thấy một phiên bản hoàn chỉnh.
+
+    python -m modules.graph_store data/fake_hcmc_road_gps_data.csv --cell-size 100
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from modules.graph_nodes import DEFAULT_CELL_SIZE_M, assign_grid_nodes
+from modules.graph_analysis import build_transition_edges
+from modules.graph_cpu import CSRGraph
+from modules.gps_store import read_gps
+from modules.instrumentation import instrument
+from modules.result_cache import fingerprint, tag_fingerprint, tagged_source
+from modules.trip_index import get_trip_index
+
+GRAPH_STORE_DIR = "data/.cache/graphs"
+SNAPSHOT_ARRAYS = ['nodes', 'offsets', 'indices', 'weights', 'centroids', 'point_counts']
+SNAPSHOT_FORMAT = 1
+
+def snapshot_path(cell_size_m=DEFAULT_CELL_SIZE_M, root=GRAPH_STORE_DIR):
+    """Thư mục snapshot mặc định cho một kích thước ô"""
+    return os.path.join(root, f"movement-grid-{cell_size_m}m")
+
+class GraphSnapshot:
+    """Snapshot đồ thị đã đọc (các mảng memory-map, chỉ đọc)"""
+
+    def __init__(self, path, meta, arrays):
+        self.path = path
+        self.meta = meta
+        for name in SNAPSHOT_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def version(self):
+        return self.meta['version']
+
+    @property
+    def cell_size_m(self):
+        return self.meta['cell_size_m']
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    def __repr__(self):
+        return f"GraphSnapshot({self.path!r}, version={self.version})"
+
+    def matrix(self):
+        """Ma trận kề CSR trên chính các mảng memory-map (không sao chép)"""
+        return sp.csr_matrix((self.weights, self.indices, self.offsets), shape=(self.n_nodes, self.n_nodes), copy=False)
+
+    def to_csr_graph(self):
+        """Đồ thị cho backend CPU (``modules.graph_cpu``)"""
+        return CSRGraph(self.nodes, self.matrix())
+
+    def edges_frame(self):
+        """Danh sách cạnh vô hướng (source <= target, weight) theo mã ô"""
+        rows = np.repeat(np.arange(self.n_nodes), np.diff(self.offsets))
+        upper = rows <= self.indices
+        return pd.DataFrame({
+            'source': self.nodes[rows[upper]],
+            'target': self.nodes[self.indices[upper]],
+            'weight': np.asarray(self.weights[upper]),
+        })
+
+    def stats(self):
+        """Các dòng thống kê giống ``create_movement_graph``"""
+        meta = self.meta
+        return [
+            f"Snapshot đồ thị: {self.path} (phiên bản {meta['version']}, {len(meta['sources'])} nguồn dữ liệu)",
+            f"Số điểm GPS: {meta['n_points']}",
+            f"Số nút (ô {meta['cell_size_m']} m): {self.n_nodes}",
+            f"Số cạnh: {meta['n_edges']} (tổng số lần chuyển: {int(meta['total_transitions'])})",
+        ]
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+@instrument()
+def load_graph_snapshot(path):
+    """Mở snapshot bằng memory-map; None nếu chưa có"""
+    meta = _read_meta(path)
+    if meta is None or meta.get('format') != SNAPSHOT_FORMAT:
+        return None
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}-{meta['version']}.npy"), mmap_mode='r')
+        for name in SNAPSHOT_ARRAYS
+    }
+    # Vân tay theo đường dẫn và phiên bản để cache kết quả không phải hash cả đồ thị
+    return tag_fingerprint(GraphSnapshot(path, meta, arrays), 'graph-snapshot', os.path.abspath(path), meta['version'])
+
+def _day_graph(gps_data, cell_size_m):
+    """Cạnh (mã ô nguồn <= mã ô đích, số lần chuyển) và tổng tọa độ theo ô của một tập dữ liệu"""
+    cells = assign_grid_nodes(gps_data, cell_size_m)
+    edges = build_transition_edges(pd.DataFrame({'cluster': cells}), trip_index=get_trip_index(gps_data))
+    point_cells, inverse = np.unique(cells, return_inverse=True)
+    sums = np.column_stack((
+        np.bincount(inverse, weights=gps_data['longitude'].to_numpy(dtype=np.float64)),
+        np.bincount(inverse, weights=gps_data['latitude'].to_numpy(dtype=np.float64)),
+    ))
+    counts = np.bincount(inverse).astype(np.int64)
+    return edges, point_cells, sums, counts
+
+def _symmetric_csr(n, rows, cols, weights):
+    """CSR đối xứng từ các cạnh rows <= cols (cạnh khuyên chỉ một lần)"""
+    off_diagonal = rows != cols
+    all_rows = np.concatenate((rows, cols[off_diagonal]))
+    all_cols = np.concatenate((cols, rows[off_diagonal]))
+    all_weights = np.concatenate((weights, weights[off_diagonal]))
+    order = np.lexsort((all_cols, all_rows))
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_rows, minlength=n), out=offsets[1:])
+    # scipy cần offsets và indices cùng kiểu
+    index_dtype = np.int32 if len(all_rows) < 2**31 and n < 2**31 else np.int64
+    return offsets.astype(index_dtype), all_cols[order].astype(index_dtype), all_weights[order]
+
+@instrument()
+def merge_into_snapshot(gps_data, path=None, cell_size_m=DEFAULT_CELL_SIZE_M, source_key=None):
+    """Gộp số lần chuyển và tọa độ của ``gps_data`` vào snapshot (tạo mới nếu chưa có)
+
+    ``source_key`` định danh nguồn; mặc định là khóa nguồn gắn khi đọc bằng
+    ``read_gps`` (``file:<vân tay file>``, giống nhau giữa ứng dụng và CLI),
+    nếu không có thì là vân tay dữ liệu. Nguồn đã gộp thì bỏ qua. Trả về
+    snapshot sau khi gộp.
+    """
+    if path is None:
+        path = snapshot_path(cell_size_m)
+    if source_key is None:
+        source_key = tagged_source(gps_data) or fingerprint(gps_data)
+    current = load_graph_snapshot(path)
+    if current is not None:
+        if current.cell_size_m != cell_size_m:
+            raise ValueError(f"Snapshot '{path}' dùng ô {current.cell_size_m} m, không gộp được dữ liệu ô {cell_size_m} m")
+        if source_key in current.meta['sources']:
+            return current
+
+    edges, point_cells, sums, counts = _day_graph(gps_data, cell_size_m)
+    src = edges['source'].to_numpy()
+    dst = edges['target'].to_numpy()
+    weights = edges['weight'].to_numpy(dtype=np.float64)
+    if current is not None:
+        # Cạnh cũ lấy từ nửa trên của CSR; tổng tọa độ khôi phục từ tâm x số điểm
+        old_edges = current.edges_frame()
+        src = np.concatenate((old_edges['source'].to_numpy(), src))
+        dst = np.concatenate((old_edges['target'].to_numpy(), dst))
+        weights = np.concatenate((old_edges['weight'].to_numpy(), weights))
+        point_cells = np.concatenate((current.nodes, point_cells))
+        sums = np.concatenate((current.centroids * current.point_counts[:, None], sums))
+        counts = np.concatenate((current.point_counts, counts))
+
+    nodes, node_inverse = np.unique(point_cells, return_inverse=True)
+    n = len(nodes)
+    node_counts = np.bincount(node_inverse, weights=counts, minlength=n).astype(np.int64)
+    centroids = np.column_stack((
+        np.bincount(node_inverse, weights=sums[:, 0], minlength=n),
+        np.bincount(node_inverse, weights=sums[:, 1], minlength=n),
+    )) / np.maximum(node_counts, 1)[:, None]
+
+    # Cộng trọng số các cạnh trùng (cũ + mới) theo khóa hàng * n + cột
+    rows = np.searchsorted(nodes, src)
+    cols = np.searchsorted(nodes, dst)
+    edge_keys, edge_inverse = np.unique(rows.astype(np.int64) * n + cols, return_inverse=True)
+    edge_weights = np.bincount(edge_inverse, weights=weights)
+    offsets, indices, csr_weights = _symmetric_csr(n, edge_keys // n, edge_keys % n, edge_weights)
+
+    version = current.version + 1 if current is not None else 1
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'cell_size_m': cell_size_m,
+        'n_points': int(node_counts.sum()),
+        'n_edges': len(edge_keys),
+        'total_transitions': float(edge_weights.sum()),
+        'sources': (current.meta['sources'] if current is not None else []) + [source_key],
+        'updated_at': time.time(),
+    }
+    arrays = {
+        'nodes': nodes, 'offsets': offsets, 'indices': indices, 'weights': csr_weights,
+        'centroids': centroids, 'point_counts': node_counts,
+    }
+    _write_snapshot(path, meta, arrays)
+    return load_graph_snapshot(path)
+
+def _write_snapshot(path, meta, arrays):
+    """Ghi mảng phiên bản mới, thay meta.json nguyên tử rồi xóa các phiên bản cũ"""
+    os.makedirs(path, exist_ok=True)
+    version = meta['version']
+    for name in SNAPSHOT_ARRAYS:
+        np.save(os.path.join(path, f"{name}-{version}.npy"), arrays[name])
+    tmp_path = os.path.join(path, f"meta.json.tmp-{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(path, "meta.json"))
+    # Người đọc đang memory-map phiên bản cũ vẫn đọc được sau khi file bị xóa (POSIX)
+    for name in SNAPSHOT_ARRAYS:
+        for old_path in glob.glob(os.path.join(path, f"{name}-*.npy")):
+            if old_path != os.path.join(path, f"{name}-{version}.npy"):
+                os.remove(old_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gộp dữ liệu GPS vào snapshot đồ thị di chuyển")
+    parser.add_argument("file_paths", nargs="+", help="Các file CSV/Parquet GPS, ví dụ mỗi ngày một file")
+    parser.add_argument("--cell-size", type=int, default=DEFAULT_CELL_SIZE_M, help="Kích thước ô lưới (m)")
+    parser.add_argument("--output", help="Thư mục snapshot (mặc định theo kích thước ô)")
+    args = parser.parse_args(argv)
+    path = args.output or snapshot_path(args.cell_size)
+    for file_path in args.file_paths:
+        started = time.perf_counter()
+        snapshot = merge_into_snapshot(read_gps(file_path), path, args.cell_size)
+        print(f"{file_path}: phiên bản {snapshot.version}, {snapshot.n_nodes} nút, "
+              f"{snapshot.meta['n_edges']} cạnh ({time.perf_counter() - started:.2f} s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Đo thời gian và bộ nhớ cho từng stage của pipeline
+
+Dùng như decorator hoặc context manager:
+
+    @instrument()
+    def analyze_bus_routes(gps_data, districts): ...
+
+    with stage("build_edges", rows_in=len(df)) as s:
+        edges = ...
+        s.rows_out = len(edges)
+
+Mặc định tắt (chi phí chỉ là một lần kiểm tra biến toàn cục). Bật bằng biến
+môi trường ``GPS_INSTRUMENT=1`` hoặc gọi ``enable()``; ``GPS_INSTRUMENT_LOG``
+là file JSON lines nhận từng bản ghi.
+"""
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+# Số bản ghi gần nhất giữ trong bộ nhớ
+MAX_RECORDS = 10_000
+# Chu kỳ lấy mẫu RSS (giây) trong khi có stage đang chạy
+RSS_SAMPLE_INTERVAL = 0.005
+
+_enabled = os.environ.get("GPS_INSTRUMENT", "") not in ("", "0")
+_log_path = os.environ.get("GPS_INSTRUMENT_LOG") or None
+_lock = threading.Lock()
+_local = threading.local()
+_records = deque(maxlen=MAX_RECORDS)
+# Tổng hợp theo stage: số lần, tổng/min/max thời gian và histogram log2(ms)
+_aggregates = defaultdict(lambda: {'count': 0, 'wall_total': 0.0, 'wall_min': math.inf, 'wall_max': 0.0, 'histogram': defaultdict(int)})
+_cupy = None
+# Các stage đang mở; thread nền cập nhật RSS đỉnh của chúng
+_open_stages = set()
+_sampler_wake = threading.Event()
+_sampler_thread = None
+
+def enable(log_path=None):
+    """Bật đo đạc; ``log_path`` là file JSON lines (tùy chọn)"""
+    global _enabled, _log_path
+    _enabled = True
+    if log_path is not None:
+        _log_path = log_path
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Xóa các bản ghi và tổng hợp trong bộ nhớ"""
+    with _lock:
+        _records.clear()
+        _aggregates.clear()
+
+def _gpu_used_bytes():
+    """Bộ nhớ GPU đang dùng trong memory pool của CuPy; None nếu không có GPU"""
+    global _cupy
+    if _cupy is None:
+        try:
+            import cupy
+            _cupy = cupy
+        except ImportError:
+            _cupy = False
+    if _cupy is False:
+        return None
+    try:
+        return _cupy.get_default_memory_pool().used_bytes()
+    except Exception:
+        return None
+
+def current_rss_bytes():
+    """RSS hiện tại của tiến trình (Linux); None nếu không đọc được"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def _sample_rss():
+    """Thread nền: lấy mẫu RSS hiện tại và nâng RSS đỉnh của mọi stage đang mở"""
+    while True:
+        _sampler_wake.wait()
+        rss = current_rss_bytes()
+        with _lock:
+            stages = list(_open_stages)
+            if not _open_stages:
+                # Không còn stage nào: ngủ tới khi có stage mới
+                _sampler_wake.clear()
+        if rss is not None:
+            for open_stage in stages:
+                open_stage._observe_rss(rss)
+        time.sleep(RSS_SAMPLE_INTERVAL)
+
+def _watch_rss(stage):
+    global _sampler_thread
+    with _lock:
+        _open_stages.add(stage)
+        if _sampler_thread is None:
+            _sampler_thread = threading.Thread(target=_sample_rss, name="rss-sampler", daemon=True)
+            _sampler_thread.start()
+    _sampler_wake.set()
+
+def _unwatch_rss(stage):
+    with _lock:
+        _open_stages.discard(stage)
+
+def _row_count(obj):
+    """Số dòng của DataFrame/mảng; phần tử đầu nếu là tuple kết quả"""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if hasattr(obj, 'shape') and getattr(obj, 'shape', None):
+        return int(obj.shape[0])
+    return None
+
+def _histogram_bucket(seconds):
+    """Bucket log2 theo mili giây: bucket k chứa [2^k, 2^(k+1)) ms"""
+    ms = seconds * 1000
+    return math.floor(math.log2(ms)) if ms > 0 else -math.inf
+
+class _Stage:
+    """Context manager ghi lại một lần chạy của một stage"""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self._gpu_start = _gpu_used_bytes()
+        self._rss_start = self._rss_peak = current_rss_bytes()
+        if self._rss_start is not None:
+            _watch_rss(self)
+        self._cpu_start = time.process_time()
+        self._wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall_start
+        cpu = time.process_time() - self._cpu_start
+        if self._rss_start is not None:
+            _unwatch_rss(self)
+            self._observe_rss(current_rss_bytes())
+        gpu_end = _gpu_used_bytes()
+        _local.stack.pop()
+
+        record = {
+            'stage': self.name,
+            'parent': self.parent,
+            'start': time.time() - wall,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            # RSS đỉnh trong chính stage này (lấy mẫu /proc/self/statm), không
+            # phải mức cao nhất từ đầu tiến trình như ru_maxrss
+            'peak_rss_mb': self._rss_peak / 2**20 if self._rss_start is not None else None,
+            'rss_growth_mb': (self._rss_peak - self._rss_start) / 2**20 if self._rss_start is not None else None,
+            'gpu_used_delta_mb': (gpu_end - self._gpu_start) / 2**20 if gpu_end is not None and self._gpu_start is not None else None,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'error': exc_type.__name__ if exc_type is not None else None,
+        }
+        _emit(record)
+        return False
+
+    def _observe_rss(self, rss):
+        if rss is not None and rss > self._rss_peak:
+            self._rss_peak = rss
+
+class _NullStage:
+    """Stage rỗng dùng khi tắt đo đạc"""
+    rows_in = None
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def _emit(record):
+    with _lock:
+        _records.append(record)
+        agg = _aggregates[record['stage']]
+        agg['count'] += 1
+        agg['wall_total'] += record['wall_s']
+        agg['wall_min'] = min(agg['wall_min'], record['wall_s'])
+        agg['wall_max'] = max(agg['wall_max'], record['wall_s'])
+        agg['histogram'][_histogram_bucket(record['wall_s'])] += 1
+        if _log_path:
+            with open(_log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def stage(name, rows_in=None):
+    """Context manager đo một stage; gán ``rows_out`` trên đối tượng trả về"""
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, rows_in)
+
+def instrument(name=None):
+    """Decorator đo một hàm; số dòng vào/ra suy ra từ tham số đầu và kết quả"""
+    def decorator(fn):
+        stage_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(stage_name, _row_count(args[0]) if args else None) as s:
+                result = fn(*args, **kwargs)
+                s.rows_out = _row_count(result)
+            return result
+        return wrapper
+    return decorator
+
+def records():
+    """Các bản ghi gần nhất (mới nhất ở cuối)"""
+    with _lock:
+        return list(_records)
+
+def summary():
+    """Tổng hợp theo stage: số lần, thời gian trung bình/min/max và histogram"""
+    with _lock:
+        return {
+            name: {
+                'count': agg['count'],
+                'wall_mean_s': agg['wall_total'] / agg['count'],
+                'wall_min_s': agg['wall_min'],
+                'wall_max_s': agg['wall_max'],
+                'histogram_ms': {
+                    ("0" if bucket == -math.inf else f"{2 ** bucket:g}-{2 ** (bucket + 1):g}"): count
+                    for bucket, count in sorted(agg['histogram'].items())
+                },
+            }
+            for name, agg in _aggregates.items()
+        }
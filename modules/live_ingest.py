@@ -0,0 +1,271 @@
+"""Dịch vụ nhận dữ liệu GPS trực tiếp và tính trạng thái đội xe theo cửa sổ trượt
+
+Nhận các dòng CSV cùng schema với ``fake_hcmc_road_gps_data.csv`` từ socket
+TCP cục bộ hoặc từ một file đang được ghi thêm (tail), rồi cứ mỗi
+``FLUSH_INTERVAL_S`` giây cập nhật trạng thái và ghi snapshot JSON (ghi file
+tạm rồi đổi tên) để Streamlit đọc:
+
+    python -m modules.live_ingest --listen 127.0.0.1:9999
+    python -m modules.live_ingest --tail data/live_gps.csv
+
+Mỗi chuyến chỉ giữ các điểm trong cửa sổ ``window_s`` giây tính theo thời
+gian dữ liệu (tối đa ``MAX_POINTS_PER_TRIP`` điểm); chuyến không có điểm mới
+trong cửa sổ bị xóa, nên bộ nhớ tỉ lệ với số xe đang hoạt động.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+import numpy as np
+from modules.bus_route_analysis import create_point_in_polygon_index, find_districts_for_points
+from modules.district_index import load_district_index
+from modules.instrumentation import instrument
+
+LIVE_STATE_PATH = "data/.cache/live/fleet_state.json"
+DISTRICTS_PATH = "data/SGDistrict.geo.json"
+WINDOW_S = 300
+FLUSH_INTERVAL_S = 0.25
+MAX_POINTS_PER_TRIP = 512
+# Hàng đợi có giới hạn: khi đầy, bên nhận phải chờ (backpressure)
+MAX_QUEUED_RECORDS = 200_000
+GPS_FIELDS = ['trip_id', 'timestamp', 'latitude', 'longitude', 'simulated_speed_kmh']
+
+def _epoch_seconds(text):
+    """Epoch (giây) của timestamp ISO; không có múi giờ thì coi là UTC như ``read_gps``/``pd.to_datetime``"""
+    ts = datetime.fromisoformat(text)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+def parse_gps_line(line):
+    """Đọc một dòng CSV GPS thành (trip_id, epoch_s, lat, lon, speed); None nếu không hợp lệ"""
+    parts = line.strip().split(",")
+    if len(parts) != len(GPS_FIELDS):
+        return None
+    try:
+        return (
+            int(parts[0]),
+            _epoch_seconds(parts[1]),
+            float(parts[2]),
+            float(parts[3]),
+            float(parts[4]),
+        )
+    except ValueError:
+        # Dòng tiêu đề hoặc dòng lỗi
+        return None
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+class LiveFleetState:
+    """Trạng thái đội xe trong cửa sổ trượt: quãng đường, tốc độ và số xe theo quận"""
+
+    def __init__(self, districts=None, window_s=WINDOW_S, max_points_per_trip=MAX_POINTS_PER_TRIP):
+        self.window_s = window_s
+        self.max_points_per_trip = max_points_per_trip
+        self.districts_gdf = create_point_in_polygon_index(districts) if districts is not None else None
+        # trip_id -> {'points': deque[(ts, lat, lon, speed, segment_km)], 'distance': km, 'speed_sum', 'district'}
+        self.trips = {}
+        self.watermark = None
+        self.records_total = 0
+        self.late_records = 0
+
+    @instrument()
+    def add_records(self, records):
+        """Thêm một loạt bản ghi đã parse và bỏ các điểm ra khỏi cửa sổ"""
+        touched = set()
+        for trip_id, ts, lat, lon, speed in records:
+            trip = self.trips.get(trip_id)
+            if trip is None:
+                trip = self.trips[trip_id] = {'points': deque(), 'distance': 0.0, 'speed_sum': 0.0, 'district': "Unknown"}
+            points = trip['points']
+            if points and ts < points[-1][0]:
+                # Điểm đến trễ trong cùng chuyến: bỏ để quãng đường không bị sai
+                self.late_records += 1
+                continue
+            segment = _haversine_km(points[-1][1], points[-1][2], lat, lon) if points else 0.0
+            points.append((ts, lat, lon, speed, segment))
+            trip['distance'] += segment
+            trip['speed_sum'] += speed
+            if len(points) > self.max_points_per_trip:
+                self._pop_oldest(trip)
+            touched.add(trip_id)
+            if self.watermark is None or ts > self.watermark:
+                self.watermark = ts
+        self.records_total += len(records)
+        self._expire()
+        self._assign_districts(touched & self.trips.keys())
+
+    def _pop_oldest(self, trip):
+        """Bỏ điểm cũ nhất của chuyến, trừ đoạn nối nó với điểm kế tiếp"""
+        points = trip['points']
+        _, _, _, speed, _ = points.popleft()
+        trip['speed_sum'] -= speed
+        if points:
+            ts, lat, lon, next_speed, segment = points[0]
+            trip['distance'] -= segment
+            points[0] = (ts, lat, lon, next_speed, 0.0)
+
+    def _expire(self):
+        """Bỏ các điểm cũ hơn ``watermark - window_s`` và các chuyến không còn điểm"""
+        if self.watermark is None:
+            return
+        horizon = self.watermark - self.window_s
+        for trip_id in list(self.trips):
+            trip = self.trips[trip_id]
+            points = trip['points']
+            while points and points[0][0] < horizon:
+                self._pop_oldest(trip)
+            if not points:
+                del self.trips[trip_id]
+
+    def _assign_districts(self, trip_ids):
+        """Tra quận cho vị trí mới nhất của các chuyến vừa có điểm mới (một lần truy vấn)"""
+        if self.districts_gdf is None or not trip_ids:
+            return
+        trip_ids = list(trip_ids)
+        last = [self.trips[trip_id]['points'][-1] for trip_id in trip_ids]
+        names = find_districts_for_points(
+            np.array([point[2] for point in last]),
+            np.array([point[1] for point in last]),
+            self.districts_gdf,
+        )
+        for trip_id, name in zip(trip_ids, names):
+            self.trips[trip_id]['district'] = name
+
+    def snapshot(self):
+        """Trạng thái hiện tại dưới dạng dict có thể ghi JSON"""
+        vehicles = []
+        for trip_id, trip in self.trips.items():
+            points = trip['points']
+            ts, lat, lon, speed, _ = points[-1]
+            span_h = (ts - points[0][0]) / 3600
+            vehicles.append({
+                'trip_id': trip_id,
+                'timestamp': ts,
+                'latitude': lat,
+                'longitude': lon,
+                'speed_kmh': round(speed, 2),
+                'window_distance_km': round(trip['distance'], 3),
+                # Tốc độ trung bình trong cửa sổ: quãng đường / thời gian
+                'window_avg_speed_kmh': round(trip['distance'] / span_h, 2) if span_h > 0 else None,
+                'window_mean_reported_kmh': round(trip['speed_sum'] / len(points), 2),
+                'window_points': len(points),
+                'district': trip['district'],
+            })
+        return {
+            'updated_at': time.time(),
+            'watermark': self.watermark,
+            'window_s': self.window_s,
+            'records_total': self.records_total,
+            'late_records': self.late_records,
+            'active_vehicles': len(vehicles),
+            'district_counts': dict(Counter(vehicle['district'] for vehicle in vehicles).most_common()),
+            'vehicles': vehicles,
+        }
+
+def write_snapshot(snapshot, path=LIVE_STATE_PATH):
+    """Ghi snapshot JSON bằng cách ghi file tạm rồi đổi tên (không bao giờ đọc phải file ghi dở)"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def load_live_snapshot(path=LIVE_STATE_PATH):
+    """Đọc snapshot mới nhất; None nếu dịch vụ chưa chạy"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+async def _enqueue_lines(lines, queue):
+    async for line in lines:
+        record = parse_gps_line(line.decode("utf-8") if isinstance(line, bytes) else line)
+        if record is not None:
+            await queue.put(record)
+
+async def serve_socket(queue, host, port):
+    """Nhận các dòng CSV từ client TCP (mỗi kết nối một luồng dữ liệu)"""
+    async def handle(reader, writer):
+        try:
+            await _enqueue_lines(reader, queue)
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+async def _tail_lines(path, poll_interval_s, from_start):
+    with open(path, "r", encoding="utf-8") as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                await asyncio.sleep(poll_interval_s)
+                continue
+            # Dòng chưa ghi xong: chờ phần còn lại
+            partial += line
+            if partial.endswith("\n"):
+                yield partial
+                partial = ""
+
+async def tail_file(queue, path, poll_interval_s=0.05, from_start=False):
+    """Đọc các dòng mới được ghi thêm vào ``path`` (giống ``tail -f``)"""
+    await _enqueue_lines(_tail_lines(path, poll_interval_s, from_start), queue)
+
+async def flush_loop(queue, state, output_path=LIVE_STATE_PATH, interval_s=FLUSH_INTERVAL_S):
+    """Định kỳ lấy hết bản ghi trong hàng đợi, cập nhật trạng thái và ghi snapshot"""
+    while True:
+        await asyncio.sleep(interval_s)
+        batch = []
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        if batch:
+            state.add_records(batch)
+            write_snapshot(state.snapshot(), output_path)
+
+async def run_ingest(listen=None, tail=None, from_start=False, output_path=LIVE_STATE_PATH,
+                     districts_path=DISTRICTS_PATH, window_s=WINDOW_S, interval_s=FLUSH_INTERVAL_S):
+    """Chạy dịch vụ nhận dữ liệu cho tới khi bị dừng"""
+    queue = asyncio.Queue(maxsize=MAX_QUEUED_RECORDS)
+    state = LiveFleetState(load_district_index(districts_path), window_s=window_s)
+    tasks = [asyncio.create_task(flush_loop(queue, state, output_path, interval_s))]
+    if listen is not None:
+        host, port = listen.rsplit(":", 1)
+        server = await serve_socket(queue, host, int(port))
+        tasks.append(asyncio.create_task(server.serve_forever()))
+        print(f"Đang nhận dữ liệu GPS tại {listen}")
+    if tail is not None:
+        tasks.append(asyncio.create_task(tail_file(queue, tail, from_start=from_start)))
+        print(f"Đang theo dõi file '{tail}'")
+    await asyncio.gather(*tasks)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nhận dữ liệu GPS trực tiếp và ghi trạng thái đội xe")
+    parser.add_argument("--listen", help="host:port của socket TCP, ví dụ 127.0.0.1:9999")
+    parser.add_argument("--tail", help="File CSV đang được ghi thêm")
+    parser.add_argument("--from-start", action="store_true", help="Đọc file tail từ đầu thay vì từ cuối")
+    parser.add_argument("--output", default=LIVE_STATE_PATH)
+    parser.add_argument("--districts", default=DISTRICTS_PATH)
+    parser.add_argument("--window", type=int, default=WINDOW_S, help="Độ dài cửa sổ trượt (giây)")
+    parser.add_argument("--interval", type=float, default=FLUSH_INTERVAL_S, help="Chu kỳ ghi snapshot (giây)")
+    args = parser.parse_args(argv)
+    if args.listen is None and args.tail is None:
+        parser.error("Cần ít nhất một nguồn: --listen hoặc --tail")
+    try:
+        asyncio.run(run_ingest(args.listen, args.tail, args.from_start, args.output,
+                               args.districts, args.window, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Phát lại file CSV GPS có sẵn như một luồng dữ liệu trực tiếp
+
+Các điểm được gửi theo thứ tự thời gian, giãn cách theo timestamp gốc chia
+cho ``--speedup``; đích là socket của ``modules.live_ingest --listen`` hoặc
+một file để ``--tail``:
+
+    python -m modules.live_replay data/fake_hcmc_road_gps_data.csv --connect 127.0.0.1:9999 --speedup 60
+    python -m modules.live_replay data/fake_hcmc_road_gps_data.csv --append data/live_gps.csv
+"""
+import argparse
+import asyncio
+import time
+
+from modules.gps_store import read_gps
+from modules.live_ingest import GPS_FIELDS
+
+# Số dòng gửi mỗi lần; các điểm cùng lô được gửi cùng lúc
+REPLAY_BATCH_ROWS = 500
+
+def _csv_lines(gps_data):
+    """Chuyển DataFrame GPS thành các dòng CSV cùng định dạng file gốc"""
+    timestamps = gps_data['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').to_numpy()
+    columns = zip(
+        gps_data['trip_id'].to_numpy().tolist(),
+        timestamps.tolist(),
+        gps_data['latitude'].to_numpy().tolist(),
+        gps_data['longitude'].to_numpy().tolist(),
+        gps_data['simulated_speed_kmh'].to_numpy().tolist(),
+    )
+    return [f"{trip_id},{ts},{lat},{lon},{speed}\n" for trip_id, ts, lat, lon, speed in columns]
+
+async def replay(file_path, write, speedup=60.0, limit=None):
+    """Gửi các dòng theo nhịp thời gian gốc; ``write(text)`` là coroutine ghi ra đích"""
+    gps_data = read_gps(file_path, columns=GPS_FIELDS)
+    gps_data = gps_data.sort_values(['timestamp', 'trip_id'], kind='stable')
+    if limit is not None:
+        gps_data = gps_data.head(limit)
+    lines = _csv_lines(gps_data)
+    offsets = (gps_data['timestamp'] - gps_data['timestamp'].iloc[0]).dt.total_seconds().to_numpy() / speedup
+
+    started = time.monotonic()
+    for start in range(0, len(lines), REPLAY_BATCH_ROWS):
+        # Chờ tới thời điểm của điểm cuối lô
+        stop = min(start + REPLAY_BATCH_ROWS, len(lines))
+        delay = offsets[stop - 1] - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await write("".join(lines[start:stop]))
+    return len(lines)
+
+async def replay_to_socket(file_path, host, port, speedup=60.0, limit=None):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def write(text):
+        writer.write(text.encode("utf-8"))
+        await writer.drain()
+
+    try:
+        return await replay(file_path, write, speedup, limit)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def replay_to_file(file_path, output_path, speedup=60.0, limit=None):
+    with open(output_path, "a", encoding="utf-8") as f:
+        async def write(text):
+            f.write(text)
+            f.flush()
+
+        return await replay(file_path, write, speedup, limit)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phát lại file CSV GPS như dữ liệu trực tiếp")
+    parser.add_argument("file_path")
+    parser.add_argument("--connect", help="host:port của dịch vụ live_ingest")
+    parser.add_argument("--append", help="File để ghi thêm (dùng với live_ingest --tail)")
+    parser.add_argument("--speedup", type=float, default=60.0, help="Tốc độ phát so với thời gian thực")
+    parser.add_argument("--limit", type=int, help="Chỉ phát N điểm đầu tiên")
+    args = parser.parse_args(argv)
+    if (args.connect is None) == (args.append is None):
+        parser.error("Cần đúng một đích: --connect hoặc --append")
+    if args.connect is not None:
+        host, port = args.connect.rsplit(":", 1)
+        sent = asyncio.run(replay_to_socket(args.file_path, host, int(port), args.speedup, args.limit))
+    else:
+        sent = asyncio.run(replay_to_file(args.file_path, args.append, args.speedup, args.limit))
+    print(f"Đã phát {sent} điểm GPS")
+
+if __name__ == "__main__":
+    main()
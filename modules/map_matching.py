@@ -0,0 +1,388 @@
+"""Map-matching dữ liệu GPS lên mạng lưới đường OSM đã lưu (HMM/Viterbi)
+
+Mạng lưới đường được đọc từ ``data/hcmc_graph.graphml`` (file do
+``data/genarate_gps_data.py`` tải bằng osmnx) bằng parser XML của thư viện
+chuẩn, rồi biên dịch thành các mảng phẳng và lưu cache ``.npy`` cạnh file
+nguồn như index quận. Mỗi tiến trình con dựng một lần STRtree trên hình học
+các cạnh và đồ thị CSR của scipy.
+
+Với mỗi chuyến, các cạnh trong bán kính ``radius_m`` quanh mỗi điểm là các
+trạng thái ứng viên (tối đa ``max_candidates``). Xác suất phát xạ là Gauss
+theo khoảng cách tới đường (``sigma_m``), xác suất chuyển theo độ lệch giữa
+quãng đường trên mạng lưới và khoảng cách thẳng giữa hai điểm GPS
+(``beta_m``), theo Newson & Krumm (2009). Quãng đường trên mạng lưới dùng
+Dijkstra giới hạn ``max_route_m`` và được nhớ theo nút nguồn. Khi không còn
+đường đi hợp lệ giữa hai điểm, chuỗi HMM được bắt đầu lại.
+
+Tọa độ được chiếu phẳng (equirectangular quanh vĩ độ TP.HCM) để tính theo
+mét; sai số không đáng kể ở phạm vi một thành phố.
+"""
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from shapely import GeometryType, STRtree
+from modules.map_utils import METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+from modules.trip_index import get_trip_index
+from modules.instrumentation import instrument
+
+ROAD_GRAPH_PATH = "data/hcmc_graph.graphml"
+ROAD_ARRAYS = ['xy', 'offsets', 'u', 'v']
+ROAD_INDEX_VERSION = 1
+
+# Tham số HMM mặc định
+GPS_SIGMA_M = 10.0
+TRANSITION_BETA_M = 50.0
+SEARCH_RADIUS_M = 50.0
+MAX_CANDIDATES = 8
+MAX_ROUTE_M = 3000.0
+# Số nút nguồn Dijkstra được nhớ trong mỗi tiến trình
+MAX_CACHED_ROUTES = 20_000
+# Số điểm mỗi lô gửi cho một tiến trình con (các chuyến không bị tách)
+MATCH_BATCH_POINTS = 50_000
+
+def _to_metric(lons, lats):
+    return np.asarray(lons, dtype=np.float64) * METERS_PER_DEG_LON, np.asarray(lats, dtype=np.float64) * METERS_PER_DEG_LAT
+
+def _read_graphml(file_path):
+    """Đọc nút (x, y) và cạnh (source, target, geometry WKT) từ file GraphML của osmnx"""
+    keys = {}
+    nodes = {}
+    edges = []
+    for _, elem in ET.iterparse(file_path, events=('end',)):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag == 'key':
+            keys[elem.get('id')] = elem.get('attr.name')
+        elif tag == 'node':
+            data = {keys.get(child.get('key')): child.text for child in elem}
+            nodes[elem.get('id')] = (float(data['x']), float(data['y']))
+            elem.clear()
+        elif tag == 'edge':
+            data = {keys.get(child.get('key')): child.text for child in elem}
+            edges.append((elem.get('source'), elem.get('target'), data.get('geometry'), data.get('name')))
+            elem.clear()
+    return nodes, edges
+
+@instrument()
+def compile_road_network(file_path):
+    """Chuyển GraphML thành các mảng phẳng
+
+    ``xy`` chứa tọa độ (lon, lat) của mọi cạnh, ``offsets`` trỏ vào ``xy``;
+    ``u``/``v`` là chỉ số nút đầu/cuối của từng cạnh (cạnh có hướng).
+    Cạnh không có ``geometry`` là đoạn thẳng nối hai nút.
+    """
+    nodes, edges = _read_graphml(file_path)
+    node_ids = {node_id: i for i, node_id in enumerate(nodes)}
+    node_xy = np.array(list(nodes.values()), dtype=np.float64).reshape(-1, 2)
+
+    u = np.array([node_ids[edge[0]] for edge in edges], dtype=np.int32)
+    v = np.array([node_ids[edge[1]] for edge in edges], dtype=np.int32)
+    wkt = np.array([edge[2] for edge in edges], dtype=object)
+    geoms = shapely.from_wkt(wkt)
+    missing = shapely.is_missing(geoms)
+    if missing.any():
+        geoms[missing] = shapely.linestrings(np.stack([node_xy[u[missing]], node_xy[v[missing]]], axis=1))
+    xy, edge_index = shapely.get_coordinates(geoms, return_index=True)
+    offsets = np.searchsorted(edge_index, np.arange(len(edges) + 1)).astype(np.int64)
+    return {
+        'xy': xy,
+        'offsets': offsets,
+        'u': u,
+        'v': v,
+        'n_nodes': len(nodes),
+        'names': [edge[3] for edge in edges],
+    }
+
+def _source_key(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"{digest.hexdigest()[:16]}-{os.stat(file_path).st_mtime_ns}"
+
+@instrument()
+def load_road_network(file_path=ROAD_GRAPH_PATH, cache_dir=None):
+    """Đọc mạng lưới đường đã biên dịch, chỉ parse GraphML khi file nguồn thay đổi"""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), ".cache")
+    index_dir = os.path.join(cache_dir, f"roads-{_source_key(file_path)}")
+    meta_path = os.path.join(index_dir, "meta.json")
+
+    if os.path.isfile(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get('version') == ROAD_INDEX_VERSION:
+            network = {'n_nodes': meta['n_nodes'], 'names': meta['names']}
+            for name in ROAD_ARRAYS:
+                network[name] = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+            return network
+
+    network = compile_road_network(file_path)
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in ROAD_ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), network[name])
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({'version': ROAD_INDEX_VERSION, 'n_nodes': network['n_nodes'], 'names': network['names']}, f, ensure_ascii=False)
+    try:
+        os.rename(tmp_dir, index_dir)
+    except OSError:
+        # Một tiến trình khác đã ghi xong trước
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    return network
+
+class RoadMatcher:
+    """Bộ map-matching HMM trên một mạng lưới đường đã biên dịch"""
+
+    def __init__(self, network, sigma_m=GPS_SIGMA_M, beta_m=TRANSITION_BETA_M, radius_m=SEARCH_RADIUS_M,
+                 max_candidates=MAX_CANDIDATES, max_route_m=MAX_ROUTE_M):
+        self.sigma_m = sigma_m
+        self.beta_m = beta_m
+        self.radius_m = radius_m
+        self.max_candidates = max_candidates
+        self.max_route_m = max_route_m
+
+        x, y = _to_metric(network['xy'][:, 0], network['xy'][:, 1])
+        self.lines = shapely.from_ragged_array(
+            GeometryType.LINESTRING, np.column_stack((x, y)), (np.asarray(network['offsets']),)
+        )
+        self.tree = STRtree(self.lines)
+        self.edge_length = shapely.length(self.lines)
+        self.u = np.asarray(network['u'])
+        self.v = np.asarray(network['v'])
+
+        # Đồ thị nút có hướng; cạnh song song giữ cạnh ngắn nhất (csr_matrix cộng trùng lặp)
+        order = np.lexsort((self.edge_length, self.v, self.u))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (self.u[order][1:] != self.u[order][:-1]) | (self.v[order][1:] != self.v[order][:-1])
+        keep = order[first]
+        n_nodes = network['n_nodes']
+        self.graph = csr_matrix(
+            (np.maximum(self.edge_length[keep], 1e-6), (self.u[keep], self.v[keep])),
+            shape=(n_nodes, n_nodes)
+        )
+        self._routes = {}
+
+    def candidates(self, x, y):
+        """Các cạnh ứng viên của từng điểm (tối đa ``max_candidates``, gần nhất trước)
+
+        Trả về (point_idx, edge, distance_m, offset_m) sắp theo điểm rồi khoảng cách.
+        """
+        points = shapely.points(x, y)
+        point_idx, edge = self.tree.query(points, predicate='dwithin', distance=self.radius_m)
+        distance = shapely.distance(points[point_idx], self.lines[edge])
+        order = np.lexsort((distance, point_idx))
+        point_idx, edge, distance = point_idx[order], edge[order], distance[order]
+        # Hạng của ứng viên trong nhóm cùng điểm
+        starts = np.flatnonzero(np.concatenate(([True], point_idx[1:] != point_idx[:-1]))) if len(point_idx) else np.empty(0, dtype=np.int64)
+        rank = np.arange(len(point_idx)) - np.repeat(starts, np.diff(np.append(starts, len(point_idx))))
+        keep = rank < self.max_candidates
+        point_idx, edge, distance = point_idx[keep], edge[keep], distance[keep]
+        offset = shapely.line_locate_point(self.lines[edge], points[point_idx])
+        return point_idx, edge, distance, offset
+
+    def _reachable(self, node):
+        """Dict nút -> khoảng cách từ ``node`` trong phạm vi ``max_route_m`` (nhớ theo nút)"""
+        cached = self._routes.get(node)
+        if cached is None:
+            if len(self._routes) >= MAX_CACHED_ROUTES:
+                self._routes.clear()
+            dist = dijkstra(self.graph, directed=True, indices=node, limit=self.max_route_m)
+            # Luôn chứa chính ``node`` với khoảng cách 0
+            reached = np.flatnonzero(np.isfinite(dist))
+            cached = self._routes[node] = dict(zip(reached.tolist(), dist[reached].tolist()))
+        return cached
+
+    def _route_distances(self, edges_a, offsets_a, edges_b, offsets_b):
+        """Ma trận quãng đường trên mạng lưới từ các ứng viên a tới các ứng viên b"""
+        targets = self.u[edges_b].tolist()
+        between = np.array([
+            [reach.get(target, np.inf) for target in targets]
+            for reach in map(self._reachable, self.v[edges_a].tolist())
+        ]).reshape(len(edges_a), len(edges_b))
+
+        # Đi hết cạnh a, theo đồ thị tới nút đầu cạnh b, rồi đi tới vị trí trên b
+        routes = (self.edge_length[edges_a] - offsets_a)[:, None] + between + offsets_b[None, :]
+        # Cùng một cạnh và đi theo chiều thuận
+        same = (edges_a[:, None] == edges_b[None, :]) & (offsets_b[None, :] >= offsets_a[:, None])
+        routes = np.where(same, offsets_b[None, :] - offsets_a[:, None], routes)
+        routes[routes > self.max_route_m] = np.inf
+        return routes
+
+    def match_trip(self, x, y, point_idx, edge, distance, offset):
+        """Viterbi trên một chuyến; các mảng ứng viên đã được lọc cho chuyến này
+
+        Trả về (edge, offset, route_m) cho từng điểm; -1/NaN nếu điểm không
+        khớp được, ``route_m`` là quãng đường trên mạng lưới từ điểm khớp trước.
+        """
+        n = len(x)
+        out_edge = np.full(n, -1, dtype=np.int64)
+        out_offset = np.full(n, np.nan)
+        out_route = np.full(n, np.nan)
+        bounds = np.searchsorted(point_idx, np.arange(n + 1))
+        emission = -0.5 * (distance / self.sigma_m) ** 2
+
+        segment = []  # [(i, slice ứng viên, backpointer, quãng đường)] của chuỗi HMM hiện tại
+        scores = None
+        prev_i = None
+        for i in range(n + 1):
+            cand = slice(bounds[i], bounds[i + 1]) if i < n else slice(0, 0)
+            if i < n and cand.stop > cand.start and scores is not None:
+                straight = np.hypot(x[i] - x[prev_i], y[i] - y[prev_i])
+                routes = self._route_distances(edge[prev_cand], offset[prev_cand], edge[cand], offset[cand])
+                total = scores[:, None] - np.abs(routes - straight) / self.beta_m
+                back = np.argmax(total, axis=0)
+                best = total[back, np.arange(total.shape[1])]
+                if np.isfinite(best).any():
+                    scores = best + emission[cand]
+                    segment.append((i, cand, back, routes))
+                    prev_i, prev_cand = i, cand
+                    continue
+            # Kết thúc chuỗi hiện tại (hết điểm, điểm không có ứng viên hoặc không có đường đi)
+            if segment:
+                self._backtrack(segment, scores, edge, offset, out_edge, out_offset, out_route)
+            segment, scores = [], None
+            if i < n and cand.stop > cand.start:
+                scores = emission[cand].copy()
+                segment.append((i, cand, None, None))
+                prev_i, prev_cand = i, cand
+        return out_edge, out_offset, out_route
+
+    @staticmethod
+    def _backtrack(segment, scores, edge, offset, out_edge, out_offset, out_route):
+        state = int(np.argmax(scores))
+        for i, cand, back, routes in reversed(segment):
+            out_edge[i] = edge[cand][state]
+            out_offset[i] = offset[cand][state]
+            if back is None:
+                out_route[i] = 0.0
+            else:
+                prev_state = int(back[state])
+                out_route[i] = routes[prev_state, state]
+                state = prev_state
+
+    def match_batch(self, lons, lats, offsets):
+        """Map-match một lô gồm nhiều chuyến liên tiếp (``offsets`` kiểu CSR)"""
+        x, y = _to_metric(lons, lats)
+        point_idx, edge, distance, offset = self.candidates(x, y)
+        out_edge = np.full(len(x), -1, dtype=np.int64)
+        out_offset = np.full(len(x), np.nan)
+        out_route = np.full(len(x), np.nan)
+        out_distance = np.full(len(x), np.nan)
+        bounds = np.searchsorted(point_idx, offsets)
+        for start, stop, c_start, c_stop in zip(offsets[:-1], offsets[1:], bounds[:-1], bounds[1:]):
+            trip = slice(start, stop)
+            cand = slice(c_start, c_stop)
+            out_edge[trip], out_offset[trip], out_route[trip] = self.match_trip(
+                x[trip], y[trip], point_idx[cand] - start, edge[cand], distance[cand], offset[cand]
+            )
+        matched = out_edge >= 0
+        if matched.any():
+            snapped = shapely.line_interpolate_point(self.lines[out_edge[matched]], out_offset[matched])
+            out_distance[matched] = shapely.distance(snapped, shapely.points(x[matched], y[matched]))
+            snapped_xy = shapely.get_coordinates(snapped)
+        else:
+            snapped_xy = np.empty((0, 2))
+        matched_lon = np.full(len(x), np.nan)
+        matched_lat = np.full(len(x), np.nan)
+        matched_lon[matched] = snapped_xy[:, 0] / METERS_PER_DEG_LON
+        matched_lat[matched] = snapped_xy[:, 1] / METERS_PER_DEG_LAT
+        return out_edge, out_offset, out_route, out_distance, matched_lon, matched_lat
+
+# Bộ matcher của tiến trình con, dựng một lần trong initializer
+_worker_matcher = None
+
+def _init_worker(network_path, matcher_params):
+    global _worker_matcher
+    _worker_matcher = RoadMatcher(load_road_network(network_path), **matcher_params)
+
+def _match_batch_in_worker(lons, lats, offsets):
+    return _worker_matcher.match_batch(lons, lats, offsets)
+
+def _trip_batches(offsets, batch_points):
+    """Chia các chuyến thành các lô khoảng ``batch_points`` điểm, không tách chuyến"""
+    boundaries = [0]
+    for trip in range(1, len(offsets)):
+        if offsets[trip] - offsets[boundaries[-1]] >= batch_points:
+            boundaries.append(trip)
+    if boundaries[-1] != len(offsets) - 1:
+        boundaries.append(len(offsets) - 1)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+@instrument()
+def match_trajectories(gps_data, network_path=ROAD_GRAPH_PATH, workers=None, batch_points=MATCH_BATCH_POINTS, **matcher_params):
+    """Map-match toàn bộ các chuyến trong ``gps_data`` lên mạng lưới đường
+
+    Các lô chuyến được xử lý song song trên ``workers`` tiến trình (mặc định
+    bằng số CPU; ``workers=1`` chạy ngay trong tiến trình hiện tại). Kết quả
+    có cùng thứ tự dòng với ``gps_data`` gồm: ``edge`` (-1 nếu không khớp),
+    ``offset_m`` trên cạnh, ``route_m`` (quãng đường trên mạng lưới từ điểm
+    khớp trước của chuyến, 0 ở đầu mỗi chuỗi), ``distance_to_road_m`` và tọa
+    độ đã khớp ``matched_lon``/``matched_lat``.
+    """
+    trip_index = get_trip_index(gps_data)
+    lons = trip_index.column(gps_data, 'longitude', dtype=np.float64)
+    lats = trip_index.column(gps_data, 'latitude', dtype=np.float64)
+    offsets = trip_index.offsets
+    batches = _trip_batches(offsets, batch_points)
+    tasks = [
+        (lons[offsets[a]:offsets[b]], lats[offsets[a]:offsets[b]], offsets[a:b + 1] - offsets[a])
+        for a, b in batches
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        matcher = RoadMatcher(load_road_network(network_path), **matcher_params)
+        results = [matcher.match_batch(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(network_path, matcher_params)) as pool:
+            results = list(pool.map(_match_batch_in_worker, *zip(*tasks)))
+
+    columns = ['edge', 'offset_m', 'route_m', 'distance_to_road_m', 'matched_lon', 'matched_lat']
+    merged = [np.concatenate([result[k] for result in results]) if results else np.empty(0) for k in range(len(columns))]
+    # Đưa kết quả về thứ tự dòng gốc
+    rows = trip_index.rows(np.arange(trip_index.n_rows))
+    matched = pd.DataFrame(index=gps_data.index)
+    for name, values in zip(columns, merged):
+        column = np.empty_like(values)
+        column[rows] = values
+        matched[name] = column
+    return matched
+
+@instrument()
+def edge_speed_summary(gps_data, matched, network_path=ROAD_GRAPH_PATH):
+    """Tốc độ theo từng cạnh đường từ kết quả map-matching
+
+    Tốc độ mỗi điểm là quãng đường trên mạng lưới từ điểm khớp trước chia
+    cho khoảng thời gian giữa hai điểm; trả về số điểm, trung vị và trung bình
+    tốc độ (km/h) cho từng cạnh.
+    """
+    trip_index = get_trip_index(gps_data)
+    ts_ns = trip_index.column(gps_data, 'timestamp').astype('datetime64[ns]').view(np.int64)
+    edge = trip_index.take(matched['edge'].to_numpy())
+    route_m = trip_index.take(matched['route_m'].to_numpy())
+    # Thời gian từ điểm trước trong cùng chuyến (điểm đầu chuyến: NaN)
+    dt_s = np.full(len(ts_ns), np.nan)
+    dt_s[1:] = np.where(trip_index.same_trip, np.diff(ts_ns) / 1e9, np.nan)
+    speed = np.where((dt_s > 0) & (route_m > 0), route_m / dt_s * 3.6, np.nan)
+    # Chỉ tính khi điểm trước trong chuyến cũng khớp được (route_m đo từ chính điểm đó)
+    prev_matched = np.concatenate(([False], trip_index.same_trip & (edge[:-1] >= 0)))
+
+    valid = (edge >= 0) & prev_matched & np.isfinite(speed)
+    speeds = pd.DataFrame({'edge': edge[valid], 'speed_kmh': speed[valid]})
+    summary = speeds.groupby('edge')['speed_kmh'].agg(n_points='size', median_speed_kmh='median', mean_speed_kmh='mean').reset_index()
+    network = load_road_network(network_path)
+    summary['u'] = np.asarray(network['u'])[summary['edge']]
+    summary['v'] = np.asarray(network['v'])[summary['edge']]
+    summary['name'] = [network['names'][e] for e in summary['edge']]
+    return summary
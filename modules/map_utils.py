@@ -1,23 +1,48 @@
 import json
+import numpy as np
 import pydeck as pdk
+import shapely
+from modules.district_index import as_district_index
+from modules.instrumentation import instrument
+from modules.trip_index import get_trip_index
+from modules.result_cache import persistent_cache
+
+# Lưới gom điểm cho heatmap: các kích thước ô (mét) được tính và cache sẵn;
+# mỗi mức zoom dùng ô lớn nhất không vượt quá HEATMAP_CELL_PIXELS điểm ảnh
+HEATMAP_CELL_SIZES_M = (10, 25, 50, 100, 200, 400, 800, 1600)
+HEATMAP_CELL_PIXELS = 4
+# Vĩ độ tham chiếu cố định để lưới không phụ thuộc vào tập dữ liệu
+GRID_REFERENCE_LAT = 10.8
+METERS_PER_DEG_LAT = 110_574.0
+METERS_PER_DEG_LON = 111_320.0 * np.cos(np.radians(GRID_REFERENCE_LAT))
+
+# Số chữ số thập phân của tọa độ gửi tới trình duyệt (1e-5 độ ~ 1.1 m)
+COORD_DECIMALS = 5
+
+# Các mức zoom có sẵn bản đơn giản hóa của đường đi; dung sai mỗi mức bằng
+# PATH_SIMPLIFY_PIXELS điểm ảnh ở mức zoom đó (Douglas-Peucker)
+PATH_SIMPLIFY_ZOOM_LEVELS = (10, 12, 14, 16, 18)
+PATH_SIMPLIFY_PIXELS = 1.0
 
 def load_geojson(file_path):
     """Đọc dữ liệu GeoJSON từ file"""
     with open(file_path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+@instrument()
 def create_district_layer(districts):
     """Tạo layer cho các quận"""
-    polygons = []
-    
-    for district in districts["level2s"]:
-        for polygon in district["coordinates"]:
-            coords = polygon[0]
-            polygons.append({
-                "name": district["name"],
-                "id": district["level2_id"],
-                "coordinates": coords
-            })
+    index = as_district_index(districts)
+    # Mỗi polygon là một vòng ngoài; vị trí lấy thẳng từ mảng phẳng của index
+    ring_offsets = np.asarray(index['ring_offsets'])
+    part_rings = np.asarray(index['part_offsets'])[:-1]
+    part_owner = np.repeat(np.arange(len(index['names'])), np.diff(index['geom_offsets']))
+    polygons = path_records(
+        np.asarray(index['xy']), np.append(ring_offsets[part_rings], ring_offsets[-1]),
+        path_key="coordinates",
+        name=np.asarray(index['names'], dtype=object)[part_owner],
+        id=np.asarray(index['ids'], dtype=object)[part_owner],
+    )
     
     return pdk.Layer(
         "PolygonLayer",
@@ -32,6 +57,7 @@ def create_district_layer(districts):
         extruded=False,
     )
 
+@instrument()
 def create_gps_layer(gps_data):
     """Tạo layer cho các điểm GPS"""
     return pdk.Layer(
@@ -44,15 +70,125 @@ def create_gps_layer(gps_data):
         auto_highlight=True,
     )
 
-def create_heatmap_layer(gps_data):
-    """Tạo layer heatmap cho các điểm GPS"""
+@instrument()
+def create_heatmap_layer(gps_data, zoom=13.5):
+    """Tạo layer heatmap cho các điểm GPS
+
+    Điểm được gom sẵn vào lưới ở server; trọng số mỗi ô là tổng tốc độ của các
+    điểm trong ô, tương đương với việc gửi từng điểm có trọng số tốc độ.
+    """
+    bins = aggregate_heatmap_bins(gps_data, heatmap_cell_size_m(zoom))
     return pdk.Layer(
         "HeatmapLayer",
-        data=gps_data,
+        data=compact_point_frame(bins, ['simulated_speed_kmh_sum']),
         get_position=['longitude', 'latitude'],
-        get_weight='simulated_speed_kmh',
+        get_weight='simulated_speed_kmh_sum',
         radius_pixels=50,
         intensity=1,
         threshold=0.05,
         pickable=True,
-    ) 
\ No newline at end of file
+    )
+
+def simplify_tolerance_deg(zoom, pixels=PATH_SIMPLIFY_PIXELS):
+    """Kích thước ``pixels`` điểm ảnh (tính theo độ) ở mức zoom Web Mercator"""
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+def trip_path_arrays(gps_data):
+    """Gom điểm GPS thành đường đi của từng chuyến theo chỉ mục chuyến dùng chung
+
+    Trả về (trip_ids, coords, offsets): ``coords[offsets[i]:offsets[i + 1]]``
+    là đường đi của chuyến ``trip_ids[i]`` theo thứ tự thời gian.
+    """
+    index = get_trip_index(gps_data)
+    coords = index.take(gps_data[['longitude', 'latitude']].to_numpy(dtype=np.float64))
+    return index.trip_ids, coords, index.offsets
+
+@instrument()
+@persistent_cache()
+def build_trip_path_levels(gps_data, zoom_levels=PATH_SIMPLIFY_ZOOM_LEVELS):
+    """Tạo đường đi của các chuyến, đơn giản hóa sẵn cho từng mức zoom
+
+    Trả về dict ``zoom -> (trip_ids, coords, offsets)``; chỉ giữ các chuyến có
+    ít nhất hai điểm. Việc đơn giản hóa chạy vectorized trên toàn bộ các
+    LineString bằng ``shapely.simplify``.
+    """
+    trip_ids, coords, offsets = trip_path_arrays(gps_data)
+    lengths = np.diff(offsets)
+    keep = lengths > 1
+    trip_ids = trip_ids[keep]
+    line_index = np.repeat(np.arange(keep.sum()), lengths[keep])
+    coords = coords[np.repeat(keep, lengths)]
+    lines = shapely.linestrings(coords, indices=line_index)
+
+    levels = {}
+    for zoom in zoom_levels:
+        simplified = shapely.simplify(lines, simplify_tolerance_deg(zoom), preserve_topology=False)
+        level_coords, level_index = shapely.get_coordinates(simplified, return_index=True)
+        level_offsets = np.searchsorted(level_index, np.arange(len(trip_ids) + 1))
+        levels[zoom] = (trip_ids, level_coords, level_offsets)
+    return levels
+
+def select_path_level(levels, zoom):
+    """Chọn mức đơn giản hóa thô nhất vẫn không sai lệch quá 1 điểm ảnh ở ``zoom``"""
+    candidates = [level for level in sorted(levels) if level >= zoom]
+    return levels[candidates[0] if candidates else max(levels)]
+
+def meters_per_pixel(zoom, latitude=GRID_REFERENCE_LAT):
+    """Số mét trên một điểm ảnh ở mức zoom Web Mercator"""
+    return 156_543.03392 * np.cos(np.radians(latitude)) / 2 ** zoom
+
+def heatmap_cell_size_m(zoom):
+    """Chọn kích thước ô lưới heatmap cho mức zoom hiện tại"""
+    target = HEATMAP_CELL_PIXELS * meters_per_pixel(zoom)
+    candidates = [size for size in HEATMAP_CELL_SIZES_M if size <= target]
+    return candidates[-1] if candidates else HEATMAP_CELL_SIZES_M[0]
+
+@instrument()
+@persistent_cache()
+def aggregate_heatmap_bins(gps_data, cell_size_m, weight_columns=('simulated_speed_kmh',)):
+    """Gom điểm GPS vào lưới ô vuông ``cell_size_m`` mét
+
+    Chạy vectorized trên pandas hoặc cuDF (cùng API). Mỗi ô có tâm
+    (longitude, latitude), ``count`` và với mỗi cột trọng số: tổng (``_sum``)
+    và trung bình (``_mean``). Kết quả luôn là pandas DataFrame.
+    """
+    cells = gps_data[['longitude', 'latitude', *weight_columns]].copy()
+    cells['ix'] = (cells['longitude'] * METERS_PER_DEG_LON // cell_size_m).astype('int64')
+    cells['iy'] = (cells['latitude'] * METERS_PER_DEG_LAT // cell_size_m).astype('int64')
+
+    aggregations = {'longitude': 'count'}
+    for column in weight_columns:
+        aggregations[column] = ['sum', 'mean']
+    bins = cells.groupby(['ix', 'iy']).agg(aggregations)
+    bins.columns = ['count'] + [f"{column}_{stat}" for column in weight_columns for stat in ('sum', 'mean')]
+    bins = bins.reset_index()
+    if hasattr(bins, 'to_pandas'):
+        bins = bins.to_pandas()
+
+    bins['longitude'] = (bins['ix'] + 0.5) * cell_size_m / METERS_PER_DEG_LON
+    bins['latitude'] = (bins['iy'] + 0.5) * cell_size_m / METERS_PER_DEG_LAT
+    return bins.drop(columns=['ix', 'iy'])
+
+def path_records(coords, offsets, path_key="path", **columns):
+    """Bản ghi JSON gọn cho PathLayer/PolygonLayer từ mảng tọa độ phẳng
+
+    ``coords`` là mảng (n, 2) các điểm nối tiếp nhau, đường thứ ``i`` là
+    ``coords[offsets[i]:offsets[i + 1]]``. st.pydeck_chart chỉ gửi được JSON
+    (pydeck đã tắt binary transport), nên tọa độ được làm tròn
+    ``COORD_DECIMALS`` chữ số và chuyển sang list trong một lần gọi cho toàn
+    bộ mảng; mỗi đường chỉ là một lát cắt của list đó.
+    """
+    flat = np.round(np.asarray(coords, dtype=np.float64), COORD_DECIMALS).reshape(-1, 2).tolist()
+    starts = np.asarray(offsets).tolist()
+    paths = [flat[start:stop] for start, stop in zip(starts[:-1], starts[1:])]
+    keys = [*columns, path_key]
+    values = [np.asarray(column).tolist() for column in columns.values()]
+    return [dict(zip(keys, row)) for row in zip(*values, paths)]
+
+def compact_point_frame(points, value_columns=()):
+    """Chỉ giữ các cột cần cho layer điểm, tọa độ làm tròn ``COORD_DECIMALS`` chữ số"""
+    frame = points[['longitude', 'latitude', *value_columns]].copy()
+    frame[['longitude', 'latitude']] = frame[['longitude', 'latitude']].round(COORD_DECIMALS)
+    for column in value_columns:
+        frame[column] = frame[column].round(2)
+    return frame
@@ -0,0 +1,170 @@
+"""Khối luồng OD (điểm đi, điểm đến, giờ trong ngày) có hướng, lưu thưa
+
+Vùng (zone) là quận (``level='district'``) hoặc ô lưới của đồ thị di chuyển
+(``level='node'``). Có hai loại luồng:
+
+- ``kind='trip'``: mỗi chuyến một luồng từ vùng của điểm đầu tới vùng của
+  điểm cuối, giờ là giờ bắt đầu chuyến (giống ``get_route_summary`` nhưng
+  có hướng và chia theo giờ);
+- ``kind='transition'``: mỗi lần hai điểm liên tiếp của một chuyến đổi vùng
+  là một luồng có hướng, giờ là giờ của điểm trước.
+
+Khối được tạo trong một lượt vectorized trên thứ tự chuyến dùng chung
+(``TripIndex``) và lưu dạng COO đã gộp, sắp theo (đi, giờ, đến) với offset
+theo vùng đi, cùng một hoán vị sắp theo (đến, giờ, đi). Truy vấn như "luồng
+đi ra từ Quận 1 từ 7 tới 9 giờ" chỉ cắt lát các mảng này, không quét lại dữ
+liệu điểm.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from modules.bus_route_analysis import create_point_in_polygon_index, find_districts_for_points
+from modules.graph_nodes import DEFAULT_CELL_SIZE_M, assign_grid_nodes
+from modules.instrumentation import instrument
+from modules.result_cache import persistent_cache
+from modules.trip_index import get_trip_index
+
+HOURS_PER_DAY = 24
+NS_PER_HOUR = 3_600_000_000_000
+
+def _hour_mask(hours, start, end):
+    """Giờ thuộc khoảng [start, end); start > end nghĩa là qua nửa đêm"""
+    if start <= end:
+        return (hours >= start) & (hours < end)
+    return (hours >= start) | (hours < end)
+
+class ODCube:
+    """Khối OD thưa: các mảng origin/destination (mã vùng), hour, flow"""
+
+    def __init__(self, zones, origin, destination, hour, flow, level, kind):
+        n = len(zones)
+        self.zones = zones
+        self.level = level
+        self.kind = kind
+        self._zone_codes = pd.Index(zones)
+        # Sắp theo (đi, giờ, đến); offset theo vùng đi
+        order = np.lexsort((destination, hour, origin))
+        self.origin = origin[order]
+        self.destination = destination[order]
+        self.hour = hour[order]
+        self.flow = flow[order]
+        self.origin_offsets = np.searchsorted(self.origin, np.arange(n + 1))
+        # Hoán vị theo (đến, giờ, đi) cho truy vấn luồng đi vào
+        self.by_destination = np.lexsort((self.origin, self.hour, self.destination))
+        self.destination_offsets = np.searchsorted(self.destination[self.by_destination], np.arange(n + 1))
+
+    @property
+    def total_flow(self):
+        return int(self.flow.sum())
+
+    def zone_code(self, zone):
+        """Mã vùng của nhãn ``zone`` (tên quận hoặc mã ô)"""
+        try:
+            return self._zone_codes.get_loc(zone)
+        except KeyError:
+            raise ValueError(f"Vùng '{zone}' không có trong khối OD") from None
+
+    def _frame(self, positions, hours):
+        if hours is not None:
+            positions = positions[_hour_mask(self.hour[positions], *hours)]
+        return pd.DataFrame({
+            'origin': self.zones[self.origin[positions]],
+            'destination': self.zones[self.destination[positions]],
+            'hour': self.hour[positions],
+            'flow': self.flow[positions],
+        })
+
+    def outflows(self, origin, hours=None):
+        """Luồng đi ra từ ``origin`` theo (đến, giờ); ``hours=(7, 9)`` là từ 7 giờ tới trước 9 giờ"""
+        code = self.zone_code(origin)
+        return self._frame(np.arange(self.origin_offsets[code], self.origin_offsets[code + 1]), hours)
+
+    def inflows(self, destination, hours=None):
+        """Luồng đi vào ``destination`` theo (đi, giờ)"""
+        code = self.zone_code(destination)
+        return self._frame(self.by_destination[self.destination_offsets[code]:self.destination_offsets[code + 1]], hours)
+
+    def flows(self, hours=None):
+        """Toàn bộ luồng (trong khoảng giờ nếu có)"""
+        return self._frame(np.arange(len(self.flow)), hours)
+
+    def matrix(self, hours=None):
+        """Ma trận OD thưa (vùng đi x vùng đến) đã cộng theo giờ"""
+        keep = slice(None) if hours is None else _hour_mask(self.hour, *hours)
+        n = len(self.zones)
+        return sp.csr_matrix((self.flow[keep], (self.origin[keep], self.destination[keep])), shape=(n, n))
+
+    def summary(self, hours=None, top_n=None):
+        """Luồng theo cặp (đi, đến) đã cộng theo giờ, sắp giảm dần"""
+        coo = self.matrix(hours).tocoo()
+        result = pd.DataFrame({
+            'origin': self.zones[coo.row],
+            'destination': self.zones[coo.col],
+            'flow': coo.data.astype(np.int64),
+        }).sort_values('flow', ascending=False, kind='stable', ignore_index=True)
+        return result if top_n is None else result.head(top_n)
+
+    def hourly_totals(self, zone=None, direction='out'):
+        """Tổng luồng theo từng giờ (của một vùng nếu có)"""
+        if zone is None:
+            hours, flow = self.hour, self.flow
+        else:
+            frame = self.outflows(zone) if direction == 'out' else self.inflows(zone)
+            hours, flow = frame['hour'].to_numpy(), frame['flow'].to_numpy()
+        return pd.Series(np.bincount(hours, weights=flow, minlength=HOURS_PER_DAY).astype(np.int64), name='flow')
+
+def _point_zones(gps_data, rows, level, districts, cell_size_m):
+    """Nhãn vùng của các dòng ``rows``"""
+    if level == 'district':
+        return find_districts_for_points(
+            gps_data['longitude'].to_numpy()[rows],
+            gps_data['latitude'].to_numpy()[rows],
+            create_point_in_polygon_index(districts),
+        )
+    if level == 'node':
+        return assign_grid_nodes(gps_data.iloc[rows] if len(rows) < len(gps_data) else gps_data, cell_size_m)
+    raise ValueError(f"Mức vùng '{level}' không hợp lệ, dùng 'district' hoặc 'node'")
+
+@instrument()
+@persistent_cache()
+def build_od_cube(gps_data, level='district', kind='trip', districts=None, cell_size_m=DEFAULT_CELL_SIZE_M):
+    """Tạo khối OD trong một lượt trên thứ tự chuyến
+
+    ``level='district'`` cần ``districts``; ``level='node'`` dùng ô lưới
+    ``cell_size_m`` mét (cùng mã nút với đồ thị di chuyển).
+    """
+    if level == 'district' and districts is None:
+        raise ValueError("Khối OD theo quận cần ranh giới quận (districts)")
+    trip_index = get_trip_index(gps_data)
+    ts_ns = gps_data['timestamp'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    point_hours = (ts_ns // NS_PER_HOUR) % HOURS_PER_DAY
+
+    if kind == 'trip':
+        # Chỉ cần tra vùng cho điểm đầu và điểm cuối của mỗi chuyến
+        n_trips = trip_index.n_trips
+        rows = np.concatenate((trip_index.first_rows, trip_index.last_rows))
+        zones, codes = np.unique(_point_zones(gps_data, rows, level, districts, cell_size_m), return_inverse=True)
+        origin, destination = codes[:n_trips], codes[n_trips:]
+        hour = point_hours[rows[:n_trips]]
+    elif kind == 'transition':
+        zones, codes = np.unique(_point_zones(gps_data, np.arange(len(gps_data)), level, districts, cell_size_m), return_inverse=True)
+        codes = trip_index.take(codes)
+        hours = trip_index.take(point_hours)
+        keep = trip_index.same_trip & (codes[:-1] != codes[1:])
+        origin, destination = codes[:-1][keep], codes[1:][keep]
+        hour = hours[:-1][keep]
+    else:
+        raise ValueError(f"Loại luồng '{kind}' không hợp lệ, dùng 'trip' hoặc 'transition'")
+
+    # Gộp các luồng trùng (đi, đến, giờ) bằng một khóa số nguyên
+    n = len(zones)
+    keys, flow = np.unique((origin.astype(np.int64) * n + destination) * HOURS_PER_DAY + hour, return_counts=True)
+    return ODCube(
+        zones,
+        (keys // HOURS_PER_DAY // n).astype(np.int32),
+        (keys // HOURS_PER_DAY % n).astype(np.int32),
+        (keys % HOURS_PER_DAY).astype(np.int8),
+        flow.astype(np.int64),
+        level,
+        kind,
+    )
@@ -0,0 +1,192 @@
+"""Cache kết quả phân tích trên đĩa, đánh địa chỉ theo nội dung đầu vào
+
+Khóa cache là hash của tên hàm, vân tay (fingerprint) các đầu vào và các tham
+số (``eps``, ``min_samples``...). Kết quả được pickle vào ``data/.cache/results``
+nên vẫn dùng được sau khi khởi động lại Streamlit; khi tổng dung lượng vượt
+``MAX_CACHE_BYTES`` thì các mục ít được dùng gần đây nhất bị xóa (LRU).
+Đặt ``GPS_RESULT_CACHE=0`` (hoặc dùng ``cache_disabled()``) để tắt cache.
+"""
+import contextlib
+import functools
+import hashlib
+import os
+import pickle
+import weakref
+
+import numpy as np
+import pandas as pd
+
+RESULT_CACHE_DIR = "data/.cache/results"
+MAX_CACHE_BYTES = 2 * 2**30
+# Tăng khi định dạng kết quả thay đổi để bỏ qua cache cũ
+CACHE_VERSION = 1
+
+_file_fingerprints = {}
+_object_fingerprints = {}
+_object_sources = {}
+
+def _cache_enabled():
+    return os.environ.get("GPS_RESULT_CACHE", "1") != "0"
+
+@contextlib.contextmanager
+def cache_disabled():
+    """Tắt cache trong khối ``with``: không đọc và không ghi mục nào (ví dụ khi benchmark)"""
+    previous = os.environ.get("GPS_RESULT_CACHE")
+    os.environ["GPS_RESULT_CACHE"] = "0"
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["GPS_RESULT_CACHE"]
+        else:
+            os.environ["GPS_RESULT_CACHE"] = previous
+
+def file_fingerprint(file_path):
+    """Hash nội dung file, chỉ tính lại khi kích thước hoặc mtime thay đổi"""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_fingerprints:
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _file_fingerprints[memo_key] = digest.hexdigest()
+    return _file_fingerprints[memo_key]
+
+def tag_fingerprint(obj, *parts):
+    """Gắn vân tay cho một đối tượng từ nguồn gốc của nó (file, tham số đọc)
+
+    Tránh phải hash lại cả DataFrame lớn ở mỗi lần rerun. Đối tượng được gắn
+    vân tay phải được coi là chỉ đọc.
+    """
+    fingerprint = hashlib.sha1(repr(parts).encode()).hexdigest()
+    _object_fingerprints[id(obj)] = (weakref.ref(obj), fingerprint)
+    return obj
+
+def tag_source(obj, key):
+    """Gắn khóa nguồn chuẩn cho một đối tượng (ví dụ ``file:<vân tay file>``)
+
+    Khác ``tag_fingerprint``, khóa nguồn không phụ thuộc tham số đọc như danh
+    sách cột, nên cùng một file đọc qua các đường khác nhau cho cùng khóa.
+    """
+    _object_sources[id(obj)] = (weakref.ref(obj), key)
+    return obj
+
+def tagged_source(obj):
+    """Khóa nguồn đã gắn bằng ``tag_source``, hoặc None nếu chưa gắn"""
+    tagged = _object_sources.get(id(obj))
+    if tagged is not None and tagged[0]() is obj:
+        return tagged[1]
+    return None
+
+def fingerprint(obj):
+    """Vân tay ổn định của một đầu vào: file, DataFrame, mảng, dict hoặc giá trị đơn"""
+    tagged = _object_fingerprints.get(id(obj))
+    if tagged is not None and tagged[0]() is obj:
+        return tagged[1]
+
+    digest = hashlib.sha1()
+    if isinstance(obj, str) and os.path.isfile(obj):
+        digest.update(b"file:" + file_fingerprint(obj).encode())
+    elif hasattr(obj, 'to_pandas') and not isinstance(obj, (pd.DataFrame, pd.Series)):
+        # cuDF: hash trên bản sao pandas
+        return fingerprint(obj.to_pandas())
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        if isinstance(obj, pd.DataFrame):
+            digest.update(b"frame:" + repr(list(obj.columns)).encode() + repr(list(obj.dtypes)).encode())
+        else:
+            digest.update(b"series:" + repr(obj.name).encode() + repr(obj.dtype).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        digest.update(f"array:{obj.dtype}:{obj.shape}".encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=repr):
+            digest.update(repr(key).encode() + fingerprint(obj[key]).encode())
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            digest.update(fingerprint(item).encode())
+    else:
+        digest.update(repr(obj).encode())
+    return digest.hexdigest()
+
+def _evict(cache_dir, max_bytes):
+    """Xóa các mục dùng lâu nhất cho tới khi tổng dung lượng <= max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".pkl"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def persistent_cache(exclude=(), cache_dir=RESULT_CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Decorator cache kết quả của hàm trên đĩa
+
+    ``exclude`` liệt kê các khóa bị bỏ khỏi kết quả dạng dict trước khi lưu
+    (ví dụ đối tượng đồ thị GPU không pickle được); các khóa này bị bỏ cả khi
+    cache hit lẫn miss để kết quả luôn nhất quán.
+    """
+    def decorator(fn):
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _cache_enabled():
+                return _strip(fn(*args, **kwargs), exclude)
+            key = hashlib.sha1("|".join(
+                [name, str(CACHE_VERSION)]
+                + [fingerprint(arg) for arg in args]
+                + [f"{k}={fingerprint(kwargs[k])}" for k in sorted(kwargs)]
+            ).encode()).hexdigest()
+            path = os.path.join(cache_dir, f"{key}.pkl")
+
+            try:
+                with open(path, "rb") as f:
+                    result = pickle.load(f)
+                # Cập nhật mtime để đánh dấu mục vừa được dùng (LRU)
+                os.utime(path)
+                return result
+            except FileNotFoundError:
+                pass
+            except Exception:
+                # Mục hỏng hoặc pickle từ phiên bản code cũ (lớp/module đã đổi):
+                # coi như chưa có, xóa đi và tính lại
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            result = _strip(fn(*args, **kwargs), exclude)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            _evict(cache_dir, max_bytes)
+            return result
+        return wrapper
+    return decorator
+
+def _strip(result, exclude):
+    if exclude and isinstance(result, dict):
+        return {k: v for k, v in result.items() if k not in exclude}
+    return result
+
+def clear_cache(cache_dir=RESULT_CACHE_DIR):
+    """Xóa toàn bộ cache kết quả"""
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
@@ -0,0 +1,161 @@
+"""Tính chỉ số chuyến đi tăng dần khi dữ liệu GPS được tải lên theo từng đợt
+
+Mỗi chuyến chỉ giữ điểm cuối, quãng đường cộng dồn, thời điểm đầu/áp chót/
+cuối và số điểm, nên ``update(batch)`` chỉ chạm vào các chuyến có trong đợt.
+Điểm đến trễ được chấp nhận nếu không cũ hơn ``lateness`` so với thời điểm
+lớn nhất đã thấy (watermark): các điểm mới hơn ``watermark - lateness`` được
+giữ ở hàng chờ và chỉ được cộng vào trạng thái khi đã qua mốc đó.
+"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from modules.gps_analysis import TRIP_METRICS_COLUMNS, _format_trip_metrics, _trip_fragments, haversine_vectorized
+from modules.instrumentation import instrument
+
+DEFAULT_LATENESS = pd.Timedelta(minutes=10)
+SNAPSHOT_VERSION = 1
+
+# Vị trí các trường trong trạng thái của một chuyến
+FIRST_NS, PREV_NS, LAST_NS, LAST_LAT, LAST_LON, DISTANCE, N_ROWS = range(7)
+
+def _apply_fragments(trips, fragments, target=None):
+    """Nối các mảnh chuyến (đã sắp theo thời gian) vào sau trạng thái ``trips``
+
+    Kết quả ghi vào ``target`` (mặc định chính ``trips``); truyền một dict
+    rỗng để tính thử mà không thay đổi trạng thái.
+    """
+    if target is None:
+        target = trips
+    ids = fragments['trip_id'].to_numpy()
+    first_ns = fragments['first_ts'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    prev_ns = fragments['prev_ts'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    last_ns = fragments['last_ts'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    first_lat = fragments['first_lat'].to_numpy()
+    first_lon = fragments['first_lon'].to_numpy()
+    last_lat = fragments['last_lat'].to_numpy()
+    last_lon = fragments['last_lon'].to_numpy()
+    distance = fragments['distance'].to_numpy()
+    n_rows = fragments['n_rows'].to_numpy()
+
+    known = [trips.get(trip_id) for trip_id in ids.tolist()]
+    # Đoạn nối điểm cuối đã lưu với điểm đầu của mảnh (NaN với chuyến mới)
+    prev_lat = np.array([np.nan if state is None else state[LAST_LAT] for state in known])
+    prev_lon = np.array([np.nan if state is None else state[LAST_LON] for state in known])
+    gap = haversine_vectorized(prev_lat, prev_lon, first_lat, first_lon) if len(ids) else np.empty(0)
+
+    for i, trip_id in enumerate(ids.tolist()):
+        state = known[i]
+        if state is None:
+            target[trip_id] = [
+                int(first_ns[i]), int(prev_ns[i]), int(last_ns[i]),
+                float(last_lat[i]), float(last_lon[i]), float(distance[i]), int(n_rows[i]),
+            ]
+        else:
+            target[trip_id] = [
+                state[FIRST_NS],
+                # Mảnh một điểm: đoạn cuối bắt đầu từ điểm cuối đã lưu
+                int(prev_ns[i]) if n_rows[i] >= 2 else state[LAST_NS],
+                int(last_ns[i]),
+                float(last_lat[i]), float(last_lon[i]),
+                state[DISTANCE] + float(gap[i]) + float(distance[i]),
+                state[N_ROWS] + int(n_rows[i]),
+            ]
+    return target
+
+class TripMetricsAccumulator:
+    """Trạng thái chỉ số chuyến đi được cập nhật theo từng đợt dữ liệu GPS"""
+
+    def __init__(self, lateness=DEFAULT_LATENESS):
+        self.lateness = pd.Timedelta(lateness)
+        self.watermark = None
+        self.trips = {}
+        self.pending = pd.DataFrame({
+            'trip_id': pd.Series(dtype=np.int64),
+            'timestamp': pd.Series(dtype='datetime64[ns]'),
+            'latitude': pd.Series(dtype=np.float64),
+            'longitude': pd.Series(dtype=np.float64),
+        })
+        # Số điểm bị bỏ vì đến trễ hơn ``lateness``
+        self.late_rows = 0
+
+    @property
+    def horizon(self):
+        """Mốc thời gian đã chốt: điểm cũ hơn mốc này bị coi là quá trễ"""
+        return None if self.watermark is None else self.watermark - self.lateness
+
+    @instrument()
+    def update(self, batch):
+        """Thêm một đợt điểm GPS; trả về số điểm được chấp nhận"""
+        batch = batch[TRIP_METRICS_COLUMNS].copy()
+        batch['timestamp'] = pd.to_datetime(batch['timestamp']).astype('datetime64[ns]')
+        if self.horizon is not None:
+            late = (batch['timestamp'] < self.horizon).to_numpy()
+            self.late_rows += int(late.sum())
+            batch = batch[~late]
+        if batch.empty:
+            return 0
+
+        batch_max = batch['timestamp'].max()
+        if self.watermark is None or batch_max > self.watermark:
+            self.watermark = batch_max
+        pending = pd.concat([self.pending, batch], ignore_index=True)
+
+        # Cộng các điểm đã qua mốc vào trạng thái; phần còn lại tiếp tục chờ
+        ready = (pending['timestamp'] <= self.horizon).to_numpy()
+        if ready.any():
+            _apply_fragments(self.trips, _trip_fragments(pending[ready]))
+        self.pending = pending[~ready].reset_index(drop=True)
+        return len(batch)
+
+    @instrument()
+    def metrics(self):
+        """Chỉ số hiện tại của mọi chuyến (tính cả các điểm còn trong hàng chờ)
+
+        Cùng cột và cách tính với ``calculate_trip_metrics_pandas``.
+        """
+        trips = self.trips
+        if not self.pending.empty:
+            trips = {**trips, **_apply_fragments(trips, _trip_fragments(self.pending), {})}
+        # Giống bản trong bộ nhớ: chuyến chỉ có một điểm không có đoạn nào
+        trip_ids = [trip_id for trip_id in sorted(trips) if trips[trip_id][N_ROWS] >= 2]
+        states = [trips[trip_id] for trip_id in trip_ids]
+        first_ns = np.array([state[FIRST_NS] for state in states], dtype=np.int64)
+        prev_ns = np.array([state[PREV_NS] for state in states], dtype=np.int64)
+        return _format_trip_metrics(
+            np.array(trip_ids, dtype=np.int64),
+            np.array([state[DISTANCE] for state in states], dtype=np.float64),
+            (prev_ns - first_ns) / 3.6e12
+        )
+
+    def snapshot(self, path):
+        """Ghi trạng thái ra đĩa (ghi file tạm rồi đổi tên)"""
+        state = {
+            'version': SNAPSHOT_VERSION,
+            'lateness': self.lateness,
+            'watermark': self.watermark,
+            'trips': self.trips,
+            'pending': self.pending,
+            'late_rows': self.late_rows,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def restore(cls, path):
+        """Đọc lại trạng thái đã ghi bằng ``snapshot``"""
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot '{path}' có phiên bản {state.get('version')}, cần {SNAPSHOT_VERSION}")
+        accumulator = cls(state['lateness'])
+        accumulator.watermark = state['watermark']
+        accumulator.trips = state['trips']
+        accumulator.pending = state['pending']
+        accumulator.late_rows = state['late_rows']
+        return accumulator
@@ -0,0 +1,110 @@
+"""Chỉ mục chuyến đi dùng chung cho mọi module
+
+``TripIndex`` lưu một hoán vị sắp dữ liệu theo (trip_id, timestamp) và các
+offset kiểu CSR: các dòng của chuyến thứ ``i`` là
+``order[offsets[i]:offsets[i + 1]]`` theo thứ tự thời gian. Dữ liệu đã sắp
+sẵn (ví dụ file ghi theo chuyến) chỉ được kiểm tra một lần và không phải sắp
+lại. ``get_trip_index`` nhớ chỉ mục theo từng DataFrame nên đường đi trên bản
+đồ, cạnh đồ thị và điểm đầu/cuối tuyến dùng chung một lần sắp xếp.
+"""
+import weakref
+
+import numpy as np
+
+_trip_indexes = {}
+
+class TripIndex:
+    """Hoán vị đã sắp theo (trip_id, timestamp) và offset của từng chuyến"""
+
+    def __init__(self, trip_ids, timestamps):
+        trip_ids = np.asarray(trip_ids)
+        ts_ns = np.asarray(timestamps).astype('datetime64[ns]').view(np.int64)
+        self.n_rows = len(trip_ids)
+
+        # Kiểm tra thứ tự một lần; nếu đã sắp thì không cần hoán vị
+        same_trip = trip_ids[1:] == trip_ids[:-1]
+        self.is_sorted = bool(
+            np.all(trip_ids[1:] >= trip_ids[:-1])
+            and np.all(ts_ns[1:][same_trip] >= ts_ns[:-1][same_trip])
+        )
+        if self.is_sorted:
+            self.order = None
+        else:
+            self.order = np.lexsort((ts_ns, trip_ids))
+            trip_ids = trip_ids[self.order]
+            same_trip = trip_ids[1:] == trip_ids[:-1]
+
+        starts = np.flatnonzero(np.concatenate(([True], ~same_trip))) if self.n_rows else np.empty(0, dtype=np.int64)
+        self.offsets = np.append(starts, self.n_rows)
+        self.trip_ids = trip_ids[starts]
+        # same_trip[k]: điểm k và k + 1 (theo thứ tự đã sắp) thuộc cùng chuyến
+        self.same_trip = same_trip
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Tạo chỉ mục từ DataFrame pandas/cuDF có cột trip_id và timestamp"""
+        return cls(_to_numpy(frame['trip_id']), _to_numpy(frame['timestamp']))
+
+    @property
+    def n_trips(self):
+        return len(self.trip_ids)
+
+    @property
+    def lengths(self):
+        """Số điểm của từng chuyến"""
+        return np.diff(self.offsets)
+
+    @property
+    def first_rows(self):
+        """Vị trí (theo dữ liệu gốc) của điểm đầu tiên mỗi chuyến"""
+        return self.rows(self.offsets[:-1])
+
+    @property
+    def last_rows(self):
+        """Vị trí (theo dữ liệu gốc) của điểm cuối cùng mỗi chuyến"""
+        return self.rows(self.offsets[1:] - 1)
+
+    def rows(self, sorted_positions):
+        """Đổi vị trí trong thứ tự đã sắp sang vị trí trong dữ liệu gốc"""
+        if self.order is None:
+            return np.asarray(sorted_positions)
+        return self.order[sorted_positions]
+
+    def trip_rows(self, i):
+        """Vị trí các dòng của chuyến thứ ``i`` theo thứ tự thời gian"""
+        return self.rows(np.arange(self.offsets[i], self.offsets[i + 1]))
+
+    def take(self, values):
+        """Sắp một mảng cột của dữ liệu gốc theo thứ tự của chỉ mục"""
+        values = _to_numpy(values)
+        return values if self.order is None else values[self.order]
+
+    def column(self, frame, name, dtype=None):
+        """Cột ``name`` của ``frame`` theo thứ tự đã sắp"""
+        values = _to_numpy(frame[name])
+        if dtype is not None:
+            values = values.astype(dtype, copy=False)
+        return self.take(values)
+
+def _to_numpy(values):
+    if hasattr(values, 'to_numpy'):
+        return values.to_numpy()
+    return np.asarray(values)
+
+def get_trip_index(frame):
+    """Chỉ mục chuyến đi của ``frame``, chỉ tạo một lần cho mỗi DataFrame
+
+    Chỉ mục được nhớ theo đối tượng và tự bỏ khi DataFrame bị giải phóng;
+    DataFrame phải được coi là chỉ đọc ở các cột trip_id/timestamp.
+    """
+    key = id(frame)
+    cached = _trip_indexes.get(key)
+    if cached is not None and cached[0]() is frame and cached[1].n_rows == len(frame):
+        return cached[1]
+    index = TripIndex.from_frame(frame)
+    try:
+        ref = weakref.ref(frame, lambda _, key=key: _trip_indexes.pop(key, None))
+    except TypeError:
+        return index
+    _trip_indexes[key] = (ref, index)
+    return index